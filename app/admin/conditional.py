@@ -0,0 +1,68 @@
+"""
+条件请求 (ETag / If-None-Match)
+
+ETag 由数据版本 (data_versions 修改计数、行情快照版本) 和影响响应内容的参数生成，
+不需要先查询和渲染就能判断客户端的缓存是否仍然有效；命中时返回不带正文的 304。
+Cache-Control: no-cache 让浏览器每次都带 If-None-Match 重新验证，数据一变立刻拿到新内容。
+
+同一个 ETag 同时用于 gzip 和未压缩的响应，按 RFC 9110 只能是弱校验值 (W/"...")。
+"""
+import hashlib
+import os
+from typing import Any, Dict, Iterable
+
+from fastapi import Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+
+CACHE_CONTROL = "private, no-cache"
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+
+def _template_version() -> str:
+    """模板文件的修改时间摘要：发版更新模板后 HTML 页面的 ETag 随之变化"""
+    mtimes = [(name, os.stat(os.path.join(TEMPLATE_DIR, name)).st_mtime_ns)
+              for name in sorted(os.listdir(TEMPLATE_DIR))]
+    return hashlib.sha1(repr(mtimes).encode("utf-8")).hexdigest()[:12]
+
+
+TEMPLATE_VERSION = _template_version()
+
+
+def make_etag(*parts: Any) -> str:
+    """弱 ETag：parts 需包含决定响应内容的全部数据版本和参数"""
+    return 'W/"' + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否命中 (按 RFC 9110 做弱比较，忽略 W/ 前缀)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+class PathExcludingGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware，exclude_paths 中的路径 (如 SSE) 原样透传，不依赖 Starlette 版本的 Content-Type 排除"""
+
+    def __init__(self, app, exclude_paths: Iterable[str] = (), **kwargs):
+        super().__init__(app, **kwargs)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
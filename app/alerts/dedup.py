@@ -1,14 +1,58 @@
-from datetime import datetime, date
-from typing import Set, Dict
+"""
+报警去重
+
+同一周期 (日 / ISO 周) 内同一规则 (+ 持仓) 只发送一次。去重键持久化在 alert_dedup_keys 表中，
+(period_key, rule_key) 唯一，重启或换主后已发送的报警不会再发：
+
+- 前置缓存: 每个进程按周期缓存已知的键 (set)，周期内首次访问时一次查询载入该周期的全部键；
+  命中缓存直接返回，不访问数据库
+- 认领: 缓存未命中时 INSERT OR IGNORE，插入成功的进程负责发送；多个进程同时认领时由唯一索引裁决
+- 过期: 键保留到周期结束后的下一个交易日 (按 NYSE 日历)，由每日清理任务删除
+- 数据库不可用时退化为进程内去重 (宁可重复发送，也不漏发)
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Set
+
 from pytz import timezone
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.init_db import engine, read_engine
+from app.database.models import AlertDedupKey
+
+logger = logging.getLogger(__name__)
 
 et_tz = timezone("America/New_York")
 
+# 认领语句只构造一次 (每次构造 ORM insert 的开销比 SQLite 插入本身还大)
+_CLAIM_STMT = (
+    sqlite_insert(AlertDedupKey.__table__)
+    .values(period_key=bindparam("period_key"), rule_key=bindparam("rule_key"),
+            expires_on=bindparam("expires_on"))
+    .on_conflict_do_nothing(index_elements=["period_key", "rule_key"])
+)
+
+
+def next_trading_day(day: date) -> date:
+    """day 之后的第一个 NYSE 交易日"""
+    from app.scheduler.trading_hours import trading_sessions
+
+    sessions = trading_sessions(day + timedelta(days=1), day + timedelta(days=14))
+    if len(sessions):
+        return sessions[0].item()
+    return day + timedelta(days=1)
+
 
 class AlertDeduplicator:
-    def __init__(self):
+    def __init__(self, persistent: bool = True):
+        self.persistent = persistent
+        # {period_key: 已发送的 rule_key}，只保留当前的日 / 周两个周期
         self.daily_rules: Dict[str, Set[str]] = {}
         self.weekly_rules: Dict[str, Set[str]] = {}
+        # 各组合的持仓在不同线程中检查
+        self._lock = threading.Lock()
 
     def get_today_key(self) -> str:
         return datetime.now(et_tz).strftime("%Y-%m-%d")
@@ -24,47 +68,84 @@ class AlertDeduplicator:
         return rule_name
 
     def should_alert(self, rule_name: str, position_id: int = None) -> bool:
-        today = self.get_today_key()
-
-        if today not in self.daily_rules:
-            self.daily_rules[today] = set()
-
-        rule_key = self._get_rule_key(rule_name, position_id)
-
-        if rule_key in self.daily_rules[today]:
-            return False
-
-        self.daily_rules[today].add(rule_key)
-        return True
+        today = datetime.now(et_tz).date()
+        with self._lock:
+            return self._check_and_mark(self.daily_rules, today.isoformat(), rule_name, position_id,
+                                        expires_on=lambda: next_trading_day(today))
 
     def should_alert_weekly(self, rule_name: str, position_id: int = None) -> bool:
-        week_key = self.get_iso_week_key()
-
-        if week_key not in self.weekly_rules:
-            self.weekly_rules[week_key] = set()
+        today = datetime.now(et_tz).date()
+        with self._lock:
+            return self._check_and_mark(self.weekly_rules, self.get_iso_week_key(), rule_name, position_id,
+                                        expires_on=lambda: next_trading_day(today + timedelta(days=6 - today.weekday())))
+
+    def _check_and_mark(self, rules: Dict[str, Set[str]], period_key: str, rule_name: str,
+                        position_id: int = None, expires_on=None) -> bool:
+        sent = rules.get(period_key)
+        if sent is None:
+            # 进入新周期：丢弃上一周期的缓存，载入本周期已持久化的键
+            rules.clear()
+            sent = rules[period_key] = self._load_period(period_key)
 
         rule_key = self._get_rule_key(rule_name, position_id)
-
-        if rule_key in self.weekly_rules[week_key]:
+        if rule_key in sent:
             return False
-
-        self.weekly_rules[week_key].add(rule_key)
-        return True
-
-    def reset_daily(self):
-        today = self.get_today_key()
-        old_days = [day for day in self.daily_rules.keys() if day != today]
-        for old_day in old_days:
-            del self.daily_rules[old_day]
-
-        week_key = self.get_iso_week_key()
-        old_weeks = [w for w in self.weekly_rules.keys() if w != week_key]
-        for old_week in old_weeks:
-            del self.weekly_rules[old_week]
+        sent.add(rule_key)
+        return self._claim(period_key, rule_key, expires_on)
+
+    def _load_period(self, period_key: str) -> Set[str]:
+        if not self.persistent:
+            return set()
+        try:
+            with read_engine.connect() as conn:
+                return set(conn.execute(
+                    select(AlertDedupKey.rule_key).where(AlertDedupKey.period_key == period_key)
+                ).scalars())
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to load dedup keys for {period_key}, using in-memory dedup: {e}")
+            return set()
+
+    def _claim(self, period_key: str, rule_key: str, expires_on) -> bool:
+        """插入去重键；返回 False 表示其他进程已认领"""
+        if not self.persistent:
+            return True
+        try:
+            # 每次认领从写连接池取一个连接，用完即归还 (不长期占用池中的连接)
+            with engine.begin() as conn:
+                result = conn.execute(_CLAIM_STMT, {
+                    "period_key": period_key,
+                    "rule_key": rule_key,
+                    "expires_on": expires_on() if expires_on else date.today(),
+                })
+            return result.rowcount == 1
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to persist dedup key {period_key}/{rule_key}: {e}")
+            return True
+
+    def reset_daily(self, today: Optional[date] = None) -> int:
+        """丢弃过期周期的缓存，删除已过期的持久化键，返回删除行数"""
+        today = today or datetime.now(et_tz).date()
+        with self._lock:
+            for rules, current in ((self.daily_rules, today.isoformat()), (self.weekly_rules, self.get_iso_week_key())):
+                for period_key in [key for key in rules if key != current]:
+                    del rules[period_key]
+
+        if not self.persistent:
+            return 0
+        try:
+            with engine.begin() as conn:
+                return conn.execute(delete(AlertDedupKey).where(AlertDedupKey.expires_on < today)).rowcount
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to purge expired dedup keys: {e}")
+            return 0
 
     def clear(self):
-        self.daily_rules.clear()
-        self.weekly_rules.clear()
+        with self._lock:
+            self.daily_rules.clear()
+            self.weekly_rules.clear()
+        if self.persistent:
+            with engine.begin() as conn:
+                conn.execute(delete(AlertDedupKey))
 
 
 _deduplicator = AlertDeduplicator()
@@ -77,8 +158,8 @@ def should_alert_weekly(rule_name: str, position_id: int = None) -> bool:
     return _deduplicator.should_alert_weekly(rule_name, position_id)
 
 
-def reset_daily_dedup():
-    _deduplicator.reset_daily()
+def reset_daily_dedup() -> int:
+    return _deduplicator.reset_daily()
 
 
 def clear_dedup():
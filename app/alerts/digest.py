@@ -0,0 +1,64 @@
+"""
+每周期报警汇总
+
+大盘类规则 (如 QQQ SMA200 趋势止损) 会在同一周期内对所有持仓同时触发。规则评估和通知之间加一层汇总:
+同一组合、同一周期内按规则分组，命中多个持仓的规则合并成一条汇总报警 (一条消息、一条报警日志，
+受影响的持仓写入 alert_log_positions)；只命中一个持仓的规则照常单独发送。
+
+按持仓计算的规则 (时间止损、阶梯止盈) 的 message / trigger_condition 含各持仓自己的 DTE、持仓时长和阈值，
+汇总时这些字段保留在每个持仓条目中；所有持仓文本相同 (如 SMA200 趋势止损) 时才提到汇总报警顶层。
+
+每周期的外发请求和日志写入从 O(持仓数) 降为 O(规则数)。
+"""
+from typing import Any, Dict, List, Tuple
+
+
+class AlertDigest:
+    def __init__(self):
+        # (alert_type, rule_name) -> 已通过去重的持仓报警，按首次触发顺序
+        self._groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+
+    def add(self, alert: Dict[str, Any]):
+        key = (alert.get("alert_type", ""), alert.get("rule_name", ""))
+        self._groups.setdefault(key, []).append(alert)
+
+    def __len__(self) -> int:
+        return sum(len(alerts) for alerts in self._groups.values())
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """取出本周期的报警：单个持仓的原样返回，多个持仓的合并为一条汇总报警"""
+        groups, self._groups = self._groups, {}
+        return [alerts[0] if len(alerts) == 1 else merge(alerts) for alerts in groups.values()]
+
+
+def merge(alerts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """同一规则的多条持仓报警合并为一条 (digest=True)，按持仓盈亏从低到高列出"""
+    first = alerts[0]
+    shared = all(alert.get("message") == first.get("message")
+                 and alert.get("trigger_condition") == first.get("trigger_condition") for alert in alerts)
+    positions = sorted((
+        {
+            "position_id": alert["position_id"],
+            "position_ticker": alert.get("position_ticker", ""),
+            "option_symbol": alert.get("option_symbol", ""),
+            "entry_price": alert.get("entry_price"),
+            "current_price": alert.get("current_price"),
+            "pnl_pct": alert.get("pnl_pct"),
+            "dte": alert.get("dte"),
+            "message": alert.get("message", ""),
+            "trigger_condition": alert.get("trigger_condition", ""),
+        } for alert in alerts
+    ), key=lambda position: position["pnl_pct"] if position["pnl_pct"] is not None else 0.0)
+
+    return {
+        "rule_name": first.get("rule_name", ""),
+        "message": first.get("message", "") if shared else "",
+        "severity": first.get("severity"),
+        "trigger_condition": first.get("trigger_condition", "") if shared else "",
+        "alert_type": first.get("alert_type", ""),
+        "portfolio_id": first.get("portfolio_id"),
+        "timestamp": first.get("timestamp"),
+        "digest": True,
+        "position_ids": [position["position_id"] for position in positions],
+        "positions": positions,
+    }
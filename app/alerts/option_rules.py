@@ -7,9 +7,12 @@ et_tz = timezone("America/New_York")
 logger = logging.getLogger(__name__)
 
 
-def check_position_signals(position, current_opt_price: float, qqq_indicators: Dict, config=None) -> Dict[str, Any]:
+def check_position_signals(position, current_opt_price: float, qqq_indicators: Dict, config=None,
+                           trend_symbol: Optional[str] = None) -> Dict[str, Any]:
     """
     重构后的期权出场/风控规则 - 长期复利引擎
+
+    qqq_indicators 为趋势止损参照标的的指标，trend_symbol 为该标的 (默认持仓标的)
     """
     alerts = []
     
@@ -41,29 +44,36 @@ def check_position_signals(position, current_opt_price: float, qqq_indicators: D
         logger.error(f"Error preparing data for position {position.id}: {e}")
         return {'alerts': [], 'new_max_profit': 0.0}
 
-    # === 新增：QQQ SMA200 连续3天跌破 止损 ===
+    # 规则开关 (组合级配置可覆盖全局)；未传 config 时全部启用
+    trend_stop_enabled = config.is_exit_trend_stop_enabled() if config else True
+    time_stop_enabled = config.is_exit_dte_force_enabled() if config else True
+    take_profit_enabled = config.is_exit_hard_tp_enabled() if config else True
+
+    # === 新增：标的 SMA200 连续3天跌破 止损 ===
+    trend_symbol = (trend_symbol or getattr(position, "underlying", None) or "QQQ").upper()
     is_below_sma200_3d = qqq_indicators.get("is_below_sma200_3d", False)
-    if is_below_sma200_3d:
+    if is_below_sma200_3d and trend_stop_enabled:
         alerts.append({
-            "rule_name": "QQQ SMA200 Stop Loss",
-            "message": f"🚨 [风控平仓] QQQ 连续 3 天跌破 SMA200，触发大盘趋势止损",
+            "rule_name": f"{trend_symbol} SMA200 Stop Loss",
+            "message": f"🚨 [风控平仓] {trend_symbol} 连续 3 天跌破 SMA200，触发趋势止损",
             "severity": "CRITICAL",
-            "trigger_condition": f"QQQ < SMA200 for 3 days",
+            "trigger_condition": f"{trend_symbol} < SMA200 for 3 days",
             "alert_type": "OPTION_STOP_LOSS"
         })
 
     # 4. 强制止损/时间风控 (Hard Stop)
     # 当期权合约距离到期日仅剩不足 3 个月 (90天) 时，无论盈亏状态如何，必须强制平仓
     if dte <= 90:
-        alerts.append({
-            "rule_name": "Time Stop (90 DTE)",
-            "message": f"⛔ [强制平仓] 距离到期日仅剩 {dte} 天 (<=90天)，触发时间风控",
-            "severity": "CRITICAL",
-            "trigger_condition": f"DTE {dte} <= 90",
-            "alert_type": "OPTION_TIME",
-            "dte": dte,
-            "expiration_date": expiration_date.strftime("%Y-%m-%d")
-        })
+        if time_stop_enabled:
+            alerts.append({
+                "rule_name": "Time Stop (90 DTE)",
+                "message": f"⛔ [强制平仓] 距离到期日仅剩 {dte} 天 (<=90天)，触发时间风控",
+                "severity": "CRITICAL",
+                "trigger_condition": f"DTE {dte} <= 90",
+                "alert_type": "OPTION_TIME",
+                "dte": dte,
+                "expiration_date": expiration_date.strftime("%Y-%m-%d")
+            })
     else:
         # 计算精确自然月
         months_held = (today.year - entry_date.year) * 12 + today.month - entry_date.month
@@ -87,7 +97,7 @@ def check_position_signals(position, current_opt_price: float, qqq_indicators: D
             tp_threshold = 0.10  # 10%
             duration_desc = "9个月及以上"
             
-        if tp_threshold is not None and pnl_pct >= tp_threshold:
+        if take_profit_enabled and tp_threshold is not None and pnl_pct >= tp_threshold:
             alerts.append({
                 "rule_name": "Tiered Take Profit",
                 "message": f"🎯 [阶梯止盈] 持仓 {duration_desc}，收益达标 ({tp_threshold*100:.0f}%)",
@@ -125,3 +135,17 @@ def format_position_ticker(position) -> str:
         return f"{position.underlying}{exp_date}{option_type}{strike}"
     except Exception:
         return f"{position.underlying}-OPT"
+
+
+def format_option_symbol(position) -> str:
+    """OCC 期权代码 (QQQ270115C00610000)，写入提醒日志便于按合约检索"""
+    try:
+        exp_date_obj = position.expiration_date
+        if isinstance(exp_date_obj, str):
+            exp_date_obj = date.fromisoformat(exp_date_obj)
+
+        option_type = "C" if position.option_type.upper() == "CALL" else "P"
+        strike = int(round(position.strike_price * 1000))
+        return f"{position.underlying}{exp_date_obj.strftime('%y%m%d')}{option_type}{strike:08d}"
+    except Exception:
+        return f"{position.underlying}-OPT"
@@ -4,9 +4,9 @@ from pytz import timezone
 
 et_tz = timezone("America/New_York")
 
-def check_entry_signals(current_price: float, indicators: Dict, config) -> List[Dict]:
+def check_entry_signals(current_price: float, indicators: Dict, config, symbol: str = "QQQ") -> List[Dict]:
     """
-    重构后的 QQQ 长期复利引擎入场规则
+    重构后的长期复利引擎入场规则 (与标的无关，指标来自 app.market.indicators)
     """
     alerts = []
     
@@ -23,10 +23,12 @@ def check_entry_signals(current_price: float, indicators: Dict, config) -> List[
     if rsi < 35 and is_above_sma200_3d and (price_1y_ago is not None and current_price > price_1y_ago):
         alerts.append({
             "rule_name": "RSI Oversold + SMA200 Trend Entry",
-            "message": f"🚨 [入场机会] RSI跌破35 ({rsi:.1f})，且连续3天站上SMA200，且现价({current_price:.2f})高于1年前({price_1y_ago:.2f})",
-            "trigger_condition": f"RSI < 35 AND QQQ > SMA200(3d) AND Price > 1y_ago",
+            "message": f"🚨 [{symbol} 入场机会] RSI跌破35 ({rsi:.1f})，且连续3天站上SMA200，且现价({current_price:.2f})高于1年前({price_1y_ago:.2f})",
+            "trigger_condition": f"RSI < 35 AND {symbol} > SMA200(3d) AND Price > 1y_ago",
             "severity": "CRITICAL",
+            # 报警类型固定 (后台筛选、去重、汇总按类型分组)，标的见 symbol 字段
             "alert_type": "QQQ_ENTRY",
+            "symbol": symbol,
             "current_price": current_price,
             "drop_percent": 0.0,
             "delta_recommendation": {
@@ -53,3 +55,15 @@ def check_all_qqq_rules(qqq_data: Dict, config) -> List[Dict]:
         return []
 
     return check_entry_signals(current_price, qqq_data, config)
+
+
+def check_watchlist_rules(market_data: Dict[str, Dict], config) -> List[Dict]:
+    """
+    Main entry point for watchlist checks: {symbol: indicators} -> 所有标的的入场信号
+    """
+    alerts = []
+    for symbol, indicators in market_data.items():
+        current_price = indicators.get("last_price")
+        if current_price:
+            alerts.extend(check_entry_signals(current_price, indicators, config, symbol))
+    return alerts
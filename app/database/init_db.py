@@ -1,26 +1,275 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+import logging
 import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境只跑单 worker
+    fcntl = None
 
 from .models import Base
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data", "qqq_alert.db")
+DATABASE_PATH = os.getenv(
+    "DATABASE_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "qqq_alert.db")
+)
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
+# SQLite 连接调优 (每个连接建立时执行)
+# - WAL: 读写互不阻塞，读连接看到的是最近一次提交的快照
+# - synchronous=NORMAL: WAL 模式下只在 checkpoint 时 fsync，掉电最多丢最后一个事务
+# - cache_size 为负数时单位是 KiB；mmap 让读直接走页缓存
+SQLITE_BUSY_TIMEOUT_MS = 30000
+SQLITE_CACHE_SIZE_KB = 8192
+SQLITE_MMAP_SIZE = 128 * 1024 * 1024
+
+# 写连接：调度任务和管理后台的写操作 (SQLite 同时只有一个写事务，其余在 busy_timeout 内排队)
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    pool_size=4,
+    max_overflow=4,
+    pool_pre_ping=True
+)
+
+# 读连接：Dashboard / 列表页 / 健康检查，只读，永远不会等待调度任务的写事务
+read_engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    pool_size=8,
+    max_overflow=8,
     pool_pre_ping=True
 )
 
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine, "connect")
+def _on_write_connect(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection, read_only=False)
+
+
+@event.listens_for(read_engine, "connect")
+def _on_read_connect(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection, read_only=True)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _commit_finished(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        metrics.db_commit_duration.observe(time.perf_counter() - started)
+
+
+@contextmanager
+def init_lock():
+    """
+    多个 worker 同时启动时串行执行建表、迁移和默认数据初始化 (数据库旁的锁文件 + flock)
+
+    ALTER TABLE / VACUUM 和 "不存在则插入" 的初始化并发执行会互相冲突。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(DATABASE_PATH)), exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(f"{DATABASE_PATH}.init.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 
 def init_db():
-    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+    """建表和迁移；多 worker 部署时调用方需持有 init_lock()"""
+    os.makedirs(os.path.dirname(os.path.abspath(DATABASE_PATH)), exist_ok=True)
+    _enable_incremental_vacuum()
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+    # create_all 不会给已存在的表补建新索引
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    _init_alert_log_search()
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(ALERT_LOG_POSITIONS_TRIGGER)
+        for ddl in DATA_VERSION_TRIGGERS:
+            conn.exec_driver_sql(ddl)
+
+
+def _enable_incremental_vacuum():
+    """
+    一次性迁移：auto_vacuum 切换为 INCREMENTAL，清理任务删除数据后可以分步归还空闲页
+
+    已有表的库需要一次完整 VACUUM 才能生效 (耗时与库大小成正比，只在首次升级时发生)。
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        has_tables = conn.exec_driver_sql("SELECT 1 FROM sqlite_master LIMIT 1").first() is not None
+        if has_tables:
+            logger.info("[INFO] Migrating database to auto_vacuum=INCREMENTAL (one-time VACUUM)...")
+            conn.exec_driver_sql("VACUUM")
+
+
+def _add_missing_columns():
+    """
+    轻量迁移：create_all 不会给已存在的表补列，模型中新增的列用 ALTER TABLE ADD COLUMN 补上
+
+    只适用于可空、无服务端默认值的新列 (已有行取 NULL)。
+    """
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                logger.info(f"[INFO] Added column {table.name}.{column.name}")
+
+
+# 删除 (过期清理) 报警日志时一并删除它关联的持仓
+ALERT_LOG_POSITIONS_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS alert_log_positions_ad AFTER DELETE ON alert_logs BEGIN
+        DELETE FROM alert_log_positions WHERE alert_log_id = old.id;
+    END
+"""
+
+
+# 维护修改计数 (data_versions) 的表；写缓冲、outbox 等绕过 ORM 的写入同样会触发
+DATA_VERSION_TABLES = ("option_positions", "alert_logs", "portfolios", "watchlist_symbols")
+
+DATA_VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN
+        INSERT INTO data_versions(name, version) VALUES ('{table}', 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1;
+    END
+    """
+    for table in DATA_VERSION_TABLES
+    for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+]
+
+
+# alert_logs 的 FTS5 外部内容索引：只存倒排索引，正文仍在 alert_logs 中，由触发器同步
+ALERT_LOG_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS alert_logs_fts USING fts5(
+        rule_name, alert_type, message,
+        content='alert_logs', content_rowid='id',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS alert_logs_fts_ai AFTER INSERT ON alert_logs BEGIN
+        INSERT INTO alert_logs_fts(rowid, rule_name, alert_type, message)
+        VALUES (new.id, new.rule_name, new.alert_type, new.message);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS alert_logs_fts_ad AFTER DELETE ON alert_logs BEGIN
+        INSERT INTO alert_logs_fts(alert_logs_fts, rowid, rule_name, alert_type, message)
+        VALUES ('delete', old.id, old.rule_name, old.alert_type, old.message);
+    END
+    """,
+    # 只在索引列变化时更新索引；投递结果回写 (sent_successfully / delivery_results) 不触发
+    """
+    CREATE TRIGGER IF NOT EXISTS alert_logs_fts_au AFTER UPDATE OF rule_name, alert_type, message ON alert_logs BEGIN
+        INSERT INTO alert_logs_fts(alert_logs_fts, rowid, rule_name, alert_type, message)
+        VALUES ('delete', old.id, old.rule_name, old.alert_type, old.message);
+        INSERT INTO alert_logs_fts(rowid, rule_name, alert_type, message)
+        VALUES (new.id, new.rule_name, new.alert_type, new.message);
+    END
+    """,
+]
+
+# 旧版本的 alert_logs_fts_au 对任何列的更新都会触发；IF NOT EXISTS 不会替换已安装的触发器
+ALERT_LOG_FTS_AU_MARKER = "UPDATE OF rule_name, alert_type, message"
+
+
+def _init_alert_log_search():
+    """创建全文索引和同步触发器；首次创建时为已有日志重建索引"""
+    try:
+        with engine.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='alert_logs_fts'"
+            ).first() is not None
+            au_sql = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type='trigger' AND name='alert_logs_fts_au'"
+            ).scalar()
+            if au_sql and ALERT_LOG_FTS_AU_MARKER not in au_sql:
+                conn.exec_driver_sql("DROP TRIGGER alert_logs_fts_au")
+                logger.info("[INFO] Replaced alert_logs_fts_au trigger (indexed columns only)")
+            for ddl in ALERT_LOG_FTS_DDL:
+                conn.exec_driver_sql(ddl)
+            if not exists:
+                conn.exec_driver_sql("INSERT INTO alert_logs_fts(alert_logs_fts) VALUES ('rebuild')")
+                logger.info("[INFO] Built full-text index for alert_logs")
+    except Exception as e:
+        # SQLite 未编译 FTS5 时日志检索不可用，其余功能不受影响
+        logger.warning(f"[WARN] Alert log full-text search unavailable: {e}")
+
+
+@contextmanager
+def session_scope():
+    """
+    一个工作单元一个 Session (调度任务每次运行、后台线程每次写入各自独立)
+
+    正常结束时提交，异常时回滚，最后归还连接。
+    """
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@contextmanager
+def read_session_scope():
+    """只读工作单元：走读连接池，取出的对象在退出后处于 detached 状态，可继续读取已加载的属性"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 def get_db():
@@ -29,3 +278,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Date, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Date, Text, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import date, datetime
@@ -39,10 +39,37 @@ class Configuration(Base):
     __table_args__ = {'sqlite_autoincrement': True}
 
 
+class Portfolio(Base):
+    """
+    策略账户：持仓、通知 Webhook 和出场规则开关按组合隔离
+
+    设置项为 NULL 时沿用全局 Configuration (列名与 Configuration 一致)。
+    """
+    __tablename__ = "portfolios"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    name = Column(String, unique=True, nullable=False)
+    enabled = Column(Boolean, default=True, nullable=False)
+
+    wechat_webhook_url = Column(String, nullable=True)
+    # 是否接收 watchlist 的入场信号
+    entry_alerts_enabled = Column(Boolean, default=True, nullable=False)
+
+    exit_hard_tp_enabled = Column(Boolean, nullable=True)      # 阶梯止盈
+    exit_dte_force_enabled = Column(Boolean, nullable=True)    # 时间止损
+    exit_trend_stop_enabled = Column(Boolean, nullable=True)   # 趋势止损
+
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
 class OptionPosition(Base):
     __tablename__ = "option_positions"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # NULL 视为默认组合 (升级前创建的持仓)
+    portfolio_id = Column(Integer, nullable=True, index=True)
 
     underlying = Column(String, default="QQQ", nullable=False)
     option_type = Column(String, nullable=False)
@@ -73,10 +100,92 @@ class AlertLog(Base):
     triggered_at = Column(DateTime, server_default=func.now())
     message = Column(Text, nullable=False)
 
+    # NULL: 已进入 outbox 尚未投递完成
     sent_successfully = Column(Boolean, default=True)
     error_message = Column(Text, nullable=True)
+    # 各通知渠道的投递结果 JSON: {"wechat": {"status", "attempts", "error"}, ...}
+    delivery_results = Column(Text, nullable=True)
 
     position_id = Column(Integer, nullable=True)
+    portfolio_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # 日志列表 / 今日计数 / 过期清理都按时间范围扫描
+        Index("ix_alert_logs_triggered_at", "triggered_at"),
+        Index("ix_alert_logs_type_triggered_at", "alert_type", "triggered_at"),
+        Index("ix_alert_logs_position_triggered_at", "position_id", "triggered_at"),
+    )
+
+
+class AlertLogPosition(Base):
+    """
+    汇总报警 (一条日志对应多个持仓) 与持仓的关联；单持仓报警只用 AlertLog.position_id
+
+    随 alert_logs 的行一起删除 (触发器见 init_db)。
+    """
+    __tablename__ = "alert_log_positions"
+
+    alert_log_id = Column(Integer, primary_key=True)
+    position_id = Column(Integer, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_alert_log_positions_position_id", "position_id", "alert_log_id"),
+    )
+
+
+class NotificationOutbox(Base):
+    """
+    待投递通知 (outbox)：与 AlertLog 在同一事务中写入，由后台 dispatcher 投递
+
+    status: pending -> sent / dead (重试次数用尽，死信)；时间戳为 epoch 秒
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    idempotency_key = Column(String, nullable=False)
+    alert_log_id = Column(Integer, nullable=True)
+
+    channel = Column(String, nullable=False, default="wechat")
+    destination = Column(String, nullable=False)
+    message = Column(Text, nullable=False)
+
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+    enqueued_at = Column(Float, nullable=False)
+    delivered_at = Column(Float, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ux_notification_outbox_idempotency_key", "idempotency_key", unique=True),
+        Index("ix_notification_outbox_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_notification_outbox_created_at", "created_at"),
+    )
+
+
+class AlertDedupKey(Base):
+    """
+    已发送报警的去重键 (跨重启 / 跨进程)：同一周期内 (period_key, rule_key) 只能插入一次
+
+    expires_on 按交易日历计算，过期后由清理任务删除。
+    """
+    __tablename__ = "alert_dedup_keys"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    period_key = Column(String, nullable=False)   # 2025-03-03 / 2025-W10
+    rule_key = Column(String, nullable=False)
+    expires_on = Column(Date, nullable=False)
+
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ux_alert_dedup_keys_period_rule", "period_key", "rule_key", unique=True),
+        Index("ix_alert_dedup_keys_expires_on", "expires_on"),
+    )
 
 
 class DailyQQQData(Base):
@@ -92,3 +201,91 @@ class DailyQQQData(Base):
     close_price = Column(Float, nullable=True)
 
     fetched_at = Column(DateTime, server_default=func.now())
+
+
+class WatchlistSymbol(Base):
+    """参与入场信号检查的标的；持仓的标的即使不在列表中也会随检查周期一起下载"""
+    __tablename__ = "watchlist_symbols"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    symbol = Column(String, unique=True, nullable=False)
+    enabled = Column(Boolean, default=True, nullable=False)
+
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class DataVersion(Base):
+    """
+    表的修改计数：触发器在每次增删改后 +1 (见 init_db.DATA_VERSION_TABLES)
+
+    页面和 JSON 接口用它生成 ETag，数据没变时直接返回 304，不再查询和渲染。
+    """
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class SchedulerLease(Base):
+    """
+    调度任务的 leader 租约：多个 worker 进程中只有持有未过期租约的一个运行调度任务
+
+    expires_at / renewed_at 为 epoch 秒；fencing_token 每次换主时递增。
+    """
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+
+    holder = Column(String, nullable=False, default="")
+    fencing_token = Column(Integer, nullable=False, default=0)
+    expires_at = Column(Float, nullable=False, default=0.0)
+    renewed_at = Column(Float, nullable=False, default=0.0)
+
+
+class PositionPriceChunk(Base):
+    """
+    单个持仓一个交易日 (美东) 的原始报价，按列打包成定长数组
+
+    timestamps: little-endian uint32 (epoch 秒)，prices: little-endian float64，
+    每个检查周期在原 BLOB 末尾追加；OHLC 随追加增量维护。编解码见 app/database/price_history.py
+    """
+    __tablename__ = "position_price_chunks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    position_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+
+    timestamps = Column(LargeBinary, nullable=False)
+    prices = Column(LargeBinary, nullable=False)
+    samples = Column(Integer, nullable=False, default=0)
+
+    open_price = Column(Float, nullable=False)
+    high_price = Column(Float, nullable=False)
+    low_price = Column(Float, nullable=False)
+    close_price = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_position_price_chunks_position_day", "position_id", "day", unique=True),
+    )
+
+
+class PositionPriceDaily(Base):
+    """原始报价超出保留窗口后压缩成的日线 OHLC"""
+    __tablename__ = "position_price_daily"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    position_id = Column(Integer, nullable=False)
+    date = Column(Date, nullable=False)
+
+    open_price = Column(Float, nullable=False)
+    high_price = Column(Float, nullable=False)
+    low_price = Column(Float, nullable=False)
+    close_price = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ux_position_price_daily_position_date", "position_id", "date", unique=True),
+    )
@@ -0,0 +1,229 @@
+"""
+持仓报价时间序列
+
+分两层存储:
+- position_price_chunks: 最近 N 天的原始报价 (每个检查周期一个点)，一个持仓一天一行，
+  时间戳和价格分别打包成定长数组存成 BLOB，追加靠 SQLite 的 BLOB 拼接完成，不需要读回 Python
+- position_price_daily : 已收盘交易日的 OHLC 日线，由 compact() 从原始层滚动生成；
+  超出原始保留窗口的 chunk 在压缩后删除，存储量只随持仓数 × 天数线性增长
+
+读取时用 numpy.frombuffer 直接映射 BLOB，不逐点构造 Python 对象。
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pytz import timezone
+from sqlalchemy import LargeBinary, cast, delete, func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.database.models import OptionPosition, PositionPriceChunk, PositionPriceDaily
+
+logger = logging.getLogger(__name__)
+
+et_tz = timezone("America/New_York")
+
+TIMESTAMP_DTYPE = np.dtype("<u4")
+PRICE_DTYPE = np.dtype("<f8")
+
+# (position_id, epoch 秒, 价格)
+PricePoint = Tuple[int, int, float]
+
+
+def to_epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = et_tz.localize(value)
+    return int(value.timestamp())
+
+
+def trading_day(epoch: int) -> date:
+    return datetime.fromtimestamp(epoch, et_tz).date()
+
+
+def pack(timestamps: Iterable[int], prices: Iterable[float]) -> Tuple[bytes, bytes]:
+    return (np.asarray(list(timestamps), dtype=TIMESTAMP_DTYPE).tobytes(),
+            np.asarray(list(prices), dtype=PRICE_DTYPE).tobytes())
+
+
+def unpack(timestamps: bytes, prices: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """零拷贝解码；重试写入可能让追加顺序错位，非单调时按时间重排"""
+    ts = np.frombuffer(timestamps, dtype=TIMESTAMP_DTYPE)
+    px = np.frombuffer(prices, dtype=PRICE_DTYPE)
+    if ts.size > 1 and np.any(np.diff(ts.astype(np.int64)) < 0):
+        order = np.argsort(ts, kind="stable")
+        ts, px = ts[order], px[order]
+    return ts, px
+
+
+def build_chunk_rows(points: List[PricePoint]) -> List[Dict[str, Any]]:
+    """把一批报价按 (持仓, 交易日) 合并成待追加的 chunk 行"""
+    grouped: Dict[Tuple[int, date], List[Tuple[int, float]]] = defaultdict(list)
+    for position_id, epoch, price in points:
+        grouped[(position_id, trading_day(epoch))].append((epoch, price))
+
+    rows = []
+    for (position_id, day), samples in grouped.items():
+        samples.sort()
+        prices = [price for _, price in samples]
+        timestamps_blob, prices_blob = pack((epoch for epoch, _ in samples), prices)
+        rows.append({
+            "position_id": position_id,
+            "day": day,
+            "timestamps": timestamps_blob,
+            "prices": prices_blob,
+            "samples": len(samples),
+            "open_price": prices[0],
+            "high_price": max(prices),
+            "low_price": min(prices),
+            "close_price": prices[-1],
+        })
+    return rows
+
+
+def append_chunks(db: Session, rows: List[Dict[str, Any]]):
+    """
+    追加到当天的 chunk：不存在则插入，存在则在 SQLite 内拼接 BLOB 并更新 OHLC
+
+    已删除持仓的报价 (删除时仍在写缓冲或检查周期中) 跳过，不留下无人清理的 chunk。
+    """
+    existing = set(db.execute(
+        select(OptionPosition.id).where(OptionPosition.id.in_({row["position_id"] for row in rows}))
+    ).scalars()) if rows else set()
+    rows = [row for row in rows if row["position_id"] in existing]
+    if not rows:
+        return
+
+    table = PositionPriceChunk.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.position_id, table.c.day],
+        set_={
+            # || 的结果是 TEXT，CAST 回 BLOB (内容按字节保留)
+            "timestamps": cast(table.c.timestamps.op("||")(stmt.excluded.timestamps), LargeBinary),
+            "prices": cast(table.c.prices.op("||")(stmt.excluded.prices), LargeBinary),
+            "samples": table.c.samples + stmt.excluded.samples,
+            "high_price": func.max(table.c.high_price, stmt.excluded.high_price),
+            "low_price": func.min(table.c.low_price, stmt.excluded.low_price),
+            "close_price": stmt.excluded.close_price,
+        }
+    )
+    db.execute(stmt, rows)
+
+
+_ROLLUP_SQL = text("""
+    INSERT INTO position_price_daily
+        (position_id, date, open_price, high_price, low_price, close_price, samples)
+    SELECT position_id, day, open_price, high_price, low_price, close_price, samples
+    FROM position_price_chunks
+    WHERE day < :today
+    ON CONFLICT (position_id, date) DO UPDATE SET
+        open_price = excluded.open_price,
+        high_price = excluded.high_price,
+        low_price = excluded.low_price,
+        close_price = excluded.close_price,
+        samples = excluded.samples
+""")
+
+
+def compact(db: Session, raw_days: int, today: Optional[date] = None) -> Dict[str, int]:
+    """
+    把已收盘交易日的 chunk 汇总进日线表 (幂等)，删除超出原始保留窗口的 chunk
+
+    返回 {"rolled_up": 写入/刷新的日线行数, "purged": 删除的 chunk 行数}
+    """
+    today = today or datetime.now(et_tz).date()
+    rolled_up = db.execute(_ROLLUP_SQL, {"today": today.isoformat()}).rowcount
+    purged = db.execute(
+        delete(PositionPriceChunk).where(PositionPriceChunk.day < today - timedelta(days=raw_days))
+    ).rowcount
+    return {"rolled_up": rolled_up, "purged": purged}
+
+
+def max_profit_from_history(db: Session, position: OptionPosition) -> Optional[float]:
+    """按入场后记录到的最高报价精确计算最高收益率；没有历史时返回 None"""
+    if not position.entry_price or position.entry_price <= 0:
+        return None
+
+    daily_high = db.query(func.max(PositionPriceDaily.high_price)).filter(
+        PositionPriceDaily.position_id == position.id,
+        PositionPriceDaily.date >= position.entry_date
+    ).scalar()
+    raw_high = db.query(func.max(PositionPriceChunk.high_price)).filter(
+        PositionPriceChunk.position_id == position.id,
+        PositionPriceChunk.day >= position.entry_date
+    ).scalar()
+
+    highs = [h for h in (daily_high, raw_high) if h is not None]
+    if not highs:
+        return None
+    return (max(highs) - position.entry_price) / position.entry_price
+
+
+def get_history(db: Session, position_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                resolution: str = "auto") -> Dict[str, Any]:
+    """
+    读取持仓报价历史
+
+    resolution:
+    - raw  : 只返回原始报价点 (仅最近 N 天可用)
+    - daily: 只返回日线 (包括尚未压缩的交易日，由 chunk 的 OHLC 补齐)
+    - auto : 两者都返回，图表用日线画全程、用原始点画最近几天
+    """
+    daily: Dict[date, Dict[str, Any]] = {}
+    points: List[Dict[str, Any]] = []
+
+    def in_range(column):
+        conditions = []
+        if start is not None:
+            conditions.append(column >= start)
+        if end is not None:
+            conditions.append(column <= end)
+        return conditions
+
+    if resolution in ("daily", "auto"):
+        rows = db.query(PositionPriceDaily).filter(
+            PositionPriceDaily.position_id == position_id, *in_range(PositionPriceDaily.date)
+        ).order_by(PositionPriceDaily.date).all()
+        for row in rows:
+            daily[row.date] = {
+                "date": row.date.isoformat(),
+                "open": row.open_price,
+                "high": row.high_price,
+                "low": row.low_price,
+                "close": row.close_price,
+                "samples": row.samples,
+            }
+
+    chunks = db.query(PositionPriceChunk).filter(
+        PositionPriceChunk.position_id == position_id, *in_range(PositionPriceChunk.day)
+    ).order_by(PositionPriceChunk.day).all()
+
+    for chunk in chunks:
+        if resolution in ("daily", "auto") and chunk.day not in daily:
+            daily[chunk.day] = {
+                "date": chunk.day.isoformat(),
+                "open": chunk.open_price,
+                "high": chunk.high_price,
+                "low": chunk.low_price,
+                "close": chunk.close_price,
+                "samples": chunk.samples,
+            }
+        if resolution in ("raw", "auto"):
+            ts, px = unpack(chunk.timestamps, chunk.prices)
+            points.extend(
+                {"t": datetime.fromtimestamp(int(t), et_tz).isoformat(), "price": float(p)}
+                for t, p in zip(ts.tolist(), px.tolist())
+            )
+
+    return {
+        "daily": [daily[d] for d in sorted(daily)],
+        "points": points,
+    }
+
+
+def delete_history(db: Session, position_id: int):
+    db.execute(delete(PositionPriceChunk).where(PositionPriceChunk.position_id == position_id))
+    db.execute(delete(PositionPriceDaily).where(PositionPriceDaily.position_id == position_id))
@@ -0,0 +1,289 @@
+"""
+管理后台 / JSON API 使用的查询
+
+提醒日志按 (triggered_at DESC, id DESC) 做 keyset 分页：游标记录上一页最后一行的
+(triggered_at, id)，下一页从该位置继续扫描索引，翻到第几页开销都只和页大小有关。
+triggered_at 以数据库中存储的原始文本参与比较 (与 CURRENT_TIMESTAMP 写入的格式一致)，
+避免 DateTime 绑定参数补零后造成的比较错位。
+
+全文检索走 alert_logs_fts (FTS5 外部内容表，见 init_db)，按 bm25 相关度排序，
+在 SQLite 内完成匹配、排序和分页，只把当前页的行取回 Python。
+"""
+import base64
+import json
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import String, and_, func, or_, select, text, type_coerce
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.database.models import AlertLog, AlertLogPosition, DataVersion, OptionPosition, Portfolio, WatchlistSymbol
+
+MAX_PAGE_SIZE = 200
+MAX_SEARCH_PAGE_SIZE = 100
+
+_triggered_at_text = type_coerce(AlertLog.triggered_at, String)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidSearchQuery(ValueError):
+    pass
+
+
+class InvalidSymbol(ValueError):
+    pass
+
+
+def encode_cursor(triggered_at: str, log_id: int) -> str:
+    raw = f"{triggered_at}|{log_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        triggered_at, log_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return triggered_at, int(log_id)
+    except Exception as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def _bound_text(value: Union[date, datetime]) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value.isoformat()
+
+
+def serialize_alert_log(log: AlertLog, triggered_at_text: Optional[str] = None) -> Dict[str, Any]:
+    try:
+        message = json.loads(log.message)
+    except (TypeError, ValueError):
+        message = log.message
+
+    return {
+        "id": log.id,
+        "alert_type": log.alert_type,
+        "rule_name": log.rule_name,
+        "triggered_at": triggered_at_text or (log.triggered_at.isoformat(sep=" ") if log.triggered_at else None),
+        "sent_successfully": log.sent_successfully,
+        "error_message": log.error_message,
+        "delivery_results": json.loads(log.delivery_results) if log.delivery_results else None,
+        "position_id": log.position_id,
+        "message": message,
+    }
+
+
+def list_alert_logs(
+    db: Session,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    alert_type: Optional[str] = None,
+    rule_name: Optional[str] = None,
+    position_id: Optional[int] = None,
+    start: Optional[Union[date, datetime]] = None,
+    end: Optional[Union[date, datetime]] = None,
+) -> Dict[str, Any]:
+    """
+    按时间倒序分页查询提醒日志
+
+    start / end 为闭区间；end 只给日期时包含当天全天。
+    返回 {"items": [...], "next_cursor": str | None}
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    query = db.query(AlertLog, _triggered_at_text.label("triggered_at_text"))
+
+    if alert_type:
+        query = query.filter(AlertLog.alert_type == alert_type)
+    if rule_name:
+        query = query.filter(AlertLog.rule_name == rule_name)
+    if position_id is not None:
+        # 单持仓报警记在 position_id 上，汇总报警通过关联表关联多个持仓
+        query = query.filter(or_(
+            AlertLog.position_id == position_id,
+            AlertLog.id.in_(
+                select(AlertLogPosition.alert_log_id).where(AlertLogPosition.position_id == position_id)
+            )
+        ))
+    if start is not None:
+        query = query.filter(_triggered_at_text >= _bound_text(start))
+    if end is not None:
+        if not isinstance(end, datetime):
+            query = query.filter(_triggered_at_text < _bound_text(end + timedelta(days=1)))
+        else:
+            query = query.filter(_triggered_at_text <= _bound_text(end))
+
+    if cursor:
+        last_triggered_at, last_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            _triggered_at_text < last_triggered_at,
+            and_(_triggered_at_text == last_triggered_at, AlertLog.id < last_id)
+        ))
+
+    rows = query.order_by(AlertLog.triggered_at.desc(), AlertLog.id.desc()).limit(limit + 1).all()
+
+    items: List[Dict[str, Any]] = [serialize_alert_log(log, text) for log, text in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last_log, last_text = rows[limit - 1]
+        next_cursor = encode_cursor(last_text, last_log.id)
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+
+_SEARCH_SQL = text("""
+    SELECT a.id, a.alert_type, a.rule_name, CAST(a.triggered_at AS TEXT) AS triggered_at,
+           a.sent_successfully, a.error_message, a.delivery_results, a.position_id, a.message,
+           alert_logs_fts.rank AS rank,
+           snippet(alert_logs_fts, 2, '[', ']', '…', 16) AS snippet
+    FROM alert_logs_fts
+    JOIN alert_logs a ON a.id = alert_logs_fts.rowid
+    WHERE alert_logs_fts MATCH :query
+    ORDER BY alert_logs_fts.rank
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def _quote_terms(query: str) -> str:
+    """把用户输入按空白拆成短语 (双引号包裹)，各短语之间为 AND"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+
+def search_alert_logs(db: Session, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """
+    全文检索提醒日志，按相关度排序
+
+    query 支持 FTS5 语法 (AND / OR / NOT、"短语"、前缀 QQQ2701*、列过滤 rule_name:stop)；
+    语法不合法时退化为把每个词当作短语做 AND 匹配。
+    rank 为 bm25 分值，越小越相关 (FTS5 内置 rank 列，ORDER BY rank LIMIT 可走内部优化)。
+    返回 {"items": [... 含 rank / snippet], "next_offset": int | None}
+    """
+    query = (query or "").strip()
+    if not query:
+        raise InvalidSearchQuery("Empty search query")
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, int(offset))
+
+    params = {"query": query, "limit": limit + 1, "offset": offset}
+    try:
+        rows = db.execute(_SEARCH_SQL, params).all()
+    except OperationalError as e:
+        # 索引缺失 (FTS5 不可用) 不是查询语法问题，原样抛出
+        if "no such table" in str(e):
+            raise
+        params["query"] = _quote_terms(query)
+        try:
+            rows = db.execute(_SEARCH_SQL, params).all()
+        except OperationalError as retry_error:
+            raise InvalidSearchQuery(f"Invalid search query: {query}") from retry_error
+
+    items: List[Dict[str, Any]] = []
+    for row in rows[:limit]:
+        item = serialize_alert_log(row, row.triggered_at)
+        item["rank"] = round(row.rank, 4)
+        item["snippet"] = row.snippet
+        items.append(item)
+
+    return {"items": items, "next_offset": offset + limit if len(rows) > limit else None}
+
+
+_SYMBOL_PATTERN = re.compile(r"^[A-Z][A-Z0-9.\-]{0,9}$")
+
+
+def normalize_symbol(symbol: str) -> str:
+    symbol = (symbol or "").strip().upper()
+    if not _SYMBOL_PATTERN.match(symbol):
+        raise InvalidSymbol(f"Invalid symbol: {symbol!r}")
+    return symbol
+
+
+def list_watchlist(db: Session) -> List[Dict[str, Any]]:
+    rows = db.query(WatchlistSymbol).order_by(WatchlistSymbol.symbol).all()
+    return [{
+        "id": row.id,
+        "symbol": row.symbol,
+        "enabled": row.enabled,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    } for row in rows]
+
+
+def market_symbols(db: Session) -> Tuple[List[str], List[str]]:
+    """
+    检查周期需要下载的标的
+
+    返回 (watchlist 中启用的标的 -> 检查入场信号, 需要下载的全部标的 = 启用的标的 + 持仓的标的)
+    """
+    watchlist = [row.symbol for row in db.query(WatchlistSymbol.symbol).filter(WatchlistSymbol.enabled.is_(True))]
+    underlyings = [row.underlying.upper() for row in db.query(OptionPosition.underlying).distinct()]
+    return sorted(watchlist), sorted(set(watchlist) | set(underlyings))
+
+
+DEFAULT_PORTFOLIO_NAME = "默认组合"
+
+# 可按组合覆盖的设置 (与 Configuration 同名，见 Config.for_portfolio)
+PORTFOLIO_SETTINGS = ("wechat_webhook_url", "exit_hard_tp_enabled", "exit_dte_force_enabled", "exit_trend_stop_enabled")
+
+
+def portfolio_settings(portfolio: Portfolio) -> Dict[str, Any]:
+    return {name: getattr(portfolio, name) for name in PORTFOLIO_SETTINGS}
+
+
+def serialize_position(position: OptionPosition, today: date) -> Dict[str, Any]:
+    """持仓 JSON：现价没有时盈亏为 None；dte 相对 today (美东日期)"""
+    current_price = position.current_price
+    pnl_amount = pnl_pct = None
+    if current_price is not None:
+        pnl_amount = (current_price - position.entry_price) * (position.quantity or 1) * 100
+        pnl_pct = ((current_price - position.entry_price) / position.entry_price * 100) if position.entry_price > 0 else 0
+    return {
+        "id": position.id,
+        "portfolio_id": position.portfolio_id,
+        "underlying": position.underlying,
+        "option_type": position.option_type,
+        "strike_price": position.strike_price,
+        "expiration_date": position.expiration_date.isoformat(),
+        "entry_price": position.entry_price,
+        "quantity": position.quantity or 1,
+        "entry_date": position.entry_date.isoformat(),
+        "current_price": current_price,
+        "last_price_update": position.last_price_update.isoformat(sep=" ") if position.last_price_update else None,
+        "pnl_amount": pnl_amount,
+        "pnl_pct": pnl_pct,
+        "max_profit_pct": (position.max_profit or 0.0) * 100,
+        "dte": (position.expiration_date - today).days,
+    }
+
+
+def data_versions(db: Session, *tables: str) -> Tuple[int, ...]:
+    """各表的修改计数 (按参数顺序，从未修改过的表为 0)"""
+    versions = dict(db.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(tables)).all())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def default_portfolio_id(db: Session) -> Optional[int]:
+    """默认组合 = 最早创建的组合；portfolio_id 为 NULL 的持仓归入该组合"""
+    return db.query(func.min(Portfolio.id)).scalar()
+
+
+def list_portfolios(db: Session) -> List[Dict[str, Any]]:
+    default_id = default_portfolio_id(db)
+    counts = dict(
+        db.query(func.coalesce(OptionPosition.portfolio_id, default_id), func.count(OptionPosition.id))
+        .group_by(func.coalesce(OptionPosition.portfolio_id, default_id)).all()
+    )
+    return [{
+        "id": row.id,
+        "name": row.name,
+        "enabled": row.enabled,
+        "is_default": row.id == default_id,
+        "entry_alerts_enabled": row.entry_alerts_enabled,
+        "positions": counts.get(row.id, 0),
+        **portfolio_settings(row),
+    } for row in db.query(Portfolio).order_by(Portfolio.id).all()]
@@ -0,0 +1,136 @@
+"""
+数据保留清理
+
+按主键区间分批删除过期行，每批单独提交，批次之间让出写锁，
+这样夜间清理即使积压了大量数据，也不会长时间占住 SQLite 的唯一写锁而阻塞检查任务和管理后台。
+整体受时间预算约束：超出预算时停止，剩余部分留给下一次运行。
+
+删除完成后用 PRAGMA incremental_vacuum 分步归还空闲页 (需要 auto_vacuum=INCREMENTAL，见 init_db)。
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import text
+
+from app.database.init_db import engine, session_scope
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+# 批次之间短暂让出写锁，让排队的写事务先拿到锁
+BATCH_PAUSE_SECONDS = 0.05
+# 每步 incremental_vacuum 释放的页数 (默认 4 KiB 页，约 4 MiB)
+VACUUM_PAGES_PER_STEP = 1024
+
+# 表名 -> 判断过期的时间列 (只允许白名单中的表，表名/列名会直接拼进 SQL)
+RETENTION_TABLES = {
+    "alert_logs": "triggered_at",
+    "daily_qqq_data": "fetched_at",
+    "notification_outbox": "created_at",
+}
+
+
+@dataclass
+class RetentionReport:
+    deleted: Dict[str, int] = field(default_factory=dict)
+    batches: int = 0
+    bytes_reclaimed: int = 0
+    complete: bool = True
+    elapsed_seconds: float = 0.0
+
+    def summary(self) -> str:
+        deleted = ", ".join(f"{table}={count}" for table, count in self.deleted.items())
+        state = "complete" if self.complete else "time budget exhausted, will resume next run"
+        return (f"deleted [{deleted}] in {self.batches} batches, "
+                f"reclaimed {self.bytes_reclaimed / 1024 / 1024:.2f} MiB "
+                f"in {self.elapsed_seconds:.1f}s ({state})")
+
+
+def _cutoff_text(cutoff: datetime) -> str:
+    # 与 CURRENT_TIMESTAMP 写入的文本格式一致，按存储的原始文本比较
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def delete_expired(table: str, cutoff: datetime, batch_size: int, deadline: float,
+                   report: RetentionReport) -> bool:
+    """
+    分批删除 table 中时间列早于 cutoff 的行
+
+    每批先取出最早的 batch_size 个过期行的主键区间，再按区间删除 (主键范围扫描)，然后提交。
+    返回 True 表示已删完，False 表示时间预算用完。
+    """
+    column = RETENTION_TABLES[table]
+    bounds_sql = text(
+        f"SELECT MIN(id), MAX(id) FROM ("
+        f"SELECT id FROM {table} WHERE {column} < :cutoff ORDER BY id LIMIT :batch_size)"
+    )
+    delete_sql = text(
+        f"DELETE FROM {table} WHERE id BETWEEN :low AND :high AND {column} < :cutoff"
+    )
+    params = {"cutoff": _cutoff_text(cutoff), "batch_size": batch_size}
+
+    report.deleted.setdefault(table, 0)
+    while True:
+        if time.monotonic() >= deadline:
+            return False
+
+        with session_scope() as db:
+            low, high = db.execute(bounds_sql, params).one()
+            if low is None:
+                return True
+            deleted = db.execute(delete_sql, dict(params, low=low, high=high)).rowcount
+
+        report.deleted[table] += deleted
+        report.batches += 1
+        metrics.retention_rows_deleted.labels(table).inc(deleted)
+        logger.debug(f"[CLEANUP] {table}: deleted {deleted} rows (id {low}..{high})")
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def _freelist_pages(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+
+def incremental_vacuum(deadline: float) -> int:
+    """分步释放空闲页直到没有空闲页或时间预算用完，返回归还给文件系统的字节数"""
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.warning("[WARN] auto_vacuum is not INCREMENTAL, skipping incremental vacuum")
+            return 0
+
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        before = _freelist_pages(conn)
+        remaining = before
+        while remaining > 0 and time.monotonic() < deadline:
+            # pysqlite 的 execute 只 step 一次 (只释放一页)，executescript 才会执行到底
+            conn.connection.dbapi_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+            remaining = _freelist_pages(conn)
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+        # WAL 模式下主库文件在 checkpoint 时才截断；PASSIVE 不等待读连接
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    return (before - remaining) * page_size
+
+
+def run_retention(cutoffs: Dict[str, datetime], batch_size: int, time_budget_seconds: float) -> RetentionReport:
+    """按 cutoffs 依次清理各表，再做增量 vacuum；全部共享同一个时间预算"""
+    started = time.monotonic()
+    deadline = started + time_budget_seconds
+    report = RetentionReport()
+
+    for table, cutoff in cutoffs.items():
+        if not delete_expired(table, cutoff, batch_size, deadline, report):
+            report.complete = False
+            break
+
+    if time.monotonic() < deadline:
+        report.bytes_reclaimed = incremental_vacuum(deadline)
+    metrics.retention_bytes_reclaimed.inc(report.bytes_reclaimed)
+
+    report.elapsed_seconds = time.monotonic() - started
+    return report
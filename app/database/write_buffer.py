@@ -0,0 +1,304 @@
+"""
+写缓冲 (write-behind)
+
+检查周期内的持仓现价 / max_profit 更新、报价历史点、DailyQQQData upsert 和 AlertLog 插入
+先在内存中合并，周期结束时在一个事务里用批量 UPDATE / INSERT 落库：
+SQLite 每次提交一次 fsync，逐持仓提交会让周期耗时随持仓数线性膨胀。
+AlertLog 附带的待投递通知与其在同一事务中写入 notification_outbox (见 app/notification/outbox.py)。
+
+- batch() 内的写入延迟到最外层 batch 结束时 flush；batch 外的写入立即 flush。
+  batch 深度按线程记录：调度周期的 batch 不会推迟 Web 线程的写入，反之亦然
+- flush 因数据库繁忙 / 锁等暂时性错误 (OperationalError) 失败时待写数据放回缓冲，下一次 flush
+  (或关闭时的 flush) 重试；其他 (数据) 错误时每类数据分开重写，只丢弃出错的那一类并记录日志，
+  报警日志和待投递通知不会被持仓 / 价格历史的坏数据连带丢弃
+- 已删除持仓的现价更新在 UPDATE 时自然跳过 (匹配 0 行)，delete_position 同时丢弃其缓冲数据
+"""
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from collections import defaultdict
+
+from sqlalchemy import bindparam, delete, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.init_db import session_scope
+from app.database.models import AlertLog, AlertLogPosition, DailyQQQData, NotificationOutbox, OptionPosition
+from app.database import price_history
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 每个线程自己的 batch 嵌套深度
+        self._local = threading.local()
+        self._positions: Dict[int, Dict[str, Any]] = {}
+        self._daily_qqq: Dict[date, Dict[str, Any]] = {}
+        self._alert_logs: List[Dict[str, Any]] = []
+        self._price_points: List[price_history.PricePoint] = []
+        # 有通知写入 outbox 后回调 (唤醒 dispatcher)
+        self._outbox_listeners: List[Callable[[], None]] = []
+
+    def add_outbox_listener(self, listener: Callable[[], None]):
+        self._outbox_listeners.append(listener)
+
+    def record_price(self, position_id: int, price: float, updated_at: datetime):
+        """更新持仓现价，同时把这次报价追加到价格历史"""
+        with self._lock:
+            row = self._positions.setdefault(position_id, {"id": position_id})
+            row["current_price"] = price
+            row["last_price_update"] = updated_at
+            self._price_points.append((position_id, price_history.to_epoch(updated_at), price))
+        self._flush_if_idle()
+
+    def add_price_point(self, position_id: int, price: float, at: datetime):
+        """只记录价格历史 (现价已由调用方直接写入时使用)"""
+        with self._lock:
+            self._price_points.append((position_id, price_history.to_epoch(at), price))
+        self._flush_if_idle()
+
+    def record_max_profit(self, position_id: int, max_profit: float):
+        with self._lock:
+            row = self._positions.setdefault(position_id, {"id": position_id})
+            row["max_profit"] = max(max_profit, row.get("max_profit", max_profit))
+        self._flush_if_idle()
+
+    def upsert_daily_qqq(self, date_val: date, close_price: float, high_price: Optional[float],
+                         fetched_at: datetime):
+        with self._lock:
+            self._daily_qqq[date_val] = {
+                "date": date_val,
+                "close_price": close_price,
+                "high_price": high_price,
+                "fetched_at": fetched_at,
+            }
+        self._flush_if_idle()
+
+    def add_alert_log(self, alert: Dict[str, Any], success: Optional[bool], error_message: Optional[str] = None,
+                      notifications: Optional[List[Dict[str, Any]]] = None):
+        """
+        记录一条报警；notifications 为各渠道的 outbox 行 (outbox.build_notification)，
+        此时 success 传 None，投递结果由 dispatcher 回写
+
+        汇总报警 (alert["position_ids"]) 同时写入 alert_log_positions 关联表
+        """
+        row = {
+            "alert_type": alert.get("alert_type", "QQQ_DROP"),
+            "rule_name": alert.get("rule_name", ""),
+            "message": json.dumps(alert, default=str, ensure_ascii=False),
+            "sent_successfully": success,
+            "error_message": error_message,
+            "position_id": alert.get("position_id"),
+            "portfolio_id": alert.get("portfolio_id"),
+            "notifications": notifications or [],
+            "position_ids": alert.get("position_ids") or [],
+        }
+        with self._lock:
+            self._alert_logs.append(row)
+        self._flush_if_idle()
+
+    @contextmanager
+    def batch(self):
+        """延迟 batch 内的全部写入，最外层退出时 (包括异常退出) 统一 flush"""
+        self._local.depth = self._depth() + 1
+        try:
+            yield self
+        finally:
+            self._local.depth -= 1
+            self._flush_if_idle()
+
+    def discard_position(self, position_id: int):
+        """持仓删除时丢弃其尚未写入的现价更新和价格历史点"""
+        with self._lock:
+            self._positions.pop(position_id, None)
+            self._price_points = [point for point in self._price_points if point[0] != position_id]
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._positions) + len(self._daily_qqq) + len(self._alert_logs) + len(self._price_points)
+
+    def _depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    def _flush_if_idle(self):
+        if self._depth() == 0:
+            self.flush()
+
+    def flush(self) -> Dict[str, int]:
+        """把缓冲中的全部数据在一个事务内写入数据库，返回各类写入行数"""
+        with self._lock:
+            positions = list(self._positions.values())
+            daily_qqq = list(self._daily_qqq.values())
+            alert_logs = self._alert_logs
+            price_points = self._price_points
+            self._positions = {}
+            self._daily_qqq = {}
+            self._alert_logs = []
+            self._price_points = []
+
+        counts = {"positions": len(positions), "daily_qqq": len(daily_qqq), "alert_logs": len(alert_logs),
+                  "price_points": len(price_points)}
+        if not any(counts.values()):
+            return counts
+
+        batches = {"positions": positions, "daily_qqq": daily_qqq, "alert_logs": alert_logs,
+                   "price_points": price_points}
+        try:
+            with session_scope() as db:
+                for kind, rows in batches.items():
+                    if rows:
+                        self._write(db, kind, rows, counts)
+        except OperationalError as e:
+            logger.error(f"[ERROR] Write buffer flush failed, will retry on next flush: {e}")
+            self._requeue(positions, daily_qqq, alert_logs, price_points)
+            raise
+        except Exception as e:
+            logger.error(f"[ERROR] Write buffer flush failed, writing each kind separately: {e}")
+            counts.pop("notifications", None)
+            self._flush_separately(batches, counts)
+            self._publish(counts)
+            raise
+
+        self._publish(counts)
+        return counts
+
+    def _write(self, db, kind: str, rows: List[Any], counts: Dict[str, int]):
+        if kind == "positions":
+            self._update_positions(db, rows)
+        elif kind == "daily_qqq":
+            stmt = sqlite_insert(DailyQQQData).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DailyQQQData.date],
+                set_={
+                    "close_price": stmt.excluded.close_price,
+                    "high_price": stmt.excluded.high_price,
+                    "fetched_at": stmt.excluded.fetched_at,
+                }
+            )
+            db.execute(stmt)
+        elif kind == "alert_logs":
+            counts["notifications"] = len(self._insert_alert_logs(db, rows))
+        elif kind == "price_points":
+            price_history.append_chunks(db, price_history.build_chunk_rows(rows))
+
+    def _flush_separately(self, batches: Dict[str, List[Any]], counts: Dict[str, int]):
+        """
+        整批写入因数据错误失败后，每类数据各用一个事务重写，只丢弃出错的那一类
+
+        报警日志和 outbox 行不会因为持仓 / 价格历史的坏数据一起丢失 (去重键已认领，丢了就不会再发)；
+        暂时性错误的那一类放回缓冲，报警日志本身写入失败时逐条完整记录被丢弃的报警。
+        """
+        for kind, rows in batches.items():
+            if not rows:
+                continue
+            try:
+                with session_scope() as db:
+                    self._write(db, kind, rows, counts)
+            except OperationalError as e:
+                logger.error(f"[ERROR] Write buffer flush of {kind} failed, will retry on next flush: {e}")
+                self._requeue(*(rows if name == kind else [] for name in batches))
+                counts[kind] = 0
+            except Exception as e:
+                logger.error(f"[ERROR] Write buffer flush of {kind} failed, dropping {len(rows)} rows: {e}")
+                if kind == "alert_logs":
+                    for row in rows:
+                        logger.error(f"[ERROR] Dropped alert log: {row}")
+                counts[kind] = 0
+
+    def _publish(self, counts: Dict[str, int]):
+        for kind, count in counts.items():
+            if count:
+                metrics.write_buffer_rows.labels(kind).inc(count)
+        logger.debug(f"[FLUSH] Write buffer flushed: {counts}")
+
+        if counts.get("notifications"):
+            for listener in self._outbox_listeners:
+                listener()
+
+    @staticmethod
+    def _update_positions(db, positions: List[Dict[str, Any]]):
+        """
+        按主键批量更新持仓；同一组列的行合并成一次 executemany
+
+        走 Core 表更新：ORM 按主键批量更新在行已被删除 (匹配 0 行) 时抛出 StaleDataError，
+        这里直接跳过这些行
+        """
+        table = OptionPosition.__table__
+        groups: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+        for row in positions:
+            values = {key: value for key, value in row.items() if key != "id"}
+            groups[tuple(sorted(values))].append(dict(values, b_id=row["id"]))
+        for rows in groups.values():
+            db.execute(table.update().where(table.c.id == bindparam("b_id")), rows)
+
+    @staticmethod
+    def _insert_alert_logs(db, alert_logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        插入报警日志，再把附带的通知连同日志 id 写入 outbox (幂等键重复的忽略)，
+        汇总报警的持仓写入关联表
+        """
+        rows = [{key: value for key, value in row.items() if key not in ("notifications", "position_ids")}
+                for row in alert_logs]
+        # 走 Core 表插入：ORM 批量插入会把显式的 None (sent_successfully 待投递) 替换成列默认值
+        table = AlertLog.__table__
+        if not any(row["notifications"] or row["position_ids"] for row in alert_logs):
+            db.execute(insert(table), rows)
+            return []
+
+        ids = db.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+
+        links = [{"alert_log_id": log_id, "position_id": position_id}
+                 for row, log_id in zip(alert_logs, ids) for position_id in row["position_ids"]]
+        if links:
+            db.execute(insert(AlertLogPosition), links)
+
+        outbox_rows = [dict(notification, alert_log_id=log_id)
+                       for row, log_id in zip(alert_logs, ids) for notification in row["notifications"]]
+        if outbox_rows:
+            inserted = set(db.execute(
+                sqlite_insert(NotificationOutbox)
+                .on_conflict_do_nothing(index_elements=["idempotency_key"])
+                .returning(NotificationOutbox.alert_log_id),
+                outbox_rows
+            ).scalars().all())
+            # 通知全部是重复入队 (幂等键已存在) 的报警：原报警已在投递，重复的日志不保留
+            duplicates = {row["alert_log_id"] for row in outbox_rows} - inserted
+            if duplicates:
+                db.execute(delete(table).where(table.c.id.in_(duplicates)))
+                outbox_rows = [row for row in outbox_rows if row["alert_log_id"] in inserted]
+        return outbox_rows
+
+    def _requeue(self, positions, daily_qqq, alert_logs, price_points):
+        with self._lock:
+            for row in positions:
+                newer = self._positions.get(row["id"], {})
+                merged = dict(row, **newer)
+                if "max_profit" in row and "max_profit" in newer:
+                    merged["max_profit"] = max(row["max_profit"], newer["max_profit"])
+                self._positions[row["id"]] = merged
+            for row in daily_qqq:
+                self._daily_qqq.setdefault(row["date"], row)
+            self._alert_logs = alert_logs + self._alert_logs
+            self._price_points = price_points + self._price_points
+
+
+_write_buffer = WriteBuffer()
+
+
+def get_write_buffer() -> WriteBuffer:
+    return _write_buffer
+
+
+def flush_pending():
+    """关闭时调用：尽力写出缓冲中剩余的数据"""
+    try:
+        _write_buffer.flush()
+    except Exception as e:
+        logger.error(f"[ERROR] Final write buffer flush failed, {_write_buffer.pending()} rows lost: {e}")
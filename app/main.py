@@ -1,25 +1,50 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 from typing import Optional
-from datetime import date
-
-from app.database.init_db import init_db, get_db, engine, SessionLocal
-from app.database.models import Configuration, OptionPosition, AlertLog
+from datetime import date, datetime
+import json
+import time
+
+from app.database.init_db import init_db, init_lock, get_db, get_read_db, session_scope, read_session_scope
+from app.database.models import Configuration, OptionPosition, AlertLog, WatchlistSymbol, Portfolio
+from app.database.queries import (
+    list_alert_logs, search_alert_logs, list_watchlist, normalize_symbol,
+    list_portfolios, default_portfolio_id, DEFAULT_PORTFOLIO_NAME, data_versions, serialize_position,
+    InvalidCursor, InvalidSearchQuery, InvalidSymbol
+)
+from app.database import price_history
+from app.database.write_buffer import get_write_buffer
 from app.config import get_config
 from app.market.polygon_client import CachedPolygonClient
 from app.market.data_fetcher import DataFetcher
-from app.scheduler.jobs import start_scheduler, stop_scheduler
+from app.market.snapshot import get_market_snapshot, SNAPSHOT_MAX_AGE_SECONDS
+from app.market import web_fetch
+from app.market.live_feed import TooManyClients, get_live_feed
+from app.notification import outbox
+from app.scheduler.jobs import start_scheduler, pause_scheduler, stop_scheduler
+from app.scheduler import leader
 from app.scheduler.trading_hours import is_market_open_now, get_current_time_et
+from app.monitoring import metrics
+from app.monitoring.health import get_health
+from app.monitoring.health_sampler import get_health_sampler
+from app.monitoring.profiler import ProfilingMiddleware, get_profiler
 from app.admin.auth import (
     get_password_hash, verify_admin_password, is_first_time_setup,
     authenticate_admin
 )
+from app.admin.conditional import (
+    TEMPLATE_VERSION, PathExcludingGZipMiddleware, make_etag, etag_matches, cache_headers, not_modified
+)
 
 app = FastAPI(title="QQQ Option Alert System")
+app.add_middleware(ProfilingMiddleware)
+# 超过 1KB 的响应按客户端 Accept-Encoding 做 gzip (流式响应逐块压缩)；SSE 逐条推送，不压缩
+app.add_middleware(PathExcludingGZipMiddleware, minimum_size=1000, exclude_paths=("/api/live",))
 
 templates = Jinja2Templates(directory="app/admin/templates")
 security = HTTPBasic()
@@ -33,57 +58,94 @@ config: Optional[get_config] = None
 async def startup_event():
     global polygon_client, data_fetcher, config
 
-    init_db()
-
-    db = SessionLocal()
+    # 多 worker 同时启动时建表、迁移和默认数据初始化依次进行
+    with init_lock():
+        init_db()
+
+        with session_scope() as db:
+            config_db = db.query(Configuration).first()
+            if not config_db:
+                config_db = Configuration(
+                    admin_password_hash="",
+                    polygon_api_key="",
+                    wechat_webhook_url=""
+                )
+                db.add(config_db)
+                db.commit()
 
-    try:
-        config_db = db.query(Configuration).first()
-        if not config_db:
-            config_db = Configuration(
-                admin_password_hash="",
-                polygon_api_key="",
-                wechat_webhook_url=""
-            )
-            db.add(config_db)
-            db.commit()
+            if not db.query(WatchlistSymbol).first():
+                db.add(WatchlistSymbol(symbol="QQQ", enabled=True))
+                db.commit()
 
-        db.refresh(config_db)
+            # 默认组合沿用全局 Webhook 和规则开关；升级前的持仓 (portfolio_id 为 NULL) 归入该组合
+            if not db.query(Portfolio).first():
+                db.add(Portfolio(name=DEFAULT_PORTFOLIO_NAME))
+                db.commit()
 
-        config_dict = {
-            "polygon_api_key": config_db.polygon_api_key,
-            "wechat_webhook_url": config_db.wechat_webhook_url,
-            # New entry rules
-            "entry_level1_enabled": getattr(config_db, 'entry_level1_enabled', None),
-            "entry_level2_enabled": getattr(config_db, 'entry_level2_enabled', None),
-            "entry_level3_enabled": getattr(config_db, 'entry_level3_enabled', None),
-            # New exit rules
-            "exit_hard_tp_enabled": getattr(config_db, 'exit_hard_tp_enabled', None),
-            "exit_fast_tp_enabled": getattr(config_db, 'exit_fast_tp_enabled', None),
-            "exit_trailing_tp_enabled": getattr(config_db, 'exit_trailing_tp_enabled', None),
-            "exit_tech_tp_enabled": getattr(config_db, 'exit_tech_tp_enabled', None),
-            "exit_dte_warning_enabled": getattr(config_db, 'exit_dte_warning_enabled', None),
-            "exit_dte_force_enabled": getattr(config_db, 'exit_dte_force_enabled', None),
-            "exit_trend_stop_enabled": getattr(config_db, 'exit_trend_stop_enabled', None),
-            # Parameters
-            "alert_log_retention_days": config_db.alert_log_retention_days,
-            "daily_qqq_data_retention_days": config_db.daily_qqq_data_retention_days,
-        }
+            db.refresh(config_db)
+
+            config_dict = {
+                "polygon_api_key": config_db.polygon_api_key,
+                "wechat_webhook_url": config_db.wechat_webhook_url,
+                # New entry rules
+                "entry_level1_enabled": getattr(config_db, 'entry_level1_enabled', None),
+                "entry_level2_enabled": getattr(config_db, 'entry_level2_enabled', None),
+                "entry_level3_enabled": getattr(config_db, 'entry_level3_enabled', None),
+                # New exit rules
+                "exit_hard_tp_enabled": getattr(config_db, 'exit_hard_tp_enabled', None),
+                "exit_fast_tp_enabled": getattr(config_db, 'exit_fast_tp_enabled', None),
+                "exit_trailing_tp_enabled": getattr(config_db, 'exit_trailing_tp_enabled', None),
+                "exit_tech_tp_enabled": getattr(config_db, 'exit_tech_tp_enabled', None),
+                "exit_dte_warning_enabled": getattr(config_db, 'exit_dte_warning_enabled', None),
+                "exit_dte_force_enabled": getattr(config_db, 'exit_dte_force_enabled', None),
+                "exit_trend_stop_enabled": getattr(config_db, 'exit_trend_stop_enabled', None),
+                # Parameters
+                "alert_log_retention_days": config_db.alert_log_retention_days,
+                "daily_qqq_data_retention_days": config_db.daily_qqq_data_retention_days,
+            }
 
-        config = get_config(config_dict)
+    config = get_config(config_dict)
 
-        polygon_client = CachedPolygonClient(config.get_polygon_api_key())
-        data_fetcher = DataFetcher(polygon_client, db)
+    polygon_client = CachedPolygonClient(config.get_polygon_api_key())
+    data_fetcher = DataFetcher(polygon_client)
 
-        start_scheduler(data_fetcher, db, config)
+    get_health_sampler().start()
 
-    finally:
-        db.close()
+    # 所有 worker 都提供 HTTP 服务，只有持有租约的 leader 运行调度任务
+    get_health().report("scheduler", "standby")
+    leader.start_election(
+        config.get_leader_lease_seconds(),
+        on_elected=lambda: start_scheduler(data_fetcher, config),
+        on_demoted=pause_scheduler
+    )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    leader.stop_election()
     stop_scheduler()
+    get_health_sampler().stop()
+
+
+def _latest_qqq_data() -> dict:
+    """
+    QQQ 行情和指标：优先读 leader 发布的共享快照 (无锁、无网络请求)
+
+    快照尚未发布，或盘中超过 SNAPSHOT_MAX_AGE_SECONDS 未更新 (leader 异常) 时才自行请求
+    (在行情线程池中执行，有并发和超时上限)；请求超时或积压时退回旧快照。
+    """
+    snapshot = get_market_snapshot().read()
+    if snapshot and snapshot.get("qqq"):
+        if not is_market_open_now() or time.time() - snapshot["published_at"] < SNAPSHOT_MAX_AGE_SECONDS:
+            return snapshot["qqq"]
+    if data_fetcher:
+        try:
+            return web_fetch.fetch(data_fetcher.get_qqq_data)
+        except web_fetch.FetchUnavailable:
+            if snapshot and snapshot.get("qqq"):
+                return snapshot["qqq"]
+            raise
+    return {}
 
 
 @app.get("/")
@@ -93,58 +155,36 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "market_open": is_market_open_now()}
+    """探活 (Docker HEALTHCHECK)：只读内存中的组件状态，不查库、不请求行情"""
+    return {"status": get_health().overall(), "market_open": is_market_open_now()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/health/detailed")
-async def health_detailed(db: Session = Depends(get_db)):
+async def health_detailed():
     """
-    Detailed health check - checks all critical components
-    """
-    results = {
-        "status": "healthy",
-        "components": {}
-    }
+    Detailed health check - 各组件上报的最近状态 (见 app/monitoring/health.py)
 
-    # Check database
-    try:
-        from sqlalchemy import text
-        db.execute(text("SELECT 1"))
-        results["components"]["database"] = {"status": "ok"}
-    except Exception as e:
-        results["components"]["database"] = {"status": "error", "message": str(e)}
-        results["status"] = "degraded"
-
-    # Check scheduler
-    from app.scheduler.jobs import scheduler
-    results["components"]["scheduler"] = {
-        "status": "running" if scheduler.running else "stopped"
+    数据库延迟、快照新鲜度、发件箱积压由后台线程定期采样，调度器状态来自任务执行事件，
+    数据源状态来自实际的行情请求；本接口只读内存，不产生任何查询或上游请求。
+    """
+    components = get_health().components()
+    elector = leader.get_elector()
+    if elector and "scheduler" in components:
+        components["scheduler"]["leader"] = elector.status()
+    return {
+        "status": get_health().overall(components),
+        "market_open": is_market_open_now(),
+        "components": components,
     }
 
-    # Check market data sources
-    if data_fetcher:
-        try:
-            qqq_data = data_fetcher.get_qqq_data()
-            results["components"]["qqq_data"] = {
-                "status": "ok" if qqq_data.get("last_price") else "no_data"
-            }
-        except Exception as e:
-            results["components"]["qqq_data"] = {"status": "error", "message": str(e)}
-            results["status"] = "degraded"
-
-    # Count positions
-    try:
-        from app.database.models import OptionPosition
-        count = db.query(OptionPosition).count()
-        results["components"]["positions"] = {"status": "ok", "count": count}
-    except Exception as e:
-        results["components"]["positions"] = {"status": "error", "message": str(e)}
-
-    return results
-
 
 @app.get("/setup", response_class=HTMLResponse)
-async def setup_page(request: Request, db: Session = Depends(get_db)):
+def setup_page(request: Request, db: Session = Depends(get_read_db)):
     if not is_first_time_setup(db):
         return RedirectResponse(url="/admin/login", status_code=302)
 
@@ -152,7 +192,7 @@ async def setup_page(request: Request, db: Session = Depends(get_db)):
 
 
 @app.post("/setup")
-async def setup(request: Request, password: str = Form(...), db: Session = Depends(get_db)):
+def setup(request: Request, password: str = Form(...), db: Session = Depends(get_db)):
     try:
         if not is_first_time_setup(db):
             return RedirectResponse(url="/admin/login", status_code=302)
@@ -178,7 +218,7 @@ async def setup(request: Request, password: str = Form(...), db: Session = Depen
 
 
 @app.get("/admin/login", response_class=HTMLResponse)
-async def login_page(request: Request, db: Session = Depends(get_db)):
+def login_page(request: Request, db: Session = Depends(get_read_db)):
     if is_first_time_setup(db):
         return RedirectResponse(url="/setup", status_code=302)
 
@@ -186,10 +226,10 @@ async def login_page(request: Request, db: Session = Depends(get_db)):
 
 
 @app.post("/admin/login")
-async def login(
+def login(
     request: Request,
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     if verify_admin_password(password, db):
         response = RedirectResponse(url="/admin", status_code=303)
@@ -214,24 +254,33 @@ def verify_admin_cookie(request: Request):
 
 
 @app.get("/admin", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+def dashboard(request: Request, db: Session = Depends(get_read_db)):
     if not verify_admin_cookie(request):
         return RedirectResponse(url="/admin/login", status_code=302)
 
+    # 页面行情来自共享快照时才能按版本判断是否变化；快照缺失或过期时会自行请求行情，不做条件响应
+    etag = None
+    market_open = is_market_open_now()
+    snapshot = get_market_snapshot().read()
+    if snapshot and snapshot.get("qqq") and (
+            not market_open or time.time() - snapshot["published_at"] < SNAPSHOT_MAX_AGE_SECONDS):
+        etag = make_etag("dashboard.html", TEMPLATE_VERSION, data_versions(db, "option_positions", "alert_logs"),
+                         snapshot["version"], market_open, get_current_time_et().date(), data_fetcher is not None)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
     positions_count = db.query(OptionPosition).count()
     today_logs = db.query(AlertLog).filter(
         AlertLog.triggered_at >= get_current_time_et().replace(hour=0, minute=0, second=0, microsecond=0)
     ).count()
 
-    market_open = is_market_open_now()
-    
     qqq_price = None
     rsi = None
     is_above_sma200 = None
     
     if data_fetcher:
         try:
-            qqq_data = data_fetcher.get_qqq_data()
+            qqq_data = _latest_qqq_data()
             if qqq_data:
                 qqq_price = qqq_data.get("last_price")
                 rsi = qqq_data.get("rsi")
@@ -240,7 +289,8 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
         except Exception as e:
             print(f"Market data fetch error: {e}")
 
-    return templates.TemplateResponse(request=request, name="dashboard.html", context={
+    return templates.TemplateResponse(request=request, name="dashboard.html",
+                                      headers=cache_headers(etag) if etag else None, context={
         "request": request,
         "positions_count": positions_count,
         "today_logs": today_logs,
@@ -251,23 +301,74 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
     })
 
 
+def _positions_query(db: Session, portfolio_id: Optional[int], default_id: int):
+    """持仓列表查询，portfolio_id 为空时不筛选；默认组合包含未分配组合的旧持仓"""
+    query = db.query(OptionPosition)
+    if portfolio_id is not None:
+        if portfolio_id == default_id:
+            query = query.filter(or_(OptionPosition.portfolio_id == portfolio_id, OptionPosition.portfolio_id.is_(None)))
+        else:
+            query = query.filter(OptionPosition.portfolio_id == portfolio_id)
+    return query
+
+
 @app.get("/admin/positions", response_class=HTMLResponse)
-async def positions(request: Request, db: Session = Depends(get_db)):
+def positions(request: Request, portfolio_id: Optional[int] = None, db: Session = Depends(get_read_db)):
     if not verify_admin_cookie(request):
         return RedirectResponse(url="/admin/login", status_code=302)
 
-    positions = db.query(OptionPosition).order_by(OptionPosition.created_at.desc()).all()
     today = get_current_time_et().date()
+    etag = make_etag("positions.html", TEMPLATE_VERSION,
+                     data_versions(db, "option_positions", "portfolios", "watchlist_symbols"), portfolio_id, today)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    return templates.TemplateResponse(request=request, name="positions.html", context={
+    portfolios = list_portfolios(db)
+    default_id = default_portfolio_id(db)
+    positions = _positions_query(db, portfolio_id, default_id).order_by(OptionPosition.created_at.desc()).all()
+
+    return templates.TemplateResponse(request=request, name="positions.html", headers=cache_headers(etag), context={
         "request": request,
         "positions": positions,
-        "today": today
+        "today": today,
+        "portfolios": portfolios,
+        "portfolio_names": {p["id"]: p["name"] for p in portfolios},
+        "default_portfolio_id": default_id,
+        "selected_portfolio_id": portfolio_id,
+        "symbols": sorted({item["symbol"] for item in list_watchlist(db)} | {"QQQ"})
     })
 
 
+def _stream_positions(portfolio_id: Optional[int], today: date):
+    """逐条序列化持仓并输出 JSON 数组，不在内存里拼出整个列表"""
+    # 独立的只读会话：请求的依赖会话在响应开始发送前就已关闭。
+    # 这里读到的数据只会比 ETag 对应的版本新，客户端下次验证时版本不符会重新下载，不会缓存旧内容
+    with read_session_scope() as db:
+        default_id = default_portfolio_id(db)
+        query = _positions_query(db, portfolio_id, default_id).order_by(OptionPosition.created_at.desc())
+        yield '{"success":true,"default_portfolio_id":%s,"positions":[' % json.dumps(default_id)
+        for i, position in enumerate(query.yield_per(200)):
+            yield ("," if i else "") + json.dumps(serialize_position(position, today), separators=(",", ":"))
+        yield "]}"
+
+
+@app.get("/api/positions")
+def api_positions(request: Request, portfolio_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    """持仓列表 JSON (含盈亏和 DTE)；带 If-None-Match 且数据未变时返回 304"""
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    today = get_current_time_et().date()
+    etag = make_etag("positions", data_versions(db, "option_positions", "portfolios"), portfolio_id, today)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    return StreamingResponse(_stream_positions(portfolio_id, today), media_type="application/json",
+                             headers=cache_headers(etag))
+
+
 @app.post("/admin/positions")
-async def add_position(
+def add_position(
     request: Request,
     underlying: str = Form("QQQ"),
     option_type: str = Form(...),
@@ -276,6 +377,7 @@ async def add_position(
     entry_price: float = Form(...),
     quantity: Optional[int] = Form(None),
     entry_date: str = Form(...),
+    portfolio_id: Optional[int] = Form(None),
     db: Session = Depends(get_db)
 ):
     if not verify_admin_cookie(request):
@@ -297,7 +399,8 @@ async def add_position(
             expiration_date=exp_date_obj,
             entry_price=entry_price,
             quantity=quantity if quantity and quantity > 0 else 1,
-            entry_date=date.fromisoformat(entry_date)
+            entry_date=date.fromisoformat(entry_date),
+            portfolio_id=portfolio_id or default_portfolio_id(db)
         )
 
         db.add(position)
@@ -311,7 +414,7 @@ async def add_position(
 
 
 @app.post("/admin/positions/{position_id}/delete")
-async def delete_position(
+def delete_position(
     position_id: int,
     request: Request,
     db: Session = Depends(get_db)
@@ -321,22 +424,28 @@ async def delete_position(
 
     position = db.query(OptionPosition).filter(OptionPosition.id == position_id).first()
     if position:
+        # 先丢弃缓冲中的报价，提交后才到的报价由 price_history.append_chunks 跳过
+        get_write_buffer().discard_position(position_id)
         db.delete(position)
+        price_history.delete_history(db, position_id)
         db.commit()
 
     return RedirectResponse(url="/admin/positions", status_code=303)
 
 
 @app.post("/admin/positions/{position_id}/refresh")
-async def refresh_position_price(
-    position_id: int,
-    request: Request,
-    db: Session = Depends(get_db)
-):
+def refresh_position_price(position_id: int, request: Request):
+    """
+    手动刷新持仓报价
+
+    读持仓、拉报价、写回分三步，拉报价期间不占用数据库连接；报价请求在行情线程池中执行，
+    超时或积压时直接返回错误，不阻塞其他请求。
+    """
     if not verify_admin_cookie(request):
         return {"success": False, "error": "Unauthorized"}
 
-    position = db.query(OptionPosition).filter(OptionPosition.id == position_id).first()
+    with read_session_scope() as db:
+        position = db.query(OptionPosition).filter(OptionPosition.id == position_id).first()
     if not position:
         return {"success": False, "error": "Position not found"}
 
@@ -344,37 +453,169 @@ async def refresh_position_price(
         return {"success": False, "error": "Data fetcher not initialized"}
 
     try:
-        current_price = data_fetcher.get_option_current_price(position)
+        current_price = web_fetch.fetch(data_fetcher.get_option_current_price, position)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+    if current_price is None:
+        return {"success": False, "error": "Failed to fetch price"}
+
+    try:
+        with session_scope() as db:
+            position = db.query(OptionPosition).filter(OptionPosition.id == position_id).first()
+            if not position:
+                return {"success": False, "error": "Position not found"}
+            updated_at = get_current_time_et()
+            result = _apply_quote(position, current_price, updated_at)
+        get_write_buffer().add_price_point(position_id, current_price, updated_at)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
 
-        if current_price is not None:
-            from datetime import datetime
-            position.current_price = current_price
-            position.last_price_update = get_current_time_et()
-            db.commit()
+    return {"success": True, **result}
 
-            pnl_amount = (current_price - position.entry_price) * (position.quantity or 1) * 100
-            pnl_pct = ((current_price - position.entry_price) / position.entry_price * 100) if position.entry_price > 0 else 0
 
-            current_pnl_decimal = pnl_pct / 100.0
-            if current_pnl_decimal > (position.max_profit or 0.0):
-                position.max_profit = current_pnl_decimal
-                db.commit()
+def _apply_quote(position: OptionPosition, current_price: float, updated_at: datetime) -> dict:
+    """报价写入持仓 (现价、更新时间、最高收益)，返回页面展示的盈亏"""
+    position.current_price = current_price
+    position.last_price_update = updated_at
 
-            return {
-                "success": True,
-                "current_price": current_price,
-                "pnl_amount": pnl_amount,
-                "pnl_pct": pnl_pct,
-                "max_profit_pct": (position.max_profit or 0.0) * 100
-            }
+    pnl_amount = (current_price - position.entry_price) * (position.quantity or 1) * 100
+    pnl_pct = ((current_price - position.entry_price) / position.entry_price * 100) if position.entry_price > 0 else 0
+
+    current_pnl_decimal = pnl_pct / 100.0
+    if current_pnl_decimal > (position.max_profit or 0.0):
+        position.max_profit = current_pnl_decimal
+    return {
+        "current_price": current_price,
+        "pnl_amount": pnl_amount,
+        "pnl_pct": pnl_pct,
+        "max_profit_pct": (position.max_profit or 0.0) * 100
+    }
+
+
+@app.post("/admin/positions/refresh")
+def refresh_all_position_prices(request: Request, portfolio_id: Optional[int] = None):
+    """
+    批量刷新持仓报价 (portfolio_id 为空时刷新全部持仓)
+
+    一次 Yahoo Finance 批量请求拿到所有合约的价格，没拿到的再逐个走 Polygon.io (受备选预算限制)。
+    响应为 NDJSON 流，每拿到一个持仓的结果输出一行 {"position_id", "success", ...}；
+    全部报价在一个事务中写回，最后一行 {"done": true, "success", "updated", "failed"} 表示写库结果。
+    """
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    if not data_fetcher:
+        return JSONResponse({"success": False, "error": "Data fetcher not initialized"}, status_code=503)
+
+    with read_session_scope() as db:
+        positions = _positions_query(db, portfolio_id, default_portfolio_id(db)).order_by(OptionPosition.id).all()
+
+    return StreamingResponse(_stream_bulk_refresh(positions), media_type="application/x-ndjson")
+
+
+def _stream_bulk_refresh(positions: list):
+    def line(payload: dict) -> str:
+        return json.dumps(payload) + "\n"
+
+    updated_at = get_current_time_et()
+    prices = {}
+
+    try:
+        batch = web_fetch.fetch(data_fetcher.get_option_prices_batch, positions) if positions else {}
+    except Exception as e:
+        print(f"[WARN] Batch option quote failed, falling back per contract: {e}")
+        batch = {}
+
+    missing = []
+    for position in positions:
+        if position.id in batch:
+            prices[position.id] = batch[position.id]
+            # position 为只读会话取出的游离对象，这里只用来计算展示值
+            yield line({"position_id": position.id, "success": True,
+                        **_apply_quote(position, batch[position.id], updated_at)})
         else:
-            return {"success": False, "error": "Failed to fetch price"}
+            missing.append(position)
+
+    # 同一合约只走一次备选
+    fallback = {}
+    deadline = time.monotonic() + web_fetch.WEB_FETCH_FALLBACK_BUDGET_SECONDS
+    for position in missing:
+        contract = (position.underlying, position.option_type, position.expiration_date, position.strike_price)
+        if contract not in fallback:
+            if time.monotonic() >= deadline:
+                fallback[contract] = (None, "Fallback budget exhausted")
+            else:
+                try:
+                    price = web_fetch.fetch(data_fetcher.get_option_polygon_price, position)
+                    fallback[contract] = (price, None if price is not None else "Failed to fetch price")
+                except Exception as e:
+                    fallback[contract] = (None, str(e))
+        price, error = fallback[contract]
+        if price is None:
+            yield line({"position_id": position.id, "success": False, "error": error})
+            continue
+        prices[position.id] = price
+        yield line({"position_id": position.id, "success": True, **_apply_quote(position, price, updated_at)})
+
+    try:
+        if prices:
+            with session_scope() as db:
+                for position in db.query(OptionPosition).filter(OptionPosition.id.in_(list(prices))):
+                    _apply_quote(position, prices[position.id], updated_at)
+            write_buffer = get_write_buffer()
+            with write_buffer.batch():
+                for position_id, price in prices.items():
+                    write_buffer.add_price_point(position_id, price, updated_at)
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        yield line({"done": True, "success": False, "error": str(e), "updated": 0, "failed": len(positions)})
+        return
+
+    yield line({"done": True, "success": True, "updated": len(prices), "failed": len(positions) - len(prices)})
+
+
+@app.get("/api/positions/{position_id}/history")
+def api_position_history(
+    position_id: int,
+    request: Request,
+    resolution: str = "auto",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    持仓报价历史：daily 为日线 OHLC，points 为最近几天的原始报价
+
+    resolution: auto (默认) / daily / raw
+    """
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    if resolution not in ("auto", "daily", "raw"):
+        return JSONResponse({"success": False, "error": f"Invalid resolution: {resolution}"}, status_code=400)
+
+    position = db.query(OptionPosition).filter(OptionPosition.id == position_id).first()
+    if not position:
+        return JSONResponse({"success": False, "error": "Position not found"}, status_code=404)
+
+    try:
+        start_date = date.fromisoformat(start) if start else None
+        end_date = date.fromisoformat(end) if end else None
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    history = price_history.get_history(db, position_id, start_date, end_date, resolution)
+    return {
+        "success": True,
+        "position_id": position_id,
+        "entry_price": position.entry_price,
+        "max_profit": position.max_profit,
+        **history
+    }
 
 
 @app.get("/admin/rules", response_class=HTMLResponse)
-async def rules(request: Request, db: Session = Depends(get_db)):
+def rules(request: Request, db: Session = Depends(get_read_db)):
     if not verify_admin_cookie(request):
         return RedirectResponse(url="/admin/login", status_code=302)
 
@@ -382,12 +623,14 @@ async def rules(request: Request, db: Session = Depends(get_db)):
 
     return templates.TemplateResponse(request=request, name="rules.html", context={
         "request": request,
-        "config": config_db
+        "config": config_db,
+        "watchlist": list_watchlist(db),
+        "portfolios": list_portfolios(db)
     })
 
 
 @app.post("/admin/rules")
-async def update_rules(
+def update_rules(
     request: Request,
     # New entry rules
     entry_level1_enabled: bool = Form(False),
@@ -425,14 +668,321 @@ async def update_rules(
     return RedirectResponse(url="/admin/rules", status_code=303)
 
 
-@app.get("/admin/logs", response_class=HTMLResponse)
-async def logs(request: Request, db: Session = Depends(get_db)):
+@app.get("/api/watchlist")
+def api_watchlist(request: Request, db: Session = Depends(get_read_db)):
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    return {"success": True, "items": list_watchlist(db)}
+
+
+@app.get("/api/market")
+async def api_market(request: Request):
+    """leader 最近一次发布的行情快照 (watchlist 指标 + 持仓报价)"""
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    snapshot = get_market_snapshot().read()
+    if snapshot is None:
+        return {"success": False, "error": "No market snapshot published yet"}
+
+    etag = make_etag("market", snapshot["version"], snapshot["published_at"])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return JSONResponse({"success": True, **snapshot}, headers=cache_headers(etag))
+
+
+@app.get("/api/live")
+async def api_live(request: Request):
+    """实时推送 (SSE)：QQQ 指标、持仓报价 / 盈亏的变化和新报警，断线重连时按 Last-Event-ID 续传"""
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    try:
+        stream = await get_live_feed().subscribe(request.headers.get("last-event-id"))
+    except TooManyClients as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=503)
+    return StreamingResponse(stream, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/outbox")
+def api_outbox(request: Request, db: Session = Depends(get_read_db)):
+    """通知发件箱：各状态数量和最近的死信"""
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    return {"success": True, **outbox.summary(db)}
+
+
+@app.post("/api/outbox/{outbox_id}/retry")
+def retry_outbox(outbox_id: int, request: Request, db: Session = Depends(get_db)):
+    """死信重新入队"""
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    if not outbox.requeue(db, outbox_id):
+        return JSONResponse({"success": False, "error": "Dead-lettered notification not found"}, status_code=404)
+    db.commit()
+    return {"success": True}
+
+
+@app.post("/admin/watchlist")
+def add_watchlist_symbol(
+    request: Request,
+    symbol: str = Form(...),
+    db: Session = Depends(get_db)
+):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
+
+    try:
+        symbol = normalize_symbol(symbol)
+    except InvalidSymbol as e:
+        print(f"添加监控标的错误: {e}")
+        return RedirectResponse(url="/admin/rules", status_code=303)
+
+    existing = db.query(WatchlistSymbol).filter(WatchlistSymbol.symbol == symbol).first()
+    if existing:
+        existing.enabled = True
+    else:
+        db.add(WatchlistSymbol(symbol=symbol, enabled=True))
+    db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+@app.post("/admin/watchlist/{symbol_id}/toggle")
+def toggle_watchlist_symbol(symbol_id: int, request: Request, db: Session = Depends(get_db)):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
+
+    item = db.query(WatchlistSymbol).filter(WatchlistSymbol.id == symbol_id).first()
+    if item:
+        item.enabled = not item.enabled
+        db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+@app.post("/admin/watchlist/{symbol_id}/delete")
+def delete_watchlist_symbol(symbol_id: int, request: Request, db: Session = Depends(get_db)):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
+
+    item = db.query(WatchlistSymbol).filter(WatchlistSymbol.id == symbol_id).first()
+    if item:
+        db.delete(item)
+        db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+def _optional_bool(value: str) -> Optional[bool]:
+    """组合规则开关的三态表单值: inherit (沿用全局) / on / off"""
+    return {"on": True, "off": False}.get(value)
+
+
+@app.get("/api/portfolios")
+def api_portfolios(request: Request, db: Session = Depends(get_read_db)):
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    return {"success": True, "items": list_portfolios(db)}
+
+
+@app.post("/admin/portfolios")
+def add_portfolio(
+    request: Request,
+    name: str = Form(...),
+    wechat_webhook_url: str = Form(""),
+    db: Session = Depends(get_db)
+):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
+
+    name = name.strip()
+    if name and not db.query(Portfolio).filter(Portfolio.name == name).first():
+        db.add(Portfolio(name=name, wechat_webhook_url=wechat_webhook_url.strip() or None))
+        db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+@app.post("/admin/portfolios/{portfolio_id}")
+def update_portfolio(
+    portfolio_id: int,
+    request: Request,
+    wechat_webhook_url: str = Form(""),
+    enabled: bool = Form(False),
+    entry_alerts_enabled: bool = Form(False),
+    exit_hard_tp_enabled: str = Form("inherit"),
+    exit_dte_force_enabled: str = Form("inherit"),
+    exit_trend_stop_enabled: str = Form("inherit"),
+    db: Session = Depends(get_db)
+):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
+
+    portfolio = db.query(Portfolio).filter(Portfolio.id == portfolio_id).first()
+    if portfolio:
+        portfolio.wechat_webhook_url = wechat_webhook_url.strip() or None
+        portfolio.enabled = enabled
+        portfolio.entry_alerts_enabled = entry_alerts_enabled
+        portfolio.exit_hard_tp_enabled = _optional_bool(exit_hard_tp_enabled)
+        portfolio.exit_dte_force_enabled = _optional_bool(exit_dte_force_enabled)
+        portfolio.exit_trend_stop_enabled = _optional_bool(exit_trend_stop_enabled)
+        db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+@app.post("/admin/portfolios/{portfolio_id}/delete")
+def delete_portfolio(portfolio_id: int, request: Request, db: Session = Depends(get_db)):
     if not verify_admin_cookie(request):
         return RedirectResponse(url="/admin/login", status_code=302)
 
-    logs = db.query(AlertLog).order_by(AlertLog.triggered_at.desc()).limit(100).all()
+    # 默认组合和仍有持仓的组合不能删除
+    portfolio = db.query(Portfolio).filter(Portfolio.id == portfolio_id).first()
+    has_positions = db.query(OptionPosition.id).filter(OptionPosition.portfolio_id == portfolio_id).first()
+    if portfolio and portfolio_id != default_portfolio_id(db) and not has_positions:
+        db.delete(portfolio)
+        db.commit()
+
+    return RedirectResponse(url="/admin/rules", status_code=303)
+
+
+@app.get("/admin/logs", response_class=HTMLResponse)
+async def logs(request: Request):
+    if not verify_admin_cookie(request):
+        return RedirectResponse(url="/admin/login", status_code=302)
 
+    # 列表由页面通过 /api/logs 分页加载
     return templates.TemplateResponse(request=request, name="logs.html", context={
-        "request": request,
-        "logs": logs
+        "request": request
     })
+
+
+def _parse_date_param(value: Optional[str]):
+    """接受 YYYY-MM-DD 或 ISO 8601 日期时间"""
+    if not value:
+        return None
+    if len(value) == 10:
+        return date.fromisoformat(value)
+    return datetime.fromisoformat(value)
+
+
+@app.get("/api/logs")
+def api_logs(
+    request: Request,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    alert_type: Optional[str] = None,
+    rule_name: Optional[str] = None,
+    position_id: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    提醒日志 JSON API (keyset 分页)
+
+    按时间倒序返回一页日志；把响应中的 next_cursor 作为 cursor 传回即可取下一页。
+    """
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    etag = make_etag("logs", data_versions(db, "alert_logs"), sorted(request.query_params.multi_items()))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        page = list_alert_logs(
+            db,
+            limit=limit,
+            cursor=cursor,
+            alert_type=alert_type,
+            rule_name=rule_name,
+            position_id=position_id,
+            start=_parse_date_param(start),
+            end=_parse_date_param(end)
+        )
+    except (InvalidCursor, ValueError) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    return JSONResponse({"success": True, **page}, headers=cache_headers(etag))
+
+
+@app.get("/api/logs/search")
+def api_logs_search(
+    request: Request,
+    q: str = "",
+    limit: int = 20,
+    offset: int = 0,
+    db: Session = Depends(get_read_db)
+):
+    """
+    提醒日志全文检索 (FTS5，按相关度排序)
+
+    示例: q=QQQ270115C00610000、q="Time Stop" DTE、q=rule_name:stop
+    """
+    if not verify_admin_cookie(request):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    etag = make_etag("logs/search", data_versions(db, "alert_logs"), sorted(request.query_params.multi_items()))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        page = search_alert_logs(db, q, limit=limit, offset=offset)
+    except InvalidSearchQuery as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    return JSONResponse({"success": True, **page}, headers=cache_headers(etag))
+
+
+@app.get("/admin/profiling")
+async def profiling_status(request: Request):
+    if not verify_admin_cookie(request):
+        return {"success": False, "error": "Unauthorized"}
+
+    return {"success": True, **get_profiler().status()}
+
+
+@app.post("/admin/profiling")
+async def start_profiling(
+    request: Request,
+    duration_seconds: int = Form(60),
+    mode: str = Form("sample"),
+    sample_rate: float = Form(1.0),
+    routes: str = Form("")
+):
+    """
+    打开一个有限时长的剖析窗口
+
+    routes 为逗号分隔的路由前缀 (如 "/admin,/health")，留空则只剖析调度任务。
+    mode 只作用于调度任务，路由总是以 sample 模式剖析；窗口对所有 worker 生效。
+    """
+    if not verify_admin_cookie(request):
+        return {"success": False, "error": "Unauthorized"}
+
+    try:
+        get_profiler().start(
+            duration_seconds,
+            mode=mode,
+            sample_rate=sample_rate,
+            route_prefixes=[r.strip() for r in routes.split(",")]
+        )
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+    return {"success": True, **get_profiler().status()}
+
+
+@app.post("/admin/profiling/stop")
+async def stop_profiling(request: Request):
+    if not verify_admin_cookie(request):
+        return {"success": False, "error": "Unauthorized"}
+
+    get_profiler().stop()
+    return {"success": True, **get_profiler().status()}
@@ -0,0 +1,138 @@
+"""
+日线缺口检测与补缺
+
+把列式存储中的日线与 NYSE 交易日历逐日比对，找出缺失的交易日，
+再把相邻的缺口合并成尽量少的区间请求 (先 yfinance，失败时 Polygon)，写回存储并标记来源。
+
+新上市的标的在上市前没有日线：补缺请求返回的第一根日线晚于请求起点、且存储中没有更早的日线时，
+把它记为该标的最早有数据的日期 (BarStore.first_available)，之前的交易日不再算缺口、不再重复请求。
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.market.bar_store import BarStore
+from app.scheduler.trading_hours import trading_sessions
+
+logger = logging.getLogger(__name__)
+
+# 两段缺口之间已有的交易日不超过该数时合并成一次请求：多拉几根已有的日线比多发一次请求便宜
+MERGE_WITHIN_SESSIONS = 5
+
+
+@dataclass
+class Gap:
+    start: date
+    end: date
+    missing: int      # 区间内缺失的交易日数
+    sessions: int     # 区间覆盖的交易日数 (含合并进来的已有交易日)
+
+
+@dataclass
+class BackfillReport:
+    ticker: str
+    missing_before: int = 0
+    missing_after: int = 0
+    gaps: List[Gap] = field(default_factory=list)
+    requests: int = 0
+    sources: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (f"{self.ticker}: {self.missing_before} missing sessions in {len(self.gaps)} ranges, "
+                f"{self.requests} requests ({', '.join(self.sources) or 'none'}), "
+                f"{self.missing_after} still missing")
+
+
+def _to_date(value: np.datetime64) -> date:
+    return pd.Timestamp(value).date()
+
+
+def find_missing_sessions(store: BarStore, ticker: str, start: date, end: date) -> np.ndarray:
+    """[start, end] 内存储中没有日线的交易日 (datetime64[D])；上市前的交易日不计"""
+    first_available = store.first_available(ticker)
+    if first_available is not None and first_available > start:
+        start = first_available
+    if start > end:
+        return np.empty(0, dtype="datetime64[D]")
+    sessions = trading_sessions(start, end)
+    stored = store.read(ticker, start=start, end=end).dates
+    return sessions[~np.isin(sessions, stored)]
+
+
+def coalesce_gaps(missing: np.ndarray, sessions: np.ndarray,
+                  merge_within: int = MERGE_WITHIN_SESSIONS) -> List[Gap]:
+    """把缺失的交易日合并成区间：在交易日序列中相邻 (或间隔不超过 merge_within) 的缺口归为一段"""
+    if not len(missing):
+        return []
+
+    positions = np.searchsorted(sessions, missing)
+    breaks = np.flatnonzero(np.diff(positions) > merge_within + 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(positions) - 1]])
+
+    return [
+        Gap(
+            start=_to_date(missing[s]),
+            end=_to_date(missing[e]),
+            missing=int(e - s + 1),
+            sessions=int(positions[e] - positions[s] + 1),
+        )
+        for s, e in zip(starts, ends)
+    ]
+
+
+def _polygon_frame(rows: list) -> Optional[pd.DataFrame]:
+    if not rows:
+        return None
+    df = pd.DataFrame(rows)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop("date")), name="Date")
+    return df.rename(columns={"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"})
+
+
+def _record_first_available(store: BarStore, ticker: str, gap: Gap, df: pd.DataFrame):
+    """请求区间开头没有返回日线、存储中也没有更早的日线时，第一根日线即为上市 (最早可得) 日期"""
+    first_returned = pd.Timestamp(df.index.min()).date()
+    if first_returned <= gap.start:
+        return
+    if len(store.read(ticker, end=first_returned - timedelta(days=1), last=1)):
+        return
+    store.set_first_available(ticker, first_returned)
+    logger.info(f"[BACKFILL] {ticker}: no bars before {first_returned}, earlier sessions are not gaps")
+
+
+def backfill(store: BarStore, ticker: str, start: date, end: date, yfinance_client, polygon_client=None,
+             merge_within: int = MERGE_WITHIN_SESSIONS) -> BackfillReport:
+    """检测 [start, end] 的缺口并逐段补齐；每段一次区间请求"""
+    report = BackfillReport(ticker=ticker)
+
+    sessions = trading_sessions(start, end)
+    missing = find_missing_sessions(store, ticker, start, end)
+    report.missing_before = len(missing)
+    report.gaps = coalesce_gaps(missing, sessions, merge_within)
+
+    for gap in report.gaps:
+        report.requests += 1
+        df = yfinance_client.get_daily_bars(ticker, gap.start, gap.end)
+        source = "yfinance"
+
+        if (df is None or df.empty) and polygon_client is not None:
+            report.requests += 1
+            df = _polygon_frame(polygon_client.get_daily_bars(ticker, gap.start, gap.end))
+            source = "polygon"
+
+        if df is None or df.empty:
+            logger.warning(f"[WARN] Backfill {ticker} {gap.start}..{gap.end}: no data from any provider")
+            continue
+
+        store.write(ticker, df, source=source)
+        _record_first_available(store, ticker, gap, df)
+        if source not in report.sources:
+            report.sources.append(source)
+        logger.info(f"[BACKFILL] {ticker} {gap.start}..{gap.end}: {len(df)} bars from {source}")
+
+    report.missing_after = len(find_missing_sessions(store, ticker, start, end)) if report.gaps else 0
+    return report
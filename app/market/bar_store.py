@@ -0,0 +1,320 @@
+"""
+列式日线存储 (memory-mapped NumPy)
+
+每个 ticker 一个目录，每列一个定长 dtype 的裸二进制文件，外加 meta.json 记录行数和当前代:
+
+    data/bars/QQQ/meta.json          {"rows": 6300, "generation": 3, "columns": [...]}
+    data/bars/QQQ/g3/date.bin        datetime64[D]，严格递增，作为日期索引
+    data/bars/QQQ/g3/close.bin       float64
+    ...
+
+- 读: np.memmap 映射各列，按日期二分查找后切片，返回的是映射视图 (零拷贝)，
+  只有实际访问的页才进入常驻内存
+- 写: 新数据全部晚于 (或等于) 已存的最后一天时直接在列尾覆盖/追加，然后原子替换 meta.json；
+  读者只看 meta 中的行数，追加中的尾部字节对其不可见。
+  插入到中间的数据 (补历史) 合并后写到新一代目录，再原子切换 meta，旧一代在下次切换时删除
+
+数据源确认最早没有日线的日期 (上市前) 记录在 data/bars/QQQ/listing.json，缺口检测不再把之前的交易日算作缺失。
+
+写入按 ticker 串行：进程内的线程锁加上 ticker 目录下锁文件的 flock。Web worker 在快照过期时
+也会拉行情并合并进存储，多个进程同时写同一 ticker 时依次进行，不会同时生成新一代、
+争抢 meta.json 或删除另一个写者正在使用的目录。
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境只跑单 worker
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+BAR_STORE_PATH = os.getenv(
+    "BAR_STORE_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "bars")
+)
+
+# 列名 -> dtype (little-endian，跨平台可直接映射)
+COLUMNS: Dict[str, np.dtype] = {
+    "date": np.dtype("<M8[D]"),
+    "open": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+    "source": np.dtype("u1"),
+}
+
+# 数据来源 (provenance)，存为 source 列的编码；旧版本写入的数据没有该列，读出为 unknown
+SOURCES = {"unknown": 0, "yfinance": 1, "polygon": 2, "realtime": 3}
+SOURCE_NAMES = {code: name for name, code in SOURCES.items()}
+
+# 与 yfinance / _process_qqq_df 一致的 DataFrame 列名
+FRAME_COLUMNS = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"}
+
+DateLike = Union[str, pd.Timestamp, np.datetime64, "datetime.date"]
+
+
+class Bars:
+    """一段日线的列视图；各列都是 numpy 数组 (映射视图或其切片)"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["date"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def dates(self) -> np.ndarray:
+        return self.columns["date"]
+
+    def to_frame(self) -> pd.DataFrame:
+        """转成以 Date 为索引的 DataFrame (列名与 yfinance 一致)，供指标计算使用"""
+        index = pd.DatetimeIndex(self.columns["date"].astype("datetime64[ns]"), name="Date")
+        return pd.DataFrame(
+            {frame_name: self.columns[name] for name, frame_name in FRAME_COLUMNS.items()},
+            index=index
+        )
+
+
+def _to_day(value: DateLike) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+class BarStore:
+    def __init__(self, root: str = BAR_STORE_PATH):
+        self.root = root
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # 元数据
+    # ------------------------------------------------------------------
+    def _ticker_dir(self, ticker: str) -> str:
+        return os.path.join(self.root, ticker.upper())
+
+    def _read_meta(self, ticker: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._ticker_dir(ticker), "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, ticker: str, meta: dict):
+        path = os.path.join(self._ticker_dir(ticker), "meta.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _write_lock(self, ticker: str):
+        """同一 ticker 的写入在进程内和进程间都串行执行"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            ticker_dir = self._ticker_dir(ticker)
+            os.makedirs(ticker_dir, exist_ok=True)
+            with open(os.path.join(ticker_dir, ".write.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _column_path(self, ticker: str, generation: int, column: str) -> str:
+        return os.path.join(self._ticker_dir(ticker), f"g{generation}", f"{column}.bin")
+
+    def tickers(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, "meta.json")))
+
+    def row_count(self, ticker: str) -> int:
+        meta = self._read_meta(ticker)
+        return meta["rows"] if meta else 0
+
+    # ------------------------------------------------------------------
+    # 读
+    # ------------------------------------------------------------------
+    def _map(self, ticker: str, meta: dict, column: str) -> np.ndarray:
+        rows = meta["rows"]
+        dtype = COLUMNS[column]
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        if column not in meta.get("columns", COLUMNS):
+            return np.zeros(rows, dtype=dtype)
+        return np.memmap(self._column_path(ticker, meta["generation"], column), dtype=dtype, mode="r", shape=(rows,))
+
+    def read(self, ticker: str, start: Optional[DateLike] = None, end: Optional[DateLike] = None,
+             last: Optional[int] = None) -> Bars:
+        """
+        读取 [start, end] (闭区间) 的日线；last 只取区间内最后 N 根
+
+        返回的列是只读映射视图，不会把整段历史读入内存。
+        """
+        meta = self._read_meta(ticker)
+        if not meta:
+            return Bars({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()})
+
+        dates = self._map(ticker, meta, "date")
+        lo = int(np.searchsorted(dates, _to_day(start), side="left")) if start is not None else 0
+        hi = int(np.searchsorted(dates, _to_day(end), side="right")) if end is not None else len(dates)
+        if last is not None:
+            lo = max(lo, hi - last)
+
+        return Bars({name: self._map(ticker, meta, name)[lo:hi] for name in COLUMNS})
+
+    def first_available(self, ticker: str) -> Optional[date]:
+        """数据源确认的最早有日线的日期 (之前的交易日没有数据，不算缺口)；未记录时为 None"""
+        try:
+            with open(os.path.join(self._ticker_dir(ticker), "listing.json")) as f:
+                return date.fromisoformat(json.load(f)["first_available"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set_first_available(self, ticker: str, day: date):
+        with self._write_lock(ticker):
+            path = os.path.join(self._ticker_dir(ticker), "listing.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"first_available": day.isoformat()}, f)
+            os.replace(tmp, path)
+
+    def last_date(self, ticker: str) -> Optional[pd.Timestamp]:
+        bars = self.read(ticker, last=1)
+        return pd.Timestamp(bars.dates[-1]) if len(bars) else None
+
+    # ------------------------------------------------------------------
+    # 写
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _normalize(df: pd.DataFrame, source: str) -> Dict[str, np.ndarray]:
+        """
+        DataFrame (Date 索引，Open/High/Low/Close/Volume 列) -> 按日期去重排序的列数组
+
+        df 带 Source 列时逐行记录来源，否则整批记为 source。
+        """
+        index = pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        dates = index.normalize().values.astype("datetime64[D]")
+
+        columns = {"date": dates}
+        for name, frame_name in FRAME_COLUMNS.items():
+            if frame_name in df.columns:
+                columns[name] = df[frame_name].to_numpy(dtype=COLUMNS[name], na_value=np.nan)
+            else:
+                columns[name] = np.full(len(df), np.nan, dtype=COLUMNS[name])
+        if "Source" in df.columns:
+            columns["source"] = df["Source"].map(SOURCES).fillna(0).to_numpy(dtype=COLUMNS["source"])
+        else:
+            columns["source"] = np.full(len(df), SOURCES[source], dtype=COLUMNS["source"])
+
+        # 同一天保留最后一行
+        order = np.argsort(dates, kind="stable")
+        columns = {name: values[order] for name, values in columns.items()}
+        keep = np.append(columns["date"][1:] != columns["date"][:-1], True) if len(dates) else np.array([], bool)
+        return {name: values[keep] for name, values in columns.items()}
+
+    def write(self, ticker: str, df: pd.DataFrame, source: str = "unknown") -> int:
+        """
+        合并写入日线，同一天以新数据为准；返回写入后的总行数
+
+        新数据不早于已存最后一天时走尾部追加，否则整体重写到新一代目录。
+        """
+        if df is None or df.empty:
+            return self.row_count(ticker)
+
+        new = self._normalize(df, source)
+        with self._write_lock(ticker):
+            # 锁内重新读取 meta：等锁期间其他进程可能已写入
+            meta = self._read_meta(ticker)
+            if meta and meta["rows"]:
+                dates = self._map(ticker, meta, "date")
+                split = int(np.searchsorted(new["date"], dates[-1], side="left"))
+                # 早于最后一天的部分与已存数据一致时 (常见: 每次都拉最近一年)，只需写尾部
+                if split == 0 or self._matches_stored(ticker, meta, {n: v[:split] for n, v in new.items()}):
+                    tail = {name: values[split:] for name, values in new.items()}
+                    if not len(tail["date"]):
+                        return meta["rows"]
+                    # 覆盖从 tail 第一天开始的尾部 (通常是今天尚未收盘的那根)
+                    offset = int(np.searchsorted(dates, tail["date"][0], side="left"))
+                    self._write_tail(ticker, meta, offset, tail)
+                    return meta["rows"]
+            return self._rewrite(ticker, meta, new)
+
+    def _matches_stored(self, ticker: str, meta: dict, older: Dict[str, np.ndarray]) -> bool:
+        dates = self._map(ticker, meta, "date")
+        positions = np.searchsorted(dates, older["date"])
+        if np.any(positions >= len(dates)) or np.any(dates[positions] != older["date"]):
+            return False
+        return all(
+            np.allclose(self._map(ticker, meta, name)[positions], older[name], rtol=1e-9, atol=0.0, equal_nan=True)
+            for name in FRAME_COLUMNS
+        )
+
+    def _write_tail(self, ticker: str, meta: dict, offset: int, new: Dict[str, np.ndarray]):
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(ticker, meta["generation"], name)
+            if name not in meta.get("columns", COLUMNS):
+                # 旧版本目录缺少的新列：已有行补默认值
+                with open(path, "wb") as f:
+                    f.write(np.zeros(offset, dtype=dtype).tobytes())
+            with open(path, "r+b") as f:
+                f.seek(offset * dtype.itemsize)
+                f.write(new[name].astype(dtype, copy=False).tobytes())
+        meta["rows"] = offset + len(new["date"])
+        meta["columns"] = list(COLUMNS)
+        self._write_meta(ticker, meta)
+
+    def _rewrite(self, ticker: str, meta: Optional[dict], new: Dict[str, np.ndarray]) -> int:
+        if meta and meta["rows"]:
+            old = {name: np.asarray(self._map(ticker, meta, name)) for name in COLUMNS}
+            # 新数据覆盖同日期的旧数据
+            keep_old = ~np.isin(old["date"], new["date"])
+            merged = {name: np.concatenate([old[name][keep_old], new[name]]) for name in COLUMNS}
+            order = np.argsort(merged["date"], kind="stable")
+            merged = {name: values[order] for name, values in merged.items()}
+        else:
+            merged = new
+
+        previous = meta["generation"] if meta else None
+        generation = (previous or 0) + 1
+        os.makedirs(os.path.join(self._ticker_dir(ticker), f"g{generation}"), exist_ok=True)
+        for name, dtype in COLUMNS.items():
+            with open(self._column_path(ticker, generation, name), "wb") as f:
+                f.write(merged[name].astype(dtype, copy=False).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        rows = len(merged["date"])
+        self._write_meta(ticker, {"rows": rows, "generation": generation, "columns": list(COLUMNS)})
+
+        # 再往前一代已不可能被新的读者打开；上一代留给切换瞬间仍在读的进程
+        if previous is not None and previous > 1:
+            shutil.rmtree(os.path.join(self._ticker_dir(ticker), f"g{previous - 1}"), ignore_errors=True)
+        return rows
+
+
+_bar_store = BarStore()
+
+
+def get_bar_store() -> BarStore:
+    return _bar_store
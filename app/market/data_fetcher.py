@@ -10,9 +10,17 @@ from app.database.models import DailyQQQData, AlertLog, OptionPosition
 from sqlalchemy.exc import IntegrityError
 from app.market.polygon_client import CachedPolygonClient
 from app.market.yfinance_client import YFinanceClient
+from app.monitoring import metrics
+from app.database.write_buffer import get_write_buffer
+from app.market.bar_store import get_bar_store
+from app.market.backfill import find_missing_sessions
+from app.market.indicators import compute_indicators
 
 et_tz = timezone("America/New_York")
 
+# 指标计算使用的日线窗口 (MA200 需要约 200 个交易日；多留一周保证 1 年前当天之前有收盘价可取)
+INDICATOR_LOOKBACK_DAYS = 372
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,14 +44,15 @@ def retry_on_failure(max_retries: int = 2, delay: float = 1.0):
 
 
 class DataFetcher:
-    def __init__(self, polygon_client: CachedPolygonClient, db):
+    def __init__(self, polygon_client: CachedPolygonClient):
         self.polygon = polygon_client
         self.yfinance = YFinanceClient()
-        self.db = db
         
         # 缓存机制，避免频繁请求 yfinance 导致被封禁
         self._qqq_cache = None
         self._qqq_cache_time = 0.0
+        self._market_cache: Dict[str, Dict[str, Any]] = {}
+        self._market_cache_time = 0.0
 
     def get_qqq_data(self) -> Dict[str, Any]:
         """
@@ -63,21 +72,29 @@ class DataFetcher:
             if not is_market_open_now():
                 # 如果是休市时间，直接返回内存中的最后一次历史数据，永远不发起网络请求
                 logger.debug("[CACHE] Market is closed, using permanent cached QQQ data")
+                metrics.record_cache("qqq_data", hit=True)
                 return self._qqq_cache
             elif current_time - self._qqq_cache_time < 60:
                 # 如果是开盘时间，则维持 60 秒的防抖缓存，避免浏览器疯狂刷新
                 logger.debug("[CACHE] Market is open, using 60s cached QQQ data")
+                metrics.record_cache("qqq_data", hit=True)
                 return self._qqq_cache
 
+        metrics.record_cache("qqq_data", hit=False)
         df = None
+        source = "unknown"
         
         # ---------------------------------------------------------
         # Level 1: YFinance (Primary)
         # ---------------------------------------------------------
+        missing_sessions = self._missing_history_sessions()
         try:
             ticker = yf.Ticker("QQQ")
-            # 获取 1 年数据，确保有足够的历史计算 MA200
-            df = ticker.history(period="1y")
+            # 本地日线完整时只拉最近几天合并进存储，否则拉 1 年数据确保能计算 MA200
+            period = "5d" if missing_sessions == 0 else "1y"
+            with metrics.track_provider("yfinance", "qqq_history"):
+                df = ticker.history(period=period)
+            source = "yfinance"
             
             if df is not None and not df.empty:
                 logger.info("[INFO] Successfully fetched QQQ history from yfinance")
@@ -112,6 +129,7 @@ class DataFetcher:
                         'low': 'Low', 
                         'close': 'Close'
                     }, inplace=True)
+                    source = "polygon"
                     
                     # 删除多余列
                     if 'date' in df.columns:
@@ -154,7 +172,12 @@ class DataFetcher:
         # Process DataFrame
         # ---------------------------------------------------------
         if df is not None and not df.empty:
+            df = self._load_indicator_window(df, source)
             result = self._process_qqq_df(df)
+            if result:
+                # 窗口内仍有缺失交易日时指标不可靠，等待补缺任务
+                result["missing_sessions"] = self._missing_history_sessions()
+                result["is_degraded"] = result["is_degraded"] or bool(result["missing_sessions"])
             # 存储缓存
             if result:
                 self._qqq_cache = result
@@ -163,135 +186,126 @@ class DataFetcher:
             
         return {}
 
-    def _process_qqq_df(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def get_market_data(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        统一处理 Pandas DataFrame 计算指标
-        无论数据源是 yfinance 还是 Polygon，经过规整后都在这里统一通过。
+        获取 watchlist 中所有标的的价格及技术指标，返回 {symbol: indicators}
+
+        每个周期只发一次批量请求:
+        Level 1 (yfinance): yf.download 一次下载全部标的的日线。
+        Level 2 (Polygon 灾备): grouped daily 一次取回最近一个交易日全市场的日线。
+        拉到的日线合并进列式存储，再对所有标的的指标窗口一次向量化计算。
+        获取失败的标的不出现在结果中。
         """
-        try:
-            # 确保按日期排序
-            df = df.sort_index()
-            close_prices = df["Close"]
-            
-            # 判断是否降级 (不足以计算 MA200)
-            is_degraded = len(df) < 200
-
-            # MA20 / MA200
-            df["ma20"] = close_prices.rolling(window=20).mean()
-            df["ma200"] = close_prices.rolling(window=200).mean()
-
-            # Bollinger Bands (20, 2)
-            std_20 = close_prices.rolling(window=20).std()
-            df["bb_upper"] = df["ma20"] + 2 * std_20
-            df["bb_lower"] = df["ma20"] - 2 * std_20
-
-            # RSI (14) - Wilder's Smoothing (com=13)
-            delta = close_prices.diff()
-            gain = (delta.where(delta > 0, 0)).fillna(0)
-            loss = (-delta.where(delta < 0, 0)).fillna(0)
-            avg_gain = gain.ewm(com=13, adjust=False).mean()
-            avg_loss = loss.ewm(com=13, adjust=False).mean()
-            rs = avg_gain / avg_loss
-            df["rsi"] = 100 - (100 / (1 + rs))
-
-            # 提取最后一行
-            latest = df.iloc[-1]
-            last_price = float(latest["Close"])
-            intraday_high = float(latest["High"])
-
-            # 获取昨日 (-2) 和 3日前 (-4)
-            # 必须防御性处理越界，特别是在数据刚开始建立时
-            total_len = len(df)
-            
-            if total_len >= 2:
-                prev_close = float(df["Close"].iloc[-2])
-            else:
-                prev_close = last_price
-                
-            if total_len >= 3:
-                three_day_prev_close = float(df["Close"].iloc[-3])
-            else:
-                three_day_prev_close = float(df["Close"].iloc[0])
+        from app.scheduler.trading_hours import is_market_open_now
 
-            # === 恐慌加速度检测所需数据 ===
-            # 当日成交量
-            volume = float(latest["Volume"]) if "Volume" in df.columns and pd.notna(latest.get("Volume")) else None
-            
-            # 成交量 MA20
-            if "Volume" in df.columns and len(df) >= 20:
-                volume_ma20 = float(df["Volume"].rolling(window=20).mean().iloc[-1])
-            else:
-                volume_ma20 = None
-            
-            # 最近 3 天的每日涨跌幅 (用于跌幅集中检测)
-            daily_changes = []
-            for i in range(min(3, total_len - 1)):
-                idx = -(i + 1)  # -1, -2, -3
-                close_today = float(df["Close"].iloc[idx])
-                close_prev = float(df["Close"].iloc[idx - 1]) if abs(idx - 1) <= total_len else close_today
-                if close_prev > 0:
-                    change_pct = (close_today - close_prev) / close_prev * 100
-                    daily_changes.append(change_pct)
-            # daily_changes: [今天跌幅, 昨天跌幅, 前天跌幅]
-
-            # 新增: 连续几天均线判断
-            is_above_sma200_3d = False
-            is_below_sma200_3d = False
-            consec_above = 0
-            consec_below = 0
-            if len(df) > 0:
-                for i in range(1, min(len(df), 200)):
-                    close_p = float(df["Close"].iloc[-i])
-                    ma_p = float(df["ma200"].iloc[-i])
-                    if pd.notna(ma_p):
-                        if close_p > ma_p and consec_below == 0:
-                            consec_above += 1
-                        elif close_p < ma_p and consec_above == 0:
-                            consec_below += 1
-                        else:
-                            break
-            
-            if len(df) >= 3 and pd.notna(df["ma200"].iloc[-3:]).all():
-                is_above_sma200_3d = bool((df["Close"].iloc[-3:] > df["ma200"].iloc[-3:]).all())
-                is_below_sma200_3d = bool((df["Close"].iloc[-3:] < df["ma200"].iloc[-3:]).all())
+        symbols = sorted({symbol.upper() for symbol in symbols})
+        current_time = time.time()
 
-            # 新增: 1年前（252个交易日）的收盘价
-            price_1y_ago = float(df["Close"].iloc[0]) if len(df) > 0 else None
+        # 与 get_qqq_data 相同的防封禁缓存
+        if self._market_cache and set(symbols) <= set(self._market_cache):
+            if not is_market_open_now() or current_time - self._market_cache_time < 60:
+                metrics.record_cache("market_data", hit=True)
+                return {symbol: self._market_cache[symbol] for symbol in symbols}
+        metrics.record_cache("market_data", hit=False)
+
+        missing = {symbol: self._missing_history_sessions(symbol) for symbol in symbols}
+        # 本地日线全部完整时只拉最近几天，否则拉 1 年数据确保能计算 MA200
+        period = "5d" if all(count == 0 for count in missing.values()) else "1y"
+        frames = self.yfinance.download_daily_bars(symbols, period)
+        source = "yfinance"
+
+        if not frames:
+            logger.info("[FALLBACK] yfinance batch download failed, trying Polygon grouped daily...")
+            frames = self._polygon_grouped_frames(symbols)
+            source = "polygon"
+
+        if not frames:
+            logger.error(f"[ERROR] Failed to fetch market data for {symbols}")
+            return {}
+        logger.info(f"[INFO] Fetched daily bars for {len(frames)}/{len(symbols)} symbols from {source}")
 
-            # 组装结果
-            result = {
-                "date": datetime.now(et_tz).date(),
-                "last_price": last_price,
-                "intraday_high": intraday_high,
-                
-                # 指标 (Pandas series 取最后一行可能为 NaN，需处理)
-                "ma20": float(latest["ma20"]) if pd.notna(latest["ma20"]) else None,
-                "ma200": float(latest["ma200"]) if pd.notna(latest["ma200"]) else None,
-                "is_above_sma200_3d": is_above_sma200_3d,
-                "is_below_sma200_3d": is_below_sma200_3d,
-                "consec_above": consec_above,
-                "consec_below": consec_below,
-                "price_1y_ago": price_1y_ago,
-                "rsi": float(latest["rsi"]) if pd.notna(latest["rsi"]) else None,
-                "bb_upper": float(latest["bb_upper"]) if pd.notna(latest["bb_upper"]) else None,
-                "bb_lower": float(latest["bb_lower"]) if pd.notna(latest["bb_lower"]) else None,
-                
-                # 历史参考
-                "prev_close": prev_close,
-                "three_day_prev_close": three_day_prev_close,
-                
-                # 恐慌加速度检测数据
-                "volume": volume,
-                "volume_ma20": volume_ma20,
-                "daily_changes": daily_changes,  # [今天, 昨天, 前天] 涨跌幅
-                
-                # 状态位
-                "is_degraded": is_degraded
-            }
+        windows = {symbol: self._load_indicator_window(df, source, symbol) for symbol, df in frames.items()}
+        results = compute_indicators(windows)
+
+        for symbol, result in results.items():
+            result["symbol"] = symbol
+            # 窗口内仍有缺失交易日时指标不可靠，等待补缺任务
+            result["missing_sessions"] = self._missing_history_sessions(symbol)
+            result["is_degraded"] = result["is_degraded"] or bool(result["missing_sessions"])
+
+        qqq = results.get("QQQ")
+        if qqq:
+            self._save_daily_data(qqq)
+            self._qqq_cache = qqq
+            self._qqq_cache_time = current_time
+
+        self._market_cache.update(results)
+        self._market_cache_time = current_time
+        return results
 
-            # 存入数据库
-            self._save_daily_data(result)
+    def _polygon_grouped_frames(self, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        """从最近一个已收盘交易日的 grouped daily 中取出各标的的日线 (免费版没有当天数据)"""
+        from app.scheduler.trading_hours import trading_sessions
+
+        today = datetime.now(et_tz).date()
+        sessions = trading_sessions(today - timedelta(days=10), today - timedelta(days=1))
+        if not len(sessions):
+            return {}
 
+        grouped = self.polygon.get_grouped_daily(pd.Timestamp(sessions[-1]).date())
+        frames = {}
+        for symbol in symbols:
+            bar = grouped.get(symbol)
+            if bar:
+                frames[symbol] = pd.DataFrame([{
+                    "Open": bar["open"], "High": bar["high"], "Low": bar["low"],
+                    "Close": bar["close"], "Volume": bar["volume"],
+                }], index=pd.DatetimeIndex([pd.Timestamp(bar["date"])], name="Date"))
+        return frames
+
+    def _missing_history_sessions(self, symbol: str = "QQQ") -> Optional[int]:
+        """
+        指标窗口内 (不含今天) 本地日线缺失的交易日数；存储不可用时返回 None
+
+        今天的日线由每个检查周期写入，不计入缺口。
+        """
+        try:
+            today = datetime.now(et_tz).date()
+            return len(find_missing_sessions(
+                get_bar_store(), symbol,
+                today - timedelta(days=INDICATOR_LOOKBACK_DAYS), today - timedelta(days=1)
+            ))
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to check {symbol} bar history gaps: {e}")
+            return None
+
+    def _load_indicator_window(self, df: pd.DataFrame, source: str = "unknown", symbol: str = "QQQ") -> pd.DataFrame:
+        """
+        把拉到的日线合并进列式存储，再从存储中读取指标计算窗口
+
+        存储不可用时直接使用拉到的数据。
+        """
+        try:
+            store = get_bar_store()
+            store.write(symbol, df, source=source)
+            start = datetime.now(et_tz).date() - timedelta(days=INDICATOR_LOOKBACK_DAYS)
+            window = store.read(symbol, start=start).to_frame()
+            if not window.empty:
+                return window
+        except Exception as e:
+            logger.warning(f"[WARN] Bar store unavailable, using fetched {symbol} history directly: {e}")
+        return df
+
+    def _process_qqq_df(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        统一处理 Pandas DataFrame 计算指标
+        无论数据源是 yfinance 还是 Polygon，经过规整后都在这里统一通过 (与多标的共用同一套指标引擎)。
+        """
+        try:
+            result = compute_indicators({"QQQ": df}).get("QQQ", {})
+            if result:
+                # 存入数据库
+                self._save_daily_data(result)
             return result
         except Exception as e:
             logger.error(f"[ERROR] processing QQQ DF: {e}")
@@ -302,25 +316,14 @@ class DataFetcher:
             if not result.get("last_price"):
                 return
 
-            date_val = result["date"]
-            # Check existing
-            existing = self.db.query(DailyQQQData).filter_by(date=date_val).first()
-            if existing:
-                existing.close_price = result["last_price"]
-                existing.high_price = result.get("intraday_high")
-                existing.fetched_at = datetime.now(et_tz)
-            else:
-                daily = DailyQQQData(
-                    date=date_val,
-                    close_price=result["last_price"],
-                    high_price=result.get("intraday_high"),
-                    fetched_at=datetime.now(et_tz)
-                )
-                self.db.add(daily)
-            
-            self.db.commit()
+            # 检查周期内延迟到周期结束时批量 upsert，其余情况立即写入
+            get_write_buffer().upsert_daily_qqq(
+                result["date"],
+                close_price=result["last_price"],
+                high_price=result.get("intraday_high"),
+                fetched_at=datetime.now(et_tz)
+            )
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Error saving daily data: {e}")
 
     @retry_on_failure(max_retries=2, delay=1.0)
@@ -351,6 +354,14 @@ class DataFetcher:
         logger.info(f"[INFO] Trying Polygon.io as fallback for: {yf_ticker}")
 
         # 方法 2: 从 Polygon.io 获取期权历史数据（免费版可用）
+        price = self.get_option_polygon_price(position)
+        if price is None:
+            logger.error(f"[ERROR] All sources failed for option: {yf_ticker}")
+        return price
+
+    def get_option_polygon_price(self, position) -> Optional[float]:
+        """Polygon.io 期权最近收盘价 (免费版可用，受每分钟 5 次的配额限制)"""
+        polygon_ticker = self._format_polygon_ticker(position)
         try:
             historical = self.polygon.get_option_historical(polygon_ticker, days=2)
             if historical and len(historical) >= 1:
@@ -365,10 +376,21 @@ class DataFetcher:
                 logger.warning(f"[WARN] Polygon.io no historical data for: {polygon_ticker}")
         except Exception as e:
             logger.error(f"[ERROR] Polygon.io exception for {polygon_ticker}: {e}")
-
-        logger.error(f"[ERROR] All sources failed for option: {yf_ticker}")
         return None
 
+    def get_option_prices_batch(self, positions) -> Dict[int, float]:
+        """
+        一次 Yahoo Finance 请求获取多个持仓的期权价格，返回 {position_id: 价格}
+
+        同一合约只请求一次；没有拿到价格的持仓不出现在结果中，由调用方逐个走 Polygon.io 备选。
+        """
+        tickers = {position.id: self._format_yahoo_finance_ticker(position) for position in positions}
+        if not tickers:
+            return {}
+        prices = self.yfinance.get_option_prices(sorted(set(tickers.values())))
+        logger.info(f"[OK] Yahoo Finance batch got {len(prices)}/{len(set(tickers.values()))} option prices")
+        return {position_id: prices[ticker] for position_id, ticker in tickers.items() if ticker in prices}
+
     @retry_on_failure(max_retries=2, delay=1.0)
     def get_option_prev_close(self, position) -> Optional[float]:
         """
@@ -445,7 +467,8 @@ class DataFetcher:
         """
         try:
             vix_ticker = yf.Ticker("^VIX")
-            vix_data = vix_ticker.history(period="1d")
+            with metrics.track_provider("yfinance", "vix_index"):
+                vix_data = vix_ticker.history(period="1d")
             
             if vix_data is not None and not vix_data.empty:
                 vix_value = float(vix_data["Close"].iloc[-1])
@@ -476,7 +499,8 @@ class DataFetcher:
         try:
             vix_ticker = yf.Ticker("^VIX")
             # 获取至少 25 天数据确保能计算 MA20
-            vix_df = vix_ticker.history(period="1mo")
+            with metrics.track_provider("yfinance", "vix_history"):
+                vix_df = vix_ticker.history(period="1mo")
             
             if vix_df is None or len(vix_df) < 2:
                 logger.warning("[WARN] Insufficient VIX data for MA20 calculation")
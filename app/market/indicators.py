@@ -0,0 +1,172 @@
+"""
+标的无关的技术指标引擎
+
+所有标的的日线按日期对齐成宽表 (日期 × 标的)，MA / 布林带 / RSI / 成交量均线
+在宽表上一次性按列向量化计算；之后每个标的只做常数次的取值。
+新增标的几乎不增加计算时间。
+
+单标的 (QQQ) 的 DataFetcher._process_qqq_df 也走这里，保证各标的的指标口径一致。
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from pytz import timezone
+
+et_tz = timezone("America/New_York")
+
+
+def _wide(frames: Dict[str, pd.DataFrame], column: str) -> pd.DataFrame:
+    series = {}
+    for symbol, df in frames.items():
+        if column in df.columns:
+            series[symbol] = df[column].astype(float)
+        else:
+            series[symbol] = pd.Series(np.nan, index=df.index)
+    return pd.concat(series, axis=1).sort_index()
+
+
+def _naive_index(df: pd.DataFrame) -> pd.DataFrame:
+    # yfinance 返回带时区的索引，列式存储返回不带时区的索引，对齐前统一成不带时区
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        df = df.copy()
+        df.index = df.index.tz_localize(None)
+    return df
+
+
+def _float_or_none(value) -> Optional[float]:
+    return float(value) if pd.notna(value) else None
+
+
+def compute_indicators(frames: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, Any]]:
+    """
+    计算每个标的的最新指标
+
+    frames: {symbol: DataFrame(Date 索引, Open/High/Low/Close[/Volume] 列)}
+    返回 {symbol: indicators}，字段与 _process_qqq_df 的结果一致；没有有效收盘价的标的不出现在结果中
+    """
+    frames = {symbol: _naive_index(df) for symbol, df in frames.items() if df is not None and not df.empty}
+    if not frames:
+        return {}
+
+    close = _wide(frames, "Close")
+    high = _wide(frames, "High")
+    volume = _wide(frames, "Volume")
+
+    # === 宽表上的向量化计算 ===
+    ma20 = close.rolling(window=20).mean()
+    ma200 = close.rolling(window=200).mean()
+
+    # Bollinger Bands (20, 2)
+    std_20 = close.rolling(window=20).std()
+    bb_upper = ma20 + 2 * std_20
+    bb_lower = ma20 - 2 * std_20
+
+    # RSI (14) - Wilder's Smoothing (com=13)
+    delta = close.diff()
+    gain = (delta.where(delta > 0, 0)).fillna(0)
+    loss = (-delta.where(delta < 0, 0)).fillna(0)
+    avg_gain = gain.ewm(com=13, adjust=False).mean()
+    avg_loss = loss.ewm(com=13, adjust=False).mean()
+    rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+
+    volume_ma20 = volume.rolling(window=20).mean()
+
+    index = close.index
+    arrays = {
+        "close": close.to_numpy(), "high": high.to_numpy(), "volume": volume.to_numpy(),
+        "ma20": ma20.to_numpy(), "ma200": ma200.to_numpy(), "rsi": rsi.to_numpy(),
+        "bb_upper": bb_upper.to_numpy(), "bb_lower": bb_lower.to_numpy(), "volume_ma20": volume_ma20.to_numpy(),
+    }
+
+    today = datetime.now(et_tz).date()
+    results = {}
+    for j, symbol in enumerate(close.columns):
+        valid = ~np.isnan(arrays["close"][:, j])
+        if not valid.any():
+            continue
+        col = {name: values[valid, j] for name, values in arrays.items()}
+        dates = index[valid]
+        results[symbol] = _latest_indicators(col, dates, "Volume" in frames[symbol].columns, today)
+    return results
+
+
+def _latest_indicators(col: Dict[str, np.ndarray], dates: pd.DatetimeIndex, has_volume: bool, today) -> Dict[str, Any]:
+    closes = col["close"]
+    ma200 = col["ma200"]
+    total_len = len(closes)
+
+    last_price = float(closes[-1])
+    prev_close = float(closes[-2]) if total_len >= 2 else last_price
+    three_day_prev_close = float(closes[-3]) if total_len >= 3 else float(closes[0])
+
+    # === 恐慌加速度检测所需数据 ===
+    volume = _float_or_none(col["volume"][-1]) if has_volume else None
+    volume_ma20 = float(col["volume_ma20"][-1]) if has_volume and total_len >= 20 else None
+
+    # 最近 3 天的每日涨跌幅 [今天, 昨天, 前天]
+    daily_changes = []
+    for i in range(min(3, total_len - 1)):
+        close_today = float(closes[-(i + 1)])
+        close_prev = float(closes[-(i + 2)])
+        if close_prev > 0:
+            daily_changes.append((close_today - close_prev) / close_prev * 100)
+
+    # 最近连续站上 / 跌破 SMA200 的天数 (最多回看 199 天，跳过 SMA200 尚未形成的日子)
+    lookback = min(total_len, 200)
+    recent_close = closes[-1:-lookback:-1]
+    recent_ma = ma200[-1:-lookback:-1]
+    has_ma = ~np.isnan(recent_ma)
+    signs = np.sign(recent_close[has_ma] - recent_ma[has_ma])
+    consec_above = consec_below = 0
+    if len(signs) and signs[0] != 0:
+        mismatch = np.flatnonzero(signs != signs[0])
+        run = int(mismatch[0]) if len(mismatch) else len(signs)
+        if signs[0] > 0:
+            consec_above = run
+        else:
+            consec_below = run
+
+    is_above_sma200_3d = False
+    is_below_sma200_3d = False
+    if total_len >= 3 and not np.isnan(ma200[-3:]).any():
+        is_above_sma200_3d = bool((closes[-3:] > ma200[-3:]).all())
+        is_below_sma200_3d = bool((closes[-3:] < ma200[-3:]).all())
+
+    # 1年前: 最后一根日线往前 365 天当天 (或之前最近一个交易日) 的收盘价
+    one_year_ago = dates[-1] - pd.Timedelta(days=365)
+    if dates[0] <= one_year_ago:
+        price_1y_ago = float(closes[dates.searchsorted(one_year_ago, side="right") - 1])
+    else:
+        # 历史不足一年时退化为最早一根
+        price_1y_ago = float(closes[0])
+
+    return {
+        "date": today,
+        "last_price": last_price,
+        "intraday_high": float(col["high"][-1]),
+
+        "ma20": _float_or_none(col["ma20"][-1]),
+        "ma200": _float_or_none(ma200[-1]),
+        "is_above_sma200_3d": is_above_sma200_3d,
+        "is_below_sma200_3d": is_below_sma200_3d,
+        "consec_above": consec_above,
+        "consec_below": consec_below,
+        "price_1y_ago": price_1y_ago,
+        "rsi": _float_or_none(col["rsi"][-1]),
+        "bb_upper": _float_or_none(col["bb_upper"][-1]),
+        "bb_lower": _float_or_none(col["bb_lower"][-1]),
+
+        # 历史参考
+        "prev_close": prev_close,
+        "three_day_prev_close": three_day_prev_close,
+
+        # 恐慌加速度检测数据
+        "volume": volume,
+        "volume_ma20": volume_ma20,
+        "daily_changes": daily_changes,
+
+        # 状态位 (不足以计算 MA200)
+        "is_degraded": total_len < 200
+    }
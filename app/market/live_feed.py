@@ -0,0 +1,290 @@
+"""
+实时推送 (Server-Sent Events)
+
+Dashboard / 持仓页通过 GET /api/live 订阅行情和报警的变化，不再靠刷新页面或逐个点刷新按钮。
+
+每个 Web worker 只有一个轮询任务 (有订阅者时才运行)，数据全部来自 leader 发布的行情快照和数据库，
+不发任何上游行情请求；连接数再多也只是在内存里多几个读者:
+
+- 每 LIVE_POLL_SECONDS 读一次快照 (内存映射，版本不变时直接命中缓存)，版本变化时计算 QQQ 指标和
+  持仓报价 / 盈亏相对上一版本的变化，发布一条 market 事件 (只含变化的字段 / 持仓，已删除的持仓为 null)
+- 快照版本变化时以及每 LIVE_ALERT_POLL_SECONDS 查一次新增的报警日志，每条发布一条 alert 事件
+- 事件进入长度为 LIVE_HISTORY 的环形缓冲，所有连接共享；空闲超过 LIVE_HEARTBEAT_SECONDS 的连接
+  发送注释行作为心跳，避免被代理断开
+
+事件 id 为 "{快照版本}:{最新报警 id}"，两者都是全局单调的，与 worker 无关。断线重连时浏览器带上
+Last-Event-ID：缓冲区仍覆盖该位置时补发之后的事件；否则 (太旧、来自进度更快的 worker) 先发一条
+完整状态的 snapshot 事件，再从数据库补发该位置之后的报警 (最多 ALERT_REPLAY_LIMIT 条)。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from app.database.init_db import read_session_scope
+from app.database.models import AlertLog, OptionPosition
+from app.database.queries import serialize_alert_log
+from app.market.snapshot import get_market_snapshot
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "1"))
+LIVE_ALERT_POLL_SECONDS = float(os.getenv("LIVE_ALERT_POLL_SECONDS", "5"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+LIVE_HISTORY = int(os.getenv("LIVE_HISTORY", "256"))
+LIVE_MAX_CLIENTS = int(os.getenv("LIVE_MAX_CLIENTS", "200"))
+
+# 浏览器断线后的重连间隔 (毫秒)
+LIVE_RETRY_MS = 5000
+ALERT_REPLAY_LIMIT = 100
+
+# 推送给页面的 QQQ 字段
+QQQ_FIELDS = (
+    "last_price", "intraday_high", "prev_close", "rsi", "ma200",
+    "is_above_sma200_3d", "is_below_sma200_3d", "is_degraded",
+)
+
+Cursor = Tuple[int, int]
+
+
+class TooManyClients(Exception):
+    pass
+
+
+def _format_event(event_id: str, name: str, data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, separators=(",", ":"), default=str)
+    return f"id: {event_id}\nevent: {name}\ndata: {payload}\n\n"
+
+
+def _parse_cursor(value: Optional[str]) -> Optional[Cursor]:
+    try:
+        version, alert_id = (value or "").split(":")
+        return int(version), int(alert_id)
+    except ValueError:
+        return None
+
+
+def _position_quotes(quotes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """快照里的持仓报价加上成本和最高收益，算出页面展示的盈亏"""
+    with read_session_scope() as db:
+        rows = db.query(OptionPosition.id, OptionPosition.entry_price, OptionPosition.quantity,
+                        OptionPosition.max_profit).all()
+
+    positions = {}
+    for position_id, entry_price, quantity, max_profit in rows:
+        quote = quotes.get(str(position_id))
+        if not quote or quote.get("price") is None:
+            continue
+        price = quote["price"]
+        pnl_pct = ((price - entry_price) / entry_price * 100) if entry_price > 0 else 0
+        positions[str(position_id)] = {
+            "current_price": price,
+            "updated_at": quote.get("updated_at"),
+            "pnl_amount": (price - entry_price) * (quantity or 1) * 100,
+            "pnl_pct": pnl_pct,
+            "max_profit_pct": max(max_profit or 0.0, pnl_pct / 100.0) * 100,
+        }
+    return positions
+
+
+def _latest_alert_id() -> int:
+    with read_session_scope() as db:
+        return db.query(func.max(AlertLog.id)).scalar() or 0
+
+
+def _alerts_between(after_id: int, until_id: Optional[int] = None, latest: bool = False) -> List[Dict[str, Any]]:
+    """
+    id 在 (after_id, until_id] 内的报警日志 (最多 ALERT_REPLAY_LIMIT 条)，按 id 升序
+
+    latest 为 True 时超出上限取最新的几条，否则取最早的几条。
+    """
+    with read_session_scope() as db:
+        query = db.query(AlertLog).filter(AlertLog.id > after_id)
+        if until_id is not None:
+            query = query.filter(AlertLog.id <= until_id)
+        order = AlertLog.id.desc() if latest else AlertLog.id
+        logs = query.order_by(order).limit(ALERT_REPLAY_LIMIT).all()
+        return sorted((serialize_alert_log(log) for log in logs), key=lambda alert: alert["id"])
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """new 中新增或变化的键，以及 old 中被删除的键 (值为 None)"""
+    changes = {key: value for key, value in new.items() if key not in old or old[key] != value}
+    changes.update({key: None for key in old if key not in new})
+    return changes
+
+
+class LiveFeed:
+    def __init__(self):
+        self._qqq: Dict[str, Any] = {}
+        self._positions: Dict[str, Dict[str, Any]] = {}
+        self._version = 0
+        self._alert_id: Optional[int] = None
+        self._last_alert_poll = 0.0
+
+        # (序号, 位置, 格式化后的事件)；_base 为缓冲区第一条事件之前的位置
+        self._events: deque = deque(maxlen=LIVE_HISTORY)
+        self._seq = 0
+        self._base: Optional[Cursor] = None
+
+        self._start_lock = asyncio.Lock()
+        self._changed: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+        self.clients = 0
+
+    @property
+    def cursor(self) -> Cursor:
+        return self._version, self._alert_id or 0
+
+    # ------------------------------------------------------------------
+    # 轮询 (每个 worker 一个任务)
+    # ------------------------------------------------------------------
+    async def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 新的事件循环 (如测试中重启应用)，旧循环上的锁和任务不能再用
+            self._loop, self._task = loop, None
+            self._start_lock = asyncio.Lock()
+            self._changed = asyncio.Condition()
+        async with self._start_lock:
+            if self._task is None or self._task.done():
+                await self._refresh()
+                self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self.clients > 0:
+            await asyncio.sleep(LIVE_POLL_SECONDS)
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.error(f"[ERROR] Live feed refresh failed: {e}")
+
+    async def _refresh(self):
+        initial = self._base is None
+        if initial:
+            # 第一次轮询只建立初始状态，之前的报警不推送
+            self._alert_id = await asyncio.to_thread(_latest_alert_id)
+            self._last_alert_poll = time.monotonic()
+
+        snapshot = get_market_snapshot().read()
+        new_version = snapshot is not None and snapshot["version"] != self._version
+
+        if new_version:
+            qqq = {field: (snapshot.get("qqq") or {}).get(field) for field in QQQ_FIELDS}
+            positions = await asyncio.to_thread(_position_quotes, snapshot.get("quotes") or {})
+            changes = {"qqq": _diff(self._qqq, qqq), "positions": _diff(self._positions, positions)}
+            self._qqq, self._positions, self._version = qqq, positions, snapshot["version"]
+            if not initial and (changes["qqq"] or changes["positions"]):
+                self._publish("market", {"version": self._version, **changes})
+
+        if initial:
+            self._base = self.cursor
+        elif new_version or time.monotonic() - self._last_alert_poll >= LIVE_ALERT_POLL_SECONDS:
+            self._last_alert_poll = time.monotonic()
+            for alert in await asyncio.to_thread(_alerts_between, self._alert_id):
+                self._alert_id = alert["id"]
+                self._publish("alert", alert)
+
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _publish(self, name: str, data: Dict[str, Any]):
+        if len(self._events) == self._events.maxlen:
+            # 最旧的事件即将被挤出缓冲区
+            self._base = self._events[0][1]
+        self._seq += 1
+        cursor = self.cursor
+        self._events.append((self._seq, cursor, _format_event(f"{cursor[0]}:{cursor[1]}", name, data)))
+        metrics.live_events.labels(name).inc()
+
+    def _full_state(self, alert_id: int) -> str:
+        return _format_event(f"{self._version}:{alert_id}", "snapshot", {
+            "version": self._version,
+            "qqq": self._qqq,
+            "positions": self._positions,
+        })
+
+    # ------------------------------------------------------------------
+    # 订阅 (每个连接一个异步生成器)
+    # ------------------------------------------------------------------
+    async def subscribe(self, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        打开一个订阅 (超过 LIVE_MAX_CLIENTS 时抛出 TooManyClients)
+
+        返回的异步生成器逐条产出 SSE 文本；调用方断开连接时关闭生成器即可。
+        连接名额在生成器开始迭代时才占用：客户端在响应开始前就断开时生成器从未启动，
+        关闭它不会执行 finally，名额不能在这之前占用，否则会泄漏。
+        """
+        if self.clients >= LIVE_MAX_CLIENTS:
+            raise TooManyClients(f"Too many live clients ({self.clients})")
+        return self._stream(_parse_cursor(last_event_id))
+
+    def _release(self):
+        self.clients -= 1
+        metrics.live_clients.dec()
+
+    async def _resume(self, cursor: Optional[Cursor]) -> Tuple[List[str], int]:
+        """返回 (需要先发送的事件, 之后从哪个序号开始跟随缓冲区)"""
+        prelude = [f"retry: {LIVE_RETRY_MS}\n\n"]
+        if cursor is not None and self._base is not None and self._base <= cursor <= self.cursor:
+            replay = [(seq, text) for seq, event_cursor, text in self._events if event_cursor > cursor]
+            if not replay:
+                return prelude, self._seq
+            return prelude, replay[0][0] - 1
+
+        seq, current_alert_id = self._seq, self.cursor[1]
+        if cursor is None:
+            prelude.append(self._full_state(current_alert_id))
+            return prelude, seq
+
+        # 缓冲区已不覆盖该位置：完整状态 + 从数据库补发错过的报警 (超过上限时只补最新的几条)
+        missed = await asyncio.to_thread(_alerts_between, cursor[1], current_alert_id, True)
+        prelude.append(self._full_state(missed[0]["id"] - 1 if missed else current_alert_id))
+        prelude.extend(_format_event(f"{self._version}:{alert['id']}", "alert", alert) for alert in missed)
+        return prelude, seq
+
+    async def _stream(self, cursor: Optional[Cursor]) -> AsyncIterator[str]:
+        self.clients += 1
+        metrics.live_clients.inc()
+        try:
+            await self._ensure_started()
+            prelude, seq = await self._resume(cursor)
+            for text in prelude:
+                yield text
+
+            while True:
+                pending = [(event_seq, text) for event_seq, _, text in self._events if event_seq > seq]
+                if pending and pending[0][0] > seq + 1:
+                    # 连接读得太慢，缓冲区已越过它的位置：直接发完整状态
+                    seq = self._seq
+                    yield self._full_state(self.cursor[1])
+                    continue
+                for event_seq, text in pending:
+                    seq = event_seq
+                    yield text
+
+                timed_out = False
+                async with self._changed:
+                    if self._seq == seq:
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), timeout=LIVE_HEARTBEAT_SECONDS)
+                        except asyncio.TimeoutError:
+                            timed_out = True
+                if timed_out:
+                    yield ": ping\n\n"
+        finally:
+            self._release()
+
+
+_live_feed = LiveFeed()
+
+
+def get_live_feed() -> LiveFeed:
+    return _live_feed
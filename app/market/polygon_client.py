@@ -1,9 +1,12 @@
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Optional, Dict, Any
 from polygon import RESTClient
 from pytz import timezone
 
+from app.monitoring import metrics
+
 et_tz = timezone("America/New_York")
 
 
@@ -12,18 +15,21 @@ class RateLimiter:
         self.max_requests = max_requests
         self.period = period
         self.requests: list = []
+        self._lock = threading.Lock()
 
     def wait_if_needed(self):
-        now = time.time()
-        self.requests = [req for req in self.requests if now - req < self.period]
+        with self._lock:
+            now = time.time()
+            self.requests = [req for req in self.requests if now - req < self.period]
 
-        if len(self.requests) >= self.max_requests:
-            sleep_time = self.period - (now - self.requests[0])
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-                self.requests = []
+            if len(self.requests) >= self.max_requests:
+                sleep_time = self.period - (now - self.requests[0])
+                if sleep_time > 0:
+                    metrics.record_rate_limit_wait("polygon", sleep_time)
+                    time.sleep(sleep_time)
+                    self.requests = []
 
-        self.requests.append(now)
+            self.requests.append(time.time())
 
 
 class CachedPolygonClient:
@@ -54,13 +60,16 @@ class CachedPolygonClient:
     def get_qqq_prev_close(self) -> Optional[float]:
         cache_key = "prev_close"
         if self._is_qqq_cache_valid(cache_key, ttl_hours=4):
+            metrics.record_cache("polygon_qqq", hit=True)
             return self.qqq_cache.get(cache_key)
+        metrics.record_cache("polygon_qqq", hit=False)
 
         self.rate_limiter.wait_if_needed()
         try:
             # 获取昨天的数据（动态日期）
             yesterday = (datetime.now(et_tz) - timedelta(days=1)).strftime("%Y-%m-%d")
-            aggs = self.client.get_aggs("QQQ", 1, "day", yesterday, yesterday, limit=1)
+            with metrics.track_provider("polygon", "qqq_prev_close"):
+                aggs = self.client.get_aggs("QQQ", 1, "day", yesterday, yesterday, limit=1)
 
             if aggs:
                 self.qqq_cache[cache_key] = aggs[0].close
@@ -73,7 +82,9 @@ class CachedPolygonClient:
     def get_qqq_intraday(self) -> Dict[str, Any]:
         cache_key = "intraday"
         if self._is_qqq_cache_valid(cache_key, ttl_hours=0):
+            metrics.record_cache("polygon_qqq", hit=True)
             return self.qqq_cache.get(cache_key, {})
+        metrics.record_cache("polygon_qqq", hit=False)
 
         self.rate_limiter.wait_if_needed()
         try:
@@ -81,7 +92,8 @@ class CachedPolygonClient:
             # 免费版不支持获取"当天"的数据
             end_date = datetime.now(et_tz).strftime("%Y-%m-%d")
             start_date = (datetime.now(et_tz) - timedelta(days=2)).strftime("%Y-%m-%d")
-            aggs = self.client.get_aggs("QQQ", 1, "day", start_date, end_date, limit=2)
+            with metrics.track_provider("polygon", "qqq_intraday"):
+                aggs = self.client.get_aggs("QQQ", 1, "day", start_date, end_date, limit=2)
 
             if aggs and len(aggs) >= 1:
                 # 使用最新的一条数据作为"当前价格"
@@ -104,14 +116,17 @@ class CachedPolygonClient:
     def get_qqq_historical(self, days: int = 5) -> list:
         cache_key = f"historical_{days}"
         if self._is_qqq_cache_valid(cache_key, ttl_hours=4):
+            metrics.record_cache("polygon_qqq", hit=True)
             return self.qqq_cache.get(cache_key, [])
+        metrics.record_cache("polygon_qqq", hit=False)
 
         self.rate_limiter.wait_if_needed()
         try:
             end_date = datetime.now(et_tz).strftime("%Y-%m-%d")
             start_date = (datetime.now(et_tz) - timedelta(days=days * 2)).strftime("%Y-%m-%d")
 
-            aggs = self.client.get_aggs("QQQ", 1, "day", start_date, end_date, limit=days)
+            with metrics.track_provider("polygon", "qqq_historical"):
+                aggs = self.client.get_aggs("QQQ", 1, "day", start_date, end_date, limit=days)
 
             result = []
             for agg in aggs:
@@ -131,15 +146,76 @@ class CachedPolygonClient:
 
         return []
 
+    def get_daily_bars(self, symbol: str, start: date, end: date) -> list:
+        """获取 [start, end] 闭区间的日线聚合 (补缺用，不缓存)"""
+        self.rate_limiter.wait_if_needed()
+        try:
+            with metrics.track_provider("polygon", "daily_bars_range"):
+                aggs = self.client.get_aggs(symbol, 1, "day", start.isoformat(), end.isoformat(), limit=50000)
+
+            return [{
+                "date": datetime.fromtimestamp(agg.timestamp / 1000, et_tz).date(),
+                "open": agg.open,
+                "high": agg.high,
+                "low": agg.low,
+                "close": agg.close,
+                "volume": agg.volume,
+            } for agg in aggs]
+        except Exception as e:
+            print(f"Error getting {symbol} daily bars {start}..{end}: {e}")
+
+        return []
+
+    def get_grouped_daily(self, day: date) -> Dict[str, Dict[str, Any]]:
+        """
+        一次请求获取某个交易日全市场的日线 (grouped daily)，返回 {symbol: bar}
+
+        已收盘交易日的数据不会再变化，按日期缓存。
+        """
+        cache_key = f"grouped_{day.isoformat()}"
+        if self._is_qqq_cache_valid(cache_key, ttl_hours=24):
+            metrics.record_cache("polygon_grouped", hit=True)
+            return self.qqq_cache.get(cache_key, {})
+        metrics.record_cache("polygon_grouped", hit=False)
+
+        self.rate_limiter.wait_if_needed()
+        try:
+            with metrics.track_provider("polygon", "grouped_daily"):
+                aggs = self.client.get_grouped_daily_aggs(day.isoformat(), adjusted=True)
+
+            result = {
+                agg.ticker: {
+                    "date": day,
+                    "open": agg.open,
+                    "high": agg.high,
+                    "low": agg.low,
+                    "close": agg.close,
+                    "volume": agg.volume,
+                }
+                for agg in aggs or [] if agg.close is not None
+            }
+            # 空结果 (非交易日 / 尚未发布) 不缓存
+            if result:
+                self.qqq_cache[cache_key] = result
+                self.qqq_cache_time[cache_key] = datetime.now(et_tz)
+            return result
+        except Exception as e:
+            print(f"Error getting grouped daily for {day}: {e}")
+
+        return {}
+
     def get_option_price(self, ticker: str) -> Optional[float]:
         cache_key = ticker
         if self._is_option_cache_valid(cache_key, ttl_minutes=1):
+            metrics.record_cache("polygon_option", hit=True)
             return self.option_cache.get(cache_key, {}).get("price")
+        metrics.record_cache("polygon_option", hit=False)
 
         self.rate_limiter.wait_if_needed()
         try:
             today = datetime.now(et_tz).strftime("%Y-%m-%d")
-            aggs = self.client.get_aggs(ticker, 1, "day", today, today, limit=1)
+            with metrics.track_provider("polygon", "option_price"):
+                aggs = self.client.get_aggs(ticker, 1, "day", today, today, limit=1)
 
             if aggs:
                 price = aggs[0].close
@@ -170,7 +246,9 @@ class CachedPolygonClient:
         cache_key = f"opt_hist_{ticker}_{days}"
         # 使用较长的缓存时间（4小时 = 240分钟）
         if self._is_option_cache_valid(cache_key, ttl_minutes=240):
+            metrics.record_cache("polygon_option", hit=True)
             return self.option_cache.get(cache_key, [])
+        metrics.record_cache("polygon_option", hit=False)
 
         self.rate_limiter.wait_if_needed()
         try:
@@ -178,7 +256,8 @@ class CachedPolygonClient:
             start_date = (datetime.now(et_tz) - timedelta(days=days * 2)).strftime("%Y-%m-%d")
 
             # 获取期权的日线聚合数据
-            aggs = self.client.get_aggs(ticker, 1, "day", start_date, end_date, limit=days)
+            with metrics.track_provider("polygon", "option_historical"):
+                aggs = self.client.get_aggs(ticker, 1, "day", start_date, end_date, limit=days)
 
             result = []
             for agg in aggs:
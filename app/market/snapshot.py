@@ -0,0 +1,196 @@
+"""
+行情快照 (多 worker 共享的内存映射文件)
+
+调度 leader 每个检查周期结束后把 QQQ / watchlist 的行情和指标、各持仓的最新报价
+发布到一个内存映射文件；所有 Web worker 直接映射读取，不加锁、不发网络请求。
+
+文件布局 (little-endian):
+
+    0   magic          4s   b"LMSS"
+    4   layout         u32  布局版本
+    8   seq            u64  seqlock 序号：奇数表示写入中
+    16  version        u64  发布次数 (每次发布 +1)
+    24  published_at   f64  epoch 秒
+    32  length         u32  payload 字节数
+    36  crc32          u32  payload 校验
+    64  payload             JSON
+
+- 写 (只有 leader 一个写者，flock 防止换主瞬间重叠): seq 置为奇数 -> 写 payload 和头部 -> seq 置为下一个偶数
+- 读: 读 seq (奇数则重试) -> 复制头部和 payload -> 再读 seq，前后一致且 CRC 匹配才算读到完整快照；
+  seq 未变时直接返回上次解码的结果，不重复解析 JSON
+- 容量不够时写者原地扩大文件，读者发现 payload 超出自己的映射范围时重新映射
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境只跑单 worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MARKET_SNAPSHOT_PATH = os.getenv(
+    "MARKET_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "market_snapshot.bin")
+)
+
+MAGIC = b"LMSS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sIQQdII")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 8
+DATA_OFFSET = 64
+INITIAL_CAPACITY = 1024 * 1024
+
+# 读者遇到写入中 / 不一致的快照时的重试次数 (写入只需微秒级)
+READ_RETRIES = 100
+
+# 盘中共享行情快照超过该时长未更新 (约 3 个检查周期) 时视为过期：Web worker 自行请求行情，健康检查报 degraded
+SNAPSHOT_MAX_AGE_SECONDS = 15 * 60
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class MarketSnapshot:
+    def __init__(self, path: str = MARKET_SNAPSHOT_PATH):
+        self.path = path
+        self._write_lock = threading.Lock()
+
+        self._read_lock = threading.Lock()
+        self._reader: Optional[mmap.mmap] = None
+        # ((seq, crc32), 解码后的快照)；整体替换，读路径不加锁
+        self._cached = (None, None)
+
+    # ------------------------------------------------------------------
+    # 写 (leader)
+    # ------------------------------------------------------------------
+    def publish(self, market: Dict[str, Dict[str, Any]], qqq: Optional[Dict[str, Any]] = None,
+                quotes: Optional[Dict[int, Dict[str, Any]]] = None) -> int:
+        """
+        发布一份新快照，返回快照版本号
+
+        quotes 为全部持仓的 {position_id: {"price": ..., "updated_at": ...}} (整体替换上一份)。
+        """
+        with self._write_lock:
+            payload = json.dumps({
+                "market": market,
+                "qqq": qqq or market.get("QQQ"),
+                "quotes": {str(position_id): quote for position_id, quote in (quotes or {}).items()},
+            }, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                size = os.fstat(fd).st_size
+                needed = DATA_OFFSET + len(payload)
+                if size < needed:
+                    capacity = max(INITIAL_CAPACITY, size)
+                    while capacity < needed:
+                        capacity *= 2
+                    os.ftruncate(fd, capacity)
+                with mmap.mmap(fd, 0) as mm:
+                    return self._write(mm, payload)
+            finally:
+                os.close(fd)
+
+    def _write(self, mm: mmap.mmap, payload: bytes) -> int:
+        magic, layout, seq, version, _, _, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            seq, version = 0, 0
+        # 上一个写者在写入中途退出时 seq 停在奇数，直接越过
+        seq += 1 if seq % 2 == 0 else 0
+
+        SEQ.pack_into(mm, SEQ_OFFSET, seq)
+        mm[DATA_OFFSET:DATA_OFFSET + len(payload)] = payload
+        HEADER.pack_into(mm, 0, MAGIC, LAYOUT_VERSION, seq, version + 1, time.time(),
+                         len(payload), zlib.crc32(payload))
+        SEQ.pack_into(mm, SEQ_OFFSET, seq + 1)
+        return version + 1
+
+    # ------------------------------------------------------------------
+    # 读 (所有 worker)
+    # ------------------------------------------------------------------
+    def read(self) -> Optional[Dict[str, Any]]:
+        """
+        返回最新快照 {"version", "published_at", "market", "qqq", "quotes"}；尚未发布过时返回 None
+
+        返回的 dict 在同一版本内被所有调用方共享，不要修改。
+        """
+        mm = self._reader or self._open_reader()
+        if mm is None:
+            return None
+
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(mm, SEQ_OFFSET)[0]
+            if seq % 2:
+                time.sleep(0)
+                continue
+            magic, layout, _, version, published_at, length, crc = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION or seq == 0:
+                return None
+            cached_key, cached = self._cached
+            if (seq, crc) == cached_key:
+                return cached
+            if DATA_OFFSET + length > len(mm):
+                # 写者扩容了文件，重新映射后再读
+                mm = self._open_reader()
+                if mm is None:
+                    return None
+                continue
+            payload = mm[DATA_OFFSET:DATA_OFFSET + length]
+            if SEQ.unpack_from(mm, SEQ_OFFSET)[0] != seq or zlib.crc32(payload) != crc:
+                continue
+
+            snapshot = json.loads(payload)
+            snapshot["version"] = version
+            snapshot["published_at"] = published_at
+            self._cached = ((seq, crc), snapshot)
+            return snapshot
+
+        logger.warning("[WARN] Market snapshot kept changing while reading, giving up")
+        return None
+
+    def age_seconds(self) -> Optional[float]:
+        snapshot = self.read()
+        if snapshot is None:
+            return None
+        return max(0.0, time.time() - snapshot["published_at"])
+
+    def _open_reader(self) -> Optional[mmap.mmap]:
+        with self._read_lock:
+            try:
+                with open(self.path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size < DATA_OFFSET:
+                        return None
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+            # 旧映射可能仍被其他线程读取，交给 GC 回收
+            self._reader = mm
+            return mm
+
+
+_snapshot = MarketSnapshot()
+
+
+def get_market_snapshot() -> MarketSnapshot:
+    return _snapshot
@@ -0,0 +1,81 @@
+"""
+Web 请求中的行情拉取
+
+管理后台的手动刷新、快照过期时的回源会发起阻塞的网络请求 (yfinance / Polygon，含限流 sleep)。
+这些调用不在事件循环上执行，也不直接占用 FastAPI 的请求线程池，而是交给一个独立的小线程池：
+
+- 并发上限 WEB_FETCH_WORKERS: 慢请求最多占满这几个线程，其余页面和 /health 不受影响
+- 排队上限 WEB_FETCH_MAX_PENDING: 已经积压时直接拒绝 (FetchBusy)，不再堆积请求线程
+- 等待上限 WEB_FETCH_TIMEOUT_SECONDS: 超时后向调用方抛出 FetchTimeout；后台线程仍会跑完，
+  结果写入数据源客户端的缓存，下一次请求可以直接命中
+- 批量刷新的备选预算 WEB_FETCH_FALLBACK_BUDGET_SECONDS: Yahoo 批量请求没拿到的合约逐个走 Polygon.io
+  (每分钟 5 次)，超出预算后剩余合约直接报失败，不让一次批量刷新占住线程数分钟
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+WEB_FETCH_WORKERS = int(os.getenv("WEB_FETCH_WORKERS", "4"))
+WEB_FETCH_MAX_PENDING = int(os.getenv("WEB_FETCH_MAX_PENDING", "16"))
+WEB_FETCH_TIMEOUT_SECONDS = float(os.getenv("WEB_FETCH_TIMEOUT_SECONDS", "15"))
+WEB_FETCH_FALLBACK_BUDGET_SECONDS = float(os.getenv("WEB_FETCH_FALLBACK_BUDGET_SECONDS", "30"))
+
+
+class FetchUnavailable(Exception):
+    pass
+
+
+class FetchTimeout(FetchUnavailable):
+    pass
+
+
+class FetchBusy(FetchUnavailable):
+    pass
+
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=WEB_FETCH_WORKERS, thread_name_prefix="web-fetch")
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _release(_future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def fetch(fn: Callable[..., Any], *args, timeout: float = None) -> Any:
+    """
+    在行情线程池中执行 fn(*args) 并等待结果 (从同步路由 / 请求线程池中调用)
+
+    积压过多时抛出 FetchBusy，等待超过 timeout 时抛出 FetchTimeout。
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= WEB_FETCH_MAX_PENDING:
+            metrics.web_fetches.labels("busy").inc()
+            raise FetchBusy(f"Too many market data requests in flight ({_pending})")
+        _pending += 1
+
+    start = time.perf_counter()
+    future = _executor.submit(fn, *args)
+    future.add_done_callback(_release)
+    try:
+        result = future.result(timeout=timeout or WEB_FETCH_TIMEOUT_SECONDS)
+    except concurrent.futures.TimeoutError:
+        metrics.web_fetches.labels("timeout").inc()
+        logger.warning(f"[WARN] Market data request {getattr(fn, '__name__', fn)} timed out "
+                       f"after {time.perf_counter() - start:.1f}s, continuing in background")
+        raise FetchTimeout("Market data request timed out")
+    except Exception:
+        metrics.web_fetches.labels("error").inc()
+        raise
+    metrics.web_fetches.labels("ok").inc()
+    return result
@@ -1,9 +1,14 @@
 import yfinance as yf
 from datetime import datetime, date, timedelta
 from pytz import timezone
+import threading
 import time
 from time import sleep
-from typing import Optional
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from app.monitoring import metrics
 
 et_tz = timezone("America/New_York")
 
@@ -12,16 +17,20 @@ class YFinanceClient:
     def __init__(self):
         self.last_request_time = 0
         self.min_request_interval = 2  # 最小请求间隔 2 秒，避免限流
+        # 多个组合并发检查时共用同一个客户端，请求间隔在锁内保证
+        self._rate_lock = threading.Lock()
 
     def _wait_for_rate_limit(self):
         """避免触发限流"""
-        now = time.time()
-        elapsed = now - self.last_request_time
+        with self._rate_lock:
+            elapsed = time.time() - self.last_request_time
 
-        if elapsed < self.min_request_interval:
-            sleep(self.min_request_interval - elapsed)
+            if elapsed < self.min_request_interval:
+                wait_seconds = self.min_request_interval - elapsed
+                metrics.record_rate_limit_wait("yfinance", wait_seconds)
+                sleep(wait_seconds)
 
-        self.last_request_time = now
+            self.last_request_time = time.time()
 
     def get_qqq_today(self) -> dict:
         """获取 QQQ 当日数据（只获取当日，避免限流）"""
@@ -31,7 +40,8 @@ class YFinanceClient:
             ticker = yf.Ticker("QQQ")
 
             # 只获取当天的数据（1 分钟间隔）
-            data = ticker.history(period="1d", interval="1m")
+            with metrics.track_provider("yfinance", "qqq_today"):
+                data = ticker.history(period="1d", interval="1m")
 
             if data is not None and not data.empty:
                 latest = data.iloc[-1]
@@ -56,7 +66,8 @@ class YFinanceClient:
             ticker = yf.Ticker("QQQ")
 
             # 获取过去 5 天的数据
-            data = ticker.history(period="5d")
+            with metrics.track_provider("yfinance", "qqq_prev_close"):
+                data = ticker.history(period="5d")
 
             if data is not None and len(data) >= 2:
                 # 返回倒数第 2 天的收盘价（昨天）
@@ -76,7 +87,8 @@ class YFinanceClient:
             ticker = yf.Ticker("QQQ")
 
             # 获取过去 5 天的数据（确保有 3 个交易日）
-            data = ticker.history(period="5d")
+            with metrics.track_provider("yfinance", "qqq_3day_high"):
+                data = ticker.history(period="5d")
 
             if data is not None and len(data) >= 3:
                 # 计算过去 3 个交易日的最高价
@@ -88,6 +100,64 @@ class YFinanceClient:
             print(f"Error getting QQQ 3day high: {e}")
             return None
 
+    def get_daily_bars(self, symbol: str, start: date, end: date):
+        """获取 [start, end] 闭区间的日线 (补缺用)，失败时返回 None"""
+        self._wait_for_rate_limit()
+
+        try:
+            ticker = yf.Ticker(symbol)
+            # yfinance 的 end 不包含当天
+            with metrics.track_provider("yfinance", "daily_bars_range"):
+                data = ticker.history(start=start.isoformat(), end=(end + timedelta(days=1)).isoformat(),
+                                      interval="1d")
+
+            if data is not None and not data.empty:
+                return data
+            return None
+        except Exception as e:
+            print(f"Error getting {symbol} daily bars {start}..{end}: {e}")
+            return None
+
+    def download_daily_bars(self, symbols: List[str], period: str) -> Dict[str, pd.DataFrame]:
+        """
+        一次请求批量下载多个标的的日线 (yf.download)，返回 {symbol: DataFrame}
+
+        下载失败或某个标的没有数据时，该标的不出现在结果中。
+        """
+        self._wait_for_rate_limit()
+
+        try:
+            with metrics.track_provider("yfinance", "daily_bars_batch"):
+                data = yf.download(symbols, period=period, interval="1d", group_by="ticker",
+                                   auto_adjust=True, threads=True, progress=False)
+        except Exception as e:
+            print(f"Error downloading daily bars for {symbols}: {e}")
+            return {}
+
+        if data is None or data.empty:
+            return {}
+
+        frames = {}
+        for symbol in symbols:
+            if isinstance(data.columns, pd.MultiIndex):
+                if symbol not in data.columns.get_level_values(0):
+                    continue
+                df = data[symbol]
+            else:
+                df = data
+            # 多标的对齐后，上市晚 / 停牌的标的在其他标的有数据的日期上整行为空
+            df = df.dropna(subset=["Close"]) if "Close" in df.columns else df.iloc[0:0]
+            if not df.empty:
+                frames[symbol] = df
+        return frames
+
+    def get_option_prices(self, tickers: List[str]) -> Dict[str, float]:
+        """一次请求批量获取多个期权合约的最新收盘价 (手动批量刷新用)，没有数据的合约不出现在结果中"""
+        if not tickers:
+            return {}
+        frames = self.download_daily_bars(tickers, period="5d")
+        return {ticker: float(df["Close"].iloc[-1]) for ticker, df in frames.items()}
+
     def get_option_price(self, ticker: str) -> Optional[float]:
         """获取期权价格（避免限流）"""
         self._wait_for_rate_limit()
@@ -98,7 +168,8 @@ class YFinanceClient:
 
             # 方法 1: 直接获取
             try:
-                data = ticker_obj.history(period="5d", interval="1d")
+                with metrics.track_provider("yfinance", "option_price"):
+                    data = ticker_obj.history(period="5d", interval="1d")
 
                 if data is not None and not data.empty:
                     latest = data.iloc[-1]
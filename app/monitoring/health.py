@@ -0,0 +1,85 @@
+"""
+组件健康状态登记
+
+各组件在自己的正常流程中上报状态 (调度任务执行、数据源调用、后台采样线程)，
+/health 和 /health/detailed 只读这里的内存数据，探活请求本身不查库、不请求行情。
+
+每个组件一条记录 {"status", "updated_at", ...详情}:
+
+- status: ok / standby / no_data 视为健康，其余 (degraded / error / stale) 使整体状态降为 degraded
+- stale_after: 超过该秒数没有再上报时，读取时状态显示为 stale (上报方卡住或已退出)
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+HEALTHY_STATUSES = ("ok", "standby", "no_data")
+
+# 连续失败达到该次数时，数据源状态显示为 degraded
+PROVIDER_FAILURE_THRESHOLD = 3
+
+
+class HealthRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._providers: Dict[str, Dict[str, Any]] = {}
+
+    def report(self, component: str, status: str, stale_after: Optional[float] = None, **details):
+        """整体替换组件的状态"""
+        entry = {"status": status, "updated_at": time.time(), **details}
+        if stale_after is not None:
+            entry["stale_after"] = stale_after
+        with self._lock:
+            self._components[component] = entry
+
+    def record_provider_call(self, provider: str, ok: bool, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            entry = self._providers.setdefault(provider, {"consecutive_errors": 0})
+            if ok:
+                entry["consecutive_errors"] = 0
+                entry["last_success_at"] = now
+            else:
+                entry["consecutive_errors"] += 1
+                entry["last_error_at"] = now
+                if error:
+                    entry["last_error"] = error
+
+    def components(self) -> Dict[str, Dict[str, Any]]:
+        """当前所有组件的状态 (副本)，时间戳换算为距今秒数"""
+        now = time.time()
+        with self._lock:
+            components = {name: dict(entry) for name, entry in self._components.items()}
+            providers = {name: dict(entry) for name, entry in self._providers.items()}
+
+        for entry in components.values():
+            age = now - entry.pop("updated_at")
+            stale_after = entry.pop("stale_after", None)
+            if stale_after is not None and age > stale_after:
+                entry["status"] = "stale"
+            entry["age_seconds"] = round(age, 1)
+
+        if providers:
+            for entry in providers.values():
+                entry["status"] = "degraded" if entry["consecutive_errors"] >= PROVIDER_FAILURE_THRESHOLD else "ok"
+                for key in ("last_success_at", "last_error_at"):
+                    if key in entry:
+                        entry[key.replace("_at", "_age_seconds")] = round(now - entry.pop(key), 1)
+            components["providers"] = {
+                "status": "ok" if all(entry["status"] == "ok" for entry in providers.values()) else "degraded",
+                "providers": providers,
+            }
+        return components
+
+    def overall(self, components: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        components = self.components() if components is None else components
+        healthy = all(entry["status"] in HEALTHY_STATUSES for entry in components.values())
+        return "healthy" if healthy else "degraded"
+
+
+_registry = HealthRegistry()
+
+
+def get_health() -> HealthRegistry:
+    return _registry
@@ -0,0 +1,111 @@
+"""
+健康状态后台采样
+
+数据库延迟、共享快照新鲜度、通知发件箱积压没有自然的上报时机，由每个 worker 的一个后台线程
+每 HEALTH_SAMPLE_SECONDS 采样一次写入健康状态登记；探活请求只读登记结果。
+采样线程退出或卡住时，这些组件在超过 3 个采样间隔后显示为 stale。
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func, select, text
+
+from app.database.init_db import read_engine
+from app.database.models import NotificationOutbox
+from app.market.snapshot import get_market_snapshot, SNAPSHOT_MAX_AGE_SECONDS
+from app.monitoring.health import get_health
+from app.scheduler.trading_hours import is_market_open_now
+
+logger = logging.getLogger(__name__)
+
+HEALTH_SAMPLE_SECONDS = float(os.getenv("HEALTH_SAMPLE_SECONDS", "15"))
+# 只读查询 SELECT 1 超过该耗时时数据库状态显示为 degraded
+DB_LATENCY_WARN_SECONDS = 0.5
+# 最早一条待投递通知等待超过该时长时发件箱状态显示为 degraded
+OUTBOX_BACKLOG_WARN_SECONDS = 10 * 60
+
+
+def sample_database():
+    stale_after = HEALTH_SAMPLE_SECONDS * 3
+    start = time.perf_counter()
+    try:
+        with read_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        get_health().report("database", "error", stale_after=stale_after, message=str(e))
+        return
+    latency = time.perf_counter() - start
+    get_health().report("database", "ok" if latency < DB_LATENCY_WARN_SECONDS else "degraded",
+                        stale_after=stale_after, latency_ms=round(latency * 1000, 2))
+
+
+def sample_snapshot():
+    stale_after = HEALTH_SAMPLE_SECONDS * 3
+    snapshot = get_market_snapshot().read()
+    if snapshot is None:
+        get_health().report("market_snapshot", "no_data", stale_after=stale_after)
+        return
+    age = time.time() - snapshot["published_at"]
+    # 休市期间快照不再更新，不算过期
+    expired = age > SNAPSHOT_MAX_AGE_SECONDS and is_market_open_now()
+    get_health().report("market_snapshot", "degraded" if expired else "ok", stale_after=stale_after,
+                        version=snapshot["version"], snapshot_age_seconds=round(age, 1),
+                        has_qqq=bool((snapshot.get("qqq") or {}).get("last_price")))
+
+
+def sample_outbox():
+    stale_after = HEALTH_SAMPLE_SECONDS * 3
+    with read_engine.connect() as conn:
+        counts = dict(conn.execute(
+            select(NotificationOutbox.status, func.count()).group_by(NotificationOutbox.status)
+        ).all())
+        oldest = conn.execute(
+            select(func.min(NotificationOutbox.enqueued_at)).where(NotificationOutbox.status == "pending")
+        ).scalar()
+    backlog = time.time() - oldest if oldest is not None else 0.0
+    get_health().report("outbox", "degraded" if backlog > OUTBOX_BACKLOG_WARN_SECONDS else "ok",
+                        stale_after=stale_after, pending=counts.get("pending", 0), dead=counts.get("dead", 0),
+                        oldest_pending_age_seconds=round(backlog, 1))
+
+
+SAMPLERS = (sample_database, sample_snapshot, sample_outbox)
+
+
+class HealthSampler:
+    def __init__(self, interval: float = HEALTH_SAMPLE_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="health-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def sample(self):
+        for sampler in SAMPLERS:
+            try:
+                sampler()
+            except Exception as e:
+                logger.error(f"[ERROR] Health sampler {sampler.__name__} failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+_sampler = HealthSampler()
+
+
+def get_health_sampler() -> HealthSampler:
+    return _sampler
@@ -0,0 +1,371 @@
+"""
+进程内指标 (Prometheus 文本格式)
+
+Counter / Gauge / Histogram 都按标签组合拆成子对象，热路径上只是一次
+未竞争的锁 + 浮点加法；渲染时才遍历全部子对象。
+/metrics 端点直接输出 render() 的结果。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.monitoring.health import get_health
+
+# 默认桶: 覆盖 1ms ~ 5min，适配从单次 DB 提交到完整检查周期的量级
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str, **kwargs: str):
+        if kwargs:
+            values = tuple(str(kwargs[n]) for n in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_to_current_time(self):
+        self.set(time.time())
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+
+
+class _HistogramChild:
+    __slots__ = ("_upper_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self._upper_bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self._upper_bounds + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# === 调度任务 ===
+job_duration = registry.register(Histogram(
+    "leaps_job_duration_seconds", "Total wall time of a scheduler job run", ["job"]))
+job_stage_duration = registry.register(Histogram(
+    "leaps_job_stage_duration_seconds", "Wall time spent per stage within a scheduler job run", ["job", "stage"]))
+job_runs = registry.register(Counter(
+    "leaps_job_runs_total", "Scheduler job runs by outcome", ["job", "status"]))
+job_last_success = registry.register(Gauge(
+    "leaps_job_last_success_timestamp_seconds", "Unix time of the last successful job run", ["job"]))
+
+scheduler_leader = registry.register(Gauge(
+    "leaps_scheduler_leader", "1 if this process holds the scheduler lease and runs jobs"))
+leader_transitions = registry.register(Counter(
+    "leaps_scheduler_leader_transitions_total", "Scheduler lease acquisitions and losses", ["event"]))
+
+# === 行情数据源 ===
+provider_request_duration = registry.register(Histogram(
+    "leaps_provider_request_duration_seconds", "Latency of market data provider calls", ["provider", "operation"]))
+provider_errors = registry.register(Counter(
+    "leaps_provider_errors_total", "Failed market data provider calls", ["provider", "operation"]))
+provider_rate_limit_waits = registry.register(Counter(
+    "leaps_provider_rate_limit_waits_total", "Times a provider call was delayed by the rate limiter", ["provider"]))
+provider_rate_limit_wait_seconds = registry.register(Counter(
+    "leaps_provider_rate_limit_wait_seconds_total", "Seconds spent sleeping in provider rate limiters", ["provider"]))
+
+web_fetches = registry.register(Counter(
+    "leaps_web_fetches_total", "Market data fetches made from web requests by outcome (ok/error/timeout/busy)",
+    ["outcome"]))
+live_clients = registry.register(Gauge(
+    "leaps_live_clients", "Open Server-Sent Events connections on this worker"))
+live_events = registry.register(Counter(
+    "leaps_live_events_total", "Events published to the live stream by type (market/alert)", ["event"]))
+
+# === 缓存 ===
+cache_requests = registry.register(Counter(
+    "leaps_cache_requests_total", "Cache lookups by outcome (hit/miss)", ["cache", "result"]))
+
+bar_missing_sessions = registry.register(Gauge(
+    "leaps_bar_missing_sessions", "Trading sessions missing from the local bar store after the last backfill",
+    ["ticker"]))
+
+# === 数据库 ===
+db_commit_duration = registry.register(Histogram(
+    "leaps_db_commit_duration_seconds", "Latency of SQLAlchemy session commits (flush + COMMIT)"))
+
+write_buffer_rows = registry.register(Counter(
+    "leaps_write_buffer_flushed_rows_total", "Rows written by write-behind buffer flushes", ["kind"]))
+
+retention_rows_deleted = registry.register(Counter(
+    "leaps_retention_deleted_rows_total", "Rows deleted by retention cleanup", ["table"]))
+retention_bytes_reclaimed = registry.register(Counter(
+    "leaps_retention_reclaimed_bytes_total", "Bytes returned to the filesystem by incremental vacuum"))
+
+# === 通知 ===
+wechat_send_duration = registry.register(Histogram(
+    "leaps_wechat_send_duration_seconds", "Latency of WeChat webhook sends", ["status"]))
+wechat_packed_messages = registry.register(Counter(
+    "leaps_wechat_packed_messages_total", "Alerts merged into a combined markdown message because of the rate limit"))
+notification_delivery_latency = registry.register(Histogram(
+    "leaps_notification_delivery_latency_seconds", "Time from outbox enqueue to successful delivery", ["channel"]))
+notification_deliveries = registry.register(Counter(
+    "leaps_notification_deliveries_total", "Outbox delivery attempts by outcome (sent/retry/dead)",
+    ["channel", "outcome"]))
+notification_outbox_pending = registry.register(Gauge(
+    "leaps_notification_outbox_pending", "Outbox rows waiting for delivery"))
+
+
+def render() -> str:
+    return registry.render()
+
+
+@contextmanager
+def track_provider(provider: str, operation: str):
+    """统计一次数据源调用的耗时；块内抛出的异常计入错误数后继续抛出"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        provider_errors.labels(provider, operation).inc()
+        get_health().record_provider_call(provider, False, f"{operation}: {e}")
+        raise
+    else:
+        get_health().record_provider_call(provider, True)
+    finally:
+        provider_request_duration.labels(provider, operation).observe(time.perf_counter() - start)
+
+
+def record_provider_error(provider: str, operation: str):
+    provider_errors.labels(provider, operation).inc()
+    get_health().record_provider_call(provider, False, operation)
+
+
+def record_rate_limit_wait(provider: str, seconds: float):
+    provider_rate_limit_waits.labels(provider).inc()
+    provider_rate_limit_wait_seconds.labels(provider).inc(seconds)
+
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.labels(cache, "hit" if hit else "miss").inc()
+
+
+class JobTimer:
+    """
+    记录一次任务运行的总耗时与分阶段耗时
+
+    同一阶段可以多次进入 (例如逐个持仓的 fetch)，结束时按阶段累加后各上报一次。
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.status = "success"
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        # 组合并发检查时多个线程累加同一阶段
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def finish(self, status: Optional[str] = None):
+        status = status or self.status
+        for name, seconds in self.stages.items():
+            job_stage_duration.labels(self.job, name).observe(seconds)
+        job_duration.labels(self.job).observe(time.perf_counter() - self._start)
+        job_runs.labels(self.job, status).inc()
+        if status == "success":
+            job_last_success.labels(self.job).set_to_current_time()
+
+
+@contextmanager
+def job_timer(job: str):
+    timer = JobTimer(job)
+    try:
+        yield timer
+    except Exception:
+        timer.finish("error")
+        raise
+    else:
+        timer.finish()
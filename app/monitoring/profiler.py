@@ -0,0 +1,280 @@
+"""
+按需性能剖析
+
+管理员在后台打开一个有限时长的剖析窗口后:
+- 被 @profile_job 装饰的调度任务每次运行都会被剖析
+- 命中所选路由前缀的 HTTP 请求按 sample_rate 抽样剖析
+
+两种模式:
+- sample  : 后台线程按固定间隔抓取调用栈，输出 collapsed stack (.folded)，可直接喂给 flamegraph.pl / speedscope
+- cprofile: cProfile 确定性剖析，输出 .pstats
+
+窗口关闭时 (默认状态) 装饰器和中间件只做一次时间比较，不产生额外开销。
+
+窗口状态写在剖析目录旁的 JSON 文件里，所有 worker 共用：管理员的请求落在哪个 worker 上都一样，
+运行调度任务的 leader 进程也会进入剖析。各进程最多每 WINDOW_CHECK_SECONDS 检查一次文件是否变化。
+
+HTTP 路由大多是同步路由，在线程池中执行，cProfile 只能剖析启用它的线程，因此路由剖析总是
+使用 sample 模式 (对所有线程采样)；cprofile 模式只用于调度任务。
+
+cProfile 同一时刻只允许一个剖析器：事件循环上并发的请求会互相记入对方的调用，
+Python 3.12+ 上第二个 enable() 还会直接报错。已有剖析进行中时，新的请求 / 任务不剖析，照常执行。
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", "profiles")
+
+MODES = ("sample", "cprofile")
+MAX_DURATION_SECONDS = 600
+MAX_PROFILE_FILES = 200
+WINDOW_CHECK_SECONDS = 1.0
+
+
+class StackSampler:
+    """后台线程周期性抓取目标线程的调用栈，按 collapsed stack 计数"""
+
+    def __init__(self, thread_ids: Optional[Sequence[int]] = None, interval: float = 0.005):
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                self.stacks[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            parts.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ";".join(reversed(parts))
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    def __init__(self, profile_dir: str = PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self.window_path = os.path.normpath(profile_dir) + "-window.json"
+        self.mode = "sample"
+        self.sample_rate = 1.0
+        self.route_prefixes: List[str] = []
+        self.interval = 0.005
+        # 窗口结束时间 (epoch 秒，跨进程比较)
+        self._until = 0.0
+        # 已载入的窗口文件 (inode, mtime)；每次写入都替换为新文件，inode 随之变化
+        self._window_stamp: Optional[tuple] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+
+    def is_active(self) -> bool:
+        self._sync_window()
+        return self._until > 0.0 and time.time() < self._until
+
+    def _sync_window(self, force: bool = False):
+        """其他 worker 打开 / 关闭窗口后，从共享文件载入"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < WINDOW_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.window_path)
+        except OSError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp == self._window_stamp:
+            return
+        try:
+            with open(self.window_path) as f:
+                window = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._window_stamp = stamp
+            self.mode = window.get("mode", "sample")
+            self.sample_rate = window.get("sample_rate", 1.0)
+            self.route_prefixes = window.get("route_prefixes", [])
+            self.interval = window.get("interval", 0.005)
+            self._until = window.get("until", 0.0)
+
+    def _write_window(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.window_path)), exist_ok=True)
+        tmp = f"{self.window_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"mode": self.mode, "sample_rate": self.sample_rate, "route_prefixes": self.route_prefixes,
+                       "interval": self.interval, "until": self._until}, f)
+        os.replace(tmp, self.window_path)
+        stat = os.stat(self.window_path)
+        self._window_stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    def start(self, duration_seconds: int, mode: str = "sample", sample_rate: float = 1.0,
+              route_prefixes: Sequence[str] = (), interval: float = 0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        duration_seconds = max(1, min(int(duration_seconds), MAX_DURATION_SECONDS))
+
+        with self._lock:
+            self.mode = mode
+            self.sample_rate = max(0.0, min(float(sample_rate), 1.0))
+            self.route_prefixes = [p for p in route_prefixes if p]
+            self.interval = interval
+            self._until = time.time() + duration_seconds
+            self._write_window()
+
+        logger.info(f"[PROFILE] Profiling enabled for {duration_seconds}s (mode={mode}, "
+                    f"sample_rate={self.sample_rate}, routes={self.route_prefixes})")
+
+    def stop(self):
+        with self._lock:
+            self._until = 0.0
+            self._write_window()
+        logger.info("[PROFILE] Profiling disabled")
+
+    def status(self) -> Dict[str, Any]:
+        active = self.is_active()
+        return {
+            "active": active,
+            "remaining_seconds": round(self._until - time.time(), 1) if active else 0,
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "route_prefixes": self.route_prefixes,
+            "profile_dir": os.path.abspath(self.profile_dir),
+            "recent_files": self.list_profiles()[:20],
+        }
+
+    def list_profiles(self) -> List[str]:
+        if not os.path.isdir(self.profile_dir):
+            return []
+        return sorted(os.listdir(self.profile_dir), reverse=True)
+
+    def should_profile_route(self, path: str) -> bool:
+        if not self.is_active() or not self.route_prefixes:
+            return False
+        if not any(path.startswith(prefix) for prefix in self.route_prefixes):
+            return False
+        return random.random() < self.sample_rate
+
+    def _output_path(self, name: str, extension: str) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name).strip("_")
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        return os.path.join(self.profile_dir, f"{safe_name}-{timestamp}.{extension}")
+
+    def _prune(self):
+        files = self.list_profiles()
+        for stale in files[MAX_PROFILE_FILES:]:
+            try:
+                os.remove(os.path.join(self.profile_dir, stale))
+            except OSError:
+                pass
+
+    @contextmanager
+    def profile(self, name: str, all_threads: bool = False, mode: Optional[str] = None):
+        """剖析 with 块 (mode 默认为窗口的模式)；sample 模式默认只采样当前线程"""
+        if (mode or self.mode) == "cprofile":
+            if not self._cprofile_lock.acquire(blocking=False):
+                logger.debug(f"[PROFILE] Skipped {name}: another cProfile session is active")
+                yield
+                return
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    path = self._output_path(name, "pstats")
+                    profile.dump_stats(path)
+                    logger.info(f"[PROFILE] Wrote {path}")
+                    self._prune()
+            finally:
+                self._cprofile_lock.release()
+        else:
+            sampler = StackSampler(None if all_threads else [threading.get_ident()], self.interval)
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                path = self._output_path(name, "folded")
+                sampler.write(path)
+                logger.info(f"[PROFILE] Wrote {path} ({sum(sampler.stacks.values())} samples)")
+                self._prune()
+
+
+_profiler = Profiler()
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+
+def profile_job(name: str):
+    """调度任务装饰器：剖析窗口打开时剖析每次运行，否则直接调用"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profiler.is_active():
+                return func(*args, **kwargs)
+            with _profiler.profile(f"job-{name}"):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    """
+    纯 ASGI 中间件：只有窗口打开且路由命中时才进入剖析
+
+    异步路由与事件循环同线程，同步路由在线程池中执行，因此不论窗口是哪种模式都用 sample 模式
+    对所有线程采样 (每条栈以线程名为根，可在火焰图中区分)。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _profiler.should_profile_route(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        with _profiler.profile(f"route-{scope['method']}-{scope['path']}", all_threads=True, mode="sample"):
+            await self.app(scope, receive, send)
@@ -0,0 +1,180 @@
+"""
+通知渠道
+
+outbox 中每行对应一个 (渠道, 目标)。dispatcher 按 (渠道, 目标) 分组后并发投递，
+每个渠道有自己的超时，一批通知的总耗时取决于最慢的渠道而不是各渠道之和。
+
+- wechat:  企业微信群机器人，目标为 Webhook URL (按速率配额合并突发，见 wechat.py)
+- webhook: 通用 JSON Webhook，POST {"message", "alert_log_id", "enqueued_at"}，2xx 视为成功
+- email:   SMTP 中继，目标为 smtp://host:port?from=...&to=a@x,b@y (面向本机中继，不做认证 / TLS)
+- file:    追加 JSON Lines 到本地文件
+- syslog:  本机 syslog (/dev/log 等 Unix socket 路径) 或 host:port (UDP)
+
+每个发送函数接收同一目标的一批 outbox 行，返回每行的 (是否成功, 失败原因)。
+"""
+import json
+import os
+import smtplib
+import socket
+import threading
+import time
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.notification.wechat import get_wechat_notifier
+
+Result = Tuple[bool, Optional[str]]
+
+# 各渠道单次请求 / 连接的超时 (秒)
+CHANNEL_TIMEOUTS = {
+    "wechat": 10.0,
+    "webhook": 5.0,
+    "email": 10.0,
+    "file": 2.0,
+    "syslog": 2.0,
+}
+
+SYSLOG_FACILITY_USER = 1
+SYSLOG_SEVERITY_WARNING = 4
+SYSLOG_TAG = "leaps-alert"
+
+
+def _send_wechat(destination: str, rows) -> List[Result]:
+    results = get_wechat_notifier(destination).send_batch([row.message for row in rows])
+    return [(success, None if success else error or "Failed to send WeChat notification")
+            for success, error in results]
+
+
+_webhook_sessions: Dict[str, requests.Session] = {}
+_webhook_sessions_lock = threading.Lock()
+
+
+def _webhook_session(url: str) -> requests.Session:
+    with _webhook_sessions_lock:
+        session = _webhook_sessions.get(url)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0))
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0))
+            _webhook_sessions[url] = session
+        return session
+
+
+def _send_webhook(destination: str, rows) -> List[Result]:
+    session = _webhook_session(destination)
+    results = []
+    for row in rows:
+        try:
+            response = session.post(destination, json={
+                "message": row.message,
+                "alert_log_id": row.alert_log_id,
+                "enqueued_at": row.enqueued_at,
+            }, timeout=CHANNEL_TIMEOUTS["webhook"])
+            if 200 <= response.status_code < 300:
+                results.append((True, None))
+            else:
+                results.append((False, f"Webhook HTTP error: {response.status_code}"))
+        except Exception as e:
+            results.append((False, f"Failed to post webhook: {e}"))
+    return results
+
+
+def _parse_email_url(destination: str) -> Tuple[str, int, str, List[str]]:
+    parts = urlsplit(destination)
+    if parts.scheme != "smtp" or not parts.hostname:
+        raise ValueError(f"Invalid email destination: {destination}")
+    query = parse_qs(parts.query)
+    recipients = [address.strip() for value in query.get("to", []) for address in value.split(",") if address.strip()]
+    if not recipients:
+        raise ValueError(f"No recipients in email destination: {destination}")
+    sender = query.get("from", ["leaps-alert@localhost"])[0]
+    return parts.hostname, parts.port or 25, sender, recipients
+
+
+def _send_email(destination: str, rows) -> List[Result]:
+    try:
+        host, port, sender, recipients = _parse_email_url(destination)
+    except ValueError as e:
+        return [(False, str(e))] * len(rows)
+
+    results: List[Result] = []
+    try:
+        # 同一目标的一批邮件共用一个 SMTP 连接
+        with smtplib.SMTP(host, port, timeout=CHANNEL_TIMEOUTS["email"]) as smtp:
+            for row in rows:
+                email = EmailMessage()
+                email["From"] = sender
+                email["To"] = ", ".join(recipients)
+                email["Subject"] = f"[LEAPS] {row.message.strip().splitlines()[0] if row.message.strip() else 'Alert'}"
+                email.set_content(row.message)
+                try:
+                    smtp.send_message(email)
+                    results.append((True, None))
+                except smtplib.SMTPException as e:
+                    results.append((False, f"SMTP error: {e}"))
+    except Exception as e:
+        error = f"Failed to send email: {e}"
+        results += [(False, error)] * (len(rows) - len(results))
+    return results
+
+
+_file_lock = threading.Lock()
+
+
+def _send_file(destination: str, rows) -> List[Result]:
+    try:
+        directory = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps({
+            "ts": time.time(),
+            "alert_log_id": row.alert_log_id,
+            "message": row.message,
+        }, ensure_ascii=False) + "\n" for row in rows)
+        with _file_lock, open(destination, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return [(True, None)] * len(rows)
+    except Exception as e:
+        return [(False, f"Failed to write notification file: {e}")] * len(rows)
+
+
+def _send_syslog(destination: str, rows) -> List[Result]:
+    priority = SYSLOG_FACILITY_USER * 8 + SYSLOG_SEVERITY_WARNING
+    try:
+        if destination.startswith("/"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            address = destination
+        else:
+            host, _, port = destination.rpartition(":")
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            address = (host or "localhost", int(port or 514))
+        with sock:
+            sock.settimeout(CHANNEL_TIMEOUTS["syslog"])
+            sock.connect(address)
+            for row in rows:
+                # syslog 一条记录一行
+                text = " | ".join(line for line in row.message.splitlines() if line.strip())
+                sock.send(f"<{priority}>{SYSLOG_TAG}: {text}".encode("utf-8"))
+        return [(True, None)] * len(rows)
+    except Exception as e:
+        return [(False, f"Failed to send syslog message: {e}")] * len(rows)
+
+
+SENDERS: Dict[str, Callable[[str, list], List[Result]]] = {
+    "wechat": _send_wechat,
+    "webhook": _send_webhook,
+    "email": _send_email,
+    "file": _send_file,
+    "syslog": _send_syslog,
+}
+
+
+def deliver(channel: str, destination: str, rows) -> List[Result]:
+    """投递同一 (渠道, 目标) 的一批 outbox 行"""
+    sender = SENDERS.get(channel)
+    if sender is None:
+        return [(False, f"Unknown notification channel: {channel}")] * len(rows)
+    return sender(destination, rows)
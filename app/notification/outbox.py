@@ -0,0 +1,335 @@
+"""
+通知发件箱 (outbox)
+
+检查周期不再同步调用 Webhook：报警日志和待投递的通知在写缓冲 flush 时写入同一事务，
+由 leader 进程中的 dispatcher 线程异步投递，规则检查不再等待外部 HTTP。
+
+- 幂等键: 同一天同一报警 (类型 + 规则 + 持仓/标的 + 组合) 发往同一目标只入队一次，
+  flush 重试或换主后重复入队会被唯一索引忽略
+- 认领: 投递前用带条件的 UPDATE 把 next_attempt_at 推到 CLAIM_SECONDS 之后，其他 dispatcher 不会同时投递同一行；
+  一批投递 (限速排队 + 渠道超时) 可能比租约更久，投递期间每 CLAIM_RENEW_SECONDS 续租一次。
+  停止时未投递的行立即释放认领。尝试次数只在记录投递结果时累加，认领本身不计数
+- 重试: 失败后按指数退避重新排队 (5s, 10s, 20s ... 最长 15 分钟)，MAX_ATTEMPTS 次后转为死信 (status=dead)，
+  可在管理接口中重新入队
+- 渠道: 同一报警按配置的每个 (渠道, 目标) 各入队一行，各组并发投递 (见 channels.py)，各渠道独立重试
+- 投递结果按渠道回写 AlertLog.delivery_results，并汇总到 sent_successfully / error_message；
+  入队到送达的延迟按渠道记入 metrics
+
+投递语义为至少一次：发送成功后、标记完成前进程退出时，恢复后会再发一次。
+"""
+import concurrent.futures
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.database.init_db import engine, read_engine
+from app.database.models import AlertLog, NotificationOutbox
+from app.monitoring import metrics
+from app.notification import channels
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 5.0
+BATCH_SIZE = 50
+# 并发投递的 (渠道, 目标) 组数上限
+CHANNEL_WORKERS = 8
+# 认领租约：dispatcher 退出后未续租的行在该时长后重新变为可投递
+CLAIM_SECONDS = 60.0
+CLAIM_RENEW_SECONDS = 20.0
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 5.0
+BACKOFF_MAX_SECONDS = 15 * 60.0
+
+
+def idempotency_key(alert: Dict[str, Any], channel: str, destination: str, day: str) -> str:
+    parts = [
+        day, channel, alert.get("alert_type", ""), alert.get("rule_name", ""),
+        str(alert.get("position_id") or alert.get("symbol") or ""),
+        # 汇总报警按持仓集合区分 (同一天同一规则后来又命中新持仓时仍会发送)
+        ",".join(str(position_id) for position_id in alert.get("position_ids") or []),
+        str(alert.get("portfolio_id") or ""),
+        destination,
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def build_notification(alert: Dict[str, Any], message: str, destination: str, day: str,
+                       channel: str = "wechat") -> Dict[str, Any]:
+    """生成 outbox 行 (alert_log_id 在 flush 时回填)"""
+    now = time.time()
+    return {
+        "idempotency_key": idempotency_key(alert, channel, destination, day),
+        "channel": channel,
+        "destination": destination,
+        "message": message,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "enqueued_at": now,
+    }
+
+
+def backoff_seconds(attempts: int) -> float:
+    return min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+
+
+class OutboxDispatcher:
+    def __init__(self, poll_interval: float = POLL_INTERVAL_SECONDS, batch_size: int = BATCH_SIZE):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # 各 (渠道, 目标) 并发投递
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=CHANNEL_WORKERS,
+                                                               thread_name_prefix="outbox-channel")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 已认领、尚未记录结果的行 (由续租线程延长租约)
+        self._in_flight: set = set()
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("[INFO] Notification outbox dispatcher started")
+
+    def stop(self, timeout: float = 15.0):
+        """停止投递；未投递的行留在 outbox 中，由下一个 leader 继续"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info("[INFO] Notification outbox dispatcher stopped")
+
+    def wake(self):
+        """有新通知入队时立即投递，不等下一次轮询"""
+        self._wake.set()
+
+    def _run(self):
+        from app.scheduler import leader
+
+        while not self._stop.is_set():
+            handled = 0
+            if leader.is_leader():
+                try:
+                    handled = self.dispatch_once()
+                except Exception as e:
+                    logger.error(f"[ERROR] Outbox dispatch failed: {e}", exc_info=True)
+            # 一批未取满说明已清空，等待唤醒或下一次轮询
+            if handled < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def dispatch_once(self) -> int:
+        """投递一批到期的通知，返回处理行数"""
+        now = time.time()
+        with read_engine.connect() as conn:
+            rows = conn.execute(
+                select(NotificationOutbox)
+                .where(NotificationOutbox.status == "pending", NotificationOutbox.next_attempt_at <= now)
+                .order_by(NotificationOutbox.next_attempt_at)
+                .limit(self.batch_size)
+            ).all()
+
+        # 先认领整批，再按 (渠道, 目标) 分组 (同一 Webhook 的消息共享速率配额，才能合并突发)
+        groups: Dict[Tuple[str, str], list] = {}
+        for row in rows:
+            if self._claim(row.id):
+                with self._in_flight_lock:
+                    self._in_flight.add(row.id)
+                groups.setdefault((row.channel, row.destination), []).append(row)
+
+        if not groups:
+            self._update_pending_gauge()
+            return len(rows)
+
+        # 各组并发投递，总耗时取决于最慢的渠道；每个渠道的超时由发送函数控制
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew_claims, args=(done,), name="outbox-claim-renewer", daemon=True)
+        renewer.start()
+        try:
+            futures = [self._executor.submit(self._deliver_group, channel, destination, group)
+                       for (channel, destination), group in groups.items()]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        finally:
+            done.set()
+            renewer.join()
+            # 异常退出的组：释放认领，不计尝试次数
+            with self._in_flight_lock:
+                leftover, self._in_flight = list(self._in_flight), set()
+            self._release(leftover)
+
+        self._update_pending_gauge()
+        return len(rows)
+
+    def _deliver_group(self, channel: str, destination: str, group: list):
+        if self._stop.is_set():
+            # 未投递：由 dispatch_once 释放认领，下一个 leader 立即可以接手
+            return
+        try:
+            results = channels.deliver(channel, destination, group)
+        except Exception as e:
+            logger.error(f"[ERROR] Notification channel {channel} failed: {e}", exc_info=True)
+            results = [(False, f"{channel} delivery failed: {e}")] * len(group)
+        for row, (success, error) in zip(group, results):
+            self._record(row, row.attempts + 1, success, error)
+
+    def _claim(self, outbox_id: int) -> bool:
+        now = time.time()
+        with engine.begin() as conn:
+            result = conn.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id == outbox_id, NotificationOutbox.status == "pending",
+                       NotificationOutbox.next_attempt_at <= now)
+                .values(next_attempt_at=now + CLAIM_SECONDS)
+            )
+            return result.rowcount == 1
+
+    def _renew_claims(self, done: threading.Event):
+        """投递期间定期延长仍在投递中的行的租约，避免超时后被其他 dispatcher 重复发送"""
+        while not done.wait(CLAIM_RENEW_SECONDS):
+            # 持锁执行：_record 移出集合后，续租不会覆盖它写入的退避时间
+            with self._in_flight_lock:
+                ids = list(self._in_flight)
+                if not ids:
+                    continue
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(
+                            update(NotificationOutbox)
+                            .where(NotificationOutbox.id.in_(ids), NotificationOutbox.status == "pending")
+                            .values(next_attempt_at=time.time() + CLAIM_SECONDS)
+                        )
+                except Exception as e:
+                    logger.warning(f"[WARN] Failed to renew outbox claims: {e}")
+
+    @staticmethod
+    def _release(ids: List[int]):
+        if not ids:
+            return
+        with engine.begin() as conn:
+            conn.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids), NotificationOutbox.status == "pending")
+                .values(next_attempt_at=time.time())
+            )
+
+    def _record(self, row, attempts: int, success: bool, error: Optional[str]):
+        """
+        记录一行的投递结果，并回写到报警日志：
+
+        - delivery_results[渠道] = {"status", "attempts", "error"}
+        - sent_successfully: 任一渠道送达即为 True；所有渠道都成为死信时为 False；其余情况保持 NULL (投递中)
+        """
+        now = time.time()
+        with self._in_flight_lock:
+            self._in_flight.discard(row.id)
+        if success:
+            values = {"status": "sent", "delivered_at": now, "last_error": None}
+            outcome = "sent"
+            metrics.notification_delivery_latency.labels(row.channel).observe(now - row.enqueued_at)
+        elif attempts >= MAX_ATTEMPTS:
+            values = {"status": "dead", "last_error": error}
+            outcome = "dead"
+            logger.error(f"[ERROR] Notification {row.id} ({row.channel}) dead-lettered after {attempts} attempts: {error}")
+        else:
+            values = {"next_attempt_at": now + backoff_seconds(attempts), "last_error": error}
+            outcome = "retry"
+            logger.warning(f"[WARN] Notification {row.id} ({row.channel}) failed (attempt {attempts}), will retry: {error}")
+
+        with engine.begin() as conn:
+            conn.execute(update(NotificationOutbox).where(NotificationOutbox.id == row.id)
+                         .values(attempts=attempts, **values))
+            if row.alert_log_id:
+                self._record_log(conn, row, outcome, attempts, error)
+        metrics.notification_deliveries.labels(row.channel, outcome).inc()
+
+    @staticmethod
+    def _record_log(conn, row, outcome: str, attempts: int, error: Optional[str]):
+        result = json.dumps({"status": outcome, "attempts": attempts, "error": error}, ensure_ascii=False)
+        # json_set 在 SQLite 内原地修改，各渠道线程并发回写时不会互相覆盖
+        values = {"delivery_results": func.json_set(func.coalesce(AlertLog.delivery_results, "{}"),
+                                                     f"$.{row.channel}", func.json(result))}
+        log = update(AlertLog).where(AlertLog.id == row.alert_log_id)
+        if outcome == "sent":
+            values.update(sent_successfully=True, error_message=None)
+        elif outcome == "dead":
+            # 其他渠道已送达或仍在投递时不标记失败
+            others_pending = (
+                select(NotificationOutbox.id)
+                .where(NotificationOutbox.alert_log_id == row.alert_log_id,
+                       NotificationOutbox.status == "pending")
+                .exists()
+            )
+            conn.execute(log.values(**values))
+            conn.execute(
+                log.where(AlertLog.sent_successfully.is_(None), ~others_pending)
+                .values(sent_successfully=False, error_message=f"{error} (gave up after {attempts} attempts)")
+            )
+            return
+        conn.execute(log.values(**values))
+
+    def _update_pending_gauge(self):
+        with read_engine.connect() as conn:
+            pending = conn.execute(
+                select(func.count()).select_from(NotificationOutbox).where(NotificationOutbox.status == "pending")
+            ).scalar()
+        metrics.notification_outbox_pending.set(pending or 0)
+
+
+def summary(db: Session, dead_limit: int = 50) -> Dict[str, Any]:
+    """各状态行数 + 最近的死信 (管理接口)"""
+    counts = dict(db.query(NotificationOutbox.status, func.count()).group_by(NotificationOutbox.status).all())
+    dead: List[NotificationOutbox] = (
+        db.query(NotificationOutbox)
+        .filter(NotificationOutbox.status == "dead")
+        .order_by(NotificationOutbox.id.desc())
+        .limit(dead_limit)
+        .all()
+    )
+    return {
+        "counts": {status: counts.get(status, 0) for status in ("pending", "sent", "dead")},
+        "dead": [{
+            "id": row.id,
+            "alert_log_id": row.alert_log_id,
+            "channel": row.channel,
+            "attempts": row.attempts,
+            "last_error": row.last_error,
+            "enqueued_at": row.enqueued_at,
+        } for row in dead],
+    }
+
+
+def requeue(db: Session, outbox_id: int) -> bool:
+    """把一条死信重新放回待投递队列"""
+    updated = (
+        db.query(NotificationOutbox)
+        .filter(NotificationOutbox.id == outbox_id, NotificationOutbox.status == "dead")
+        .update({"status": "pending", "attempts": 0, "next_attempt_at": time.time(), "last_error": None},
+                synchronize_session=False)
+    )
+    if updated and _dispatcher.running:
+        _dispatcher.wake()
+    return bool(updated)
+
+
+_dispatcher = OutboxDispatcher()
+
+
+def get_dispatcher() -> OutboxDispatcher:
+    return _dispatcher
@@ -1,26 +1,127 @@
 import json
+import threading
+import time
 import requests
-from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
+from app.monitoring import metrics
+
+# 企业微信群机器人每个 Webhook 每分钟最多 20 条消息
+RATE_LIMIT_MESSAGES = 20
+RATE_LIMIT_PERIOD = 60
+# markdown 消息内容上限 4096 字节 (UTF-8)
+MARKDOWN_MAX_BYTES = 4096
+# 接口频率超限的错误码
+ERRCODE_RATE_LIMITED = 45009
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每 period 秒补满；允许短时突发，长期速率不超过配额"""
+
+    def __init__(self, capacity: int = RATE_LIMIT_MESSAGES, period: float = RATE_LIMIT_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> int:
+        with self._lock:
+            self._refill()
+            return int(self.tokens)
+
+    def acquire(self):
+        """取一个令牌，没有时等到下一个令牌生成"""
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                metrics.record_rate_limit_wait("wechat", wait)
+                time.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+
+    def drain(self):
+        """服务端已判定超限：清空令牌，后续消息改为打包发送"""
+        with self._lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
 
 class WeChatNotifier:
     def __init__(self, webhook_url: str):
         self.webhook_url = webhook_url
+        # 最近一次发送失败的原因 (outbox 记录到 last_error)
+        self.last_error: Optional[str] = None
+        self.rate_limiter = TokenBucket()
+        # 长连接复用：同一 Webhook 的消息共用 TCP/TLS 连接；失败重试由 outbox 负责
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
 
     def send_qqq_alert(self, alert: Dict) -> bool:
-        message = self._format_qqq_alert(alert)
+        message = self.format_qqq_alert(alert)
         return self._send_message(message)
 
     def send_option_alert(self, alert: Dict, position_ticker: str) -> bool:
-        message = self._format_option_alert(alert, position_ticker)
+        message = self.format_option_alert(alert, position_ticker)
         return self._send_message(message)
 
     def send_daily_report(self, report_data: Dict) -> bool:
-        message = self._format_daily_report(report_data)
+        message = self.format_daily_report(report_data)
+        return self._send_message(message)
+
+    def send_text(self, message: str) -> bool:
+        """发送已格式化的消息 (outbox 投递)"""
         return self._send_message(message)
 
-    def _format_daily_report(self, data: Dict) -> str:
+    def send_batch(self, messages: List[str]) -> List[Tuple[bool, Optional[str]]]:
+        """
+        按速率配额发送一批消息，返回每条消息的 (是否成功, 失败原因)
+
+        令牌足够时逐条发送；突发超过配额 (如趋势止损同时命中所有持仓) 时，
+        把剩余消息合并成尽量少的 markdown 消息，每条合并消息只占一个令牌。
+        """
+        results: List[Tuple[bool, Optional[str]]] = [(False, None)] * len(messages)
+        pending = list(range(len(messages)))
+        while pending:
+            self.rate_limiter.acquire()
+            if len(pending) <= self.rate_limiter.available() + 1:
+                chunk = pending[:1]
+                success = self._post({"msgtype": "text", "text": {"content": messages[chunk[0]], "mentioned_list": []}})
+            else:
+                chunk = self._pack(messages, pending)
+                content = "\n\n---\n\n".join(messages[i] for i in chunk)
+                success = self._post({"msgtype": "markdown", "markdown": {"content": content}})
+                if success:
+                    metrics.wechat_packed_messages.inc(len(chunk))
+            for i in chunk:
+                results[i] = (success, self.last_error)
+            pending = pending[len(chunk):]
+        return results
+
+    @staticmethod
+    def _pack(messages: List[str], pending: List[int]) -> List[int]:
+        """从 pending 头部取出能放进一条 markdown 消息的消息 (至少一条)"""
+        chunk = [pending[0]]
+        size = len(messages[pending[0]].encode("utf-8"))
+        separator = len("\n\n---\n\n")
+        for i in pending[1:]:
+            size += separator + len(messages[i].encode("utf-8"))
+            if size > MARKDOWN_MAX_BYTES:
+                break
+            chunk.append(i)
+        return chunk
+
+    def format_daily_report(self, data: Dict) -> str:
         date_str = data.get("date", datetime.now().strftime("%Y-%m-%d"))
         qqq_price = data.get("qqq_price", 0.0)
         sma200 = data.get("sma200", 0.0)
@@ -61,10 +162,11 @@ class WeChatNotifier:
 
 ⚠️ 止损状态：{stop_status}{stop_extra}"""
 
-    def _format_qqq_alert(self, alert: Dict) -> str:
+    def format_qqq_alert(self, alert: Dict) -> str:
         timestamp = alert.get("timestamp", datetime.now())
         time_str = timestamp.strftime("%Y-%m-%d %H:%M:%S") if isinstance(timestamp, datetime) else str(timestamp)
         current_price = alert.get("trigger_price", alert.get("current_price", 0))
+        symbol = alert.get("symbol", "QQQ")
         
         # 基础信息
         rule_name = alert.get('rule_name', '')
@@ -85,7 +187,7 @@ class WeChatNotifier:
 Delta 要求: {delta_recommend}
 策略说明: {explanation}"""
 
-        return f"""【QQQ 长期复利引擎 - 入场信号】
+        return f"""【{symbol} 长期复利引擎 - 入场信号】
 
 规则: {rule_name}
 
@@ -93,12 +195,12 @@ Delta 要求: {delta_recommend}
 
 触发条件: {trigger_condition}
 
-QQQ 当前价: ${current_price:.2f}
+{symbol} 当前价: ${current_price:.2f}
 {delta_section}
 
 时间: {time_str}"""
 
-    def _format_option_alert(self, alert: Dict, position_ticker: str) -> str:
+    def format_option_alert(self, alert: Dict, position_ticker: str) -> str:
         alert_type = alert.get("alert_type", "")
 
         if alert_type == "OPTION_MAX_HOLDING":
@@ -112,6 +214,39 @@ QQQ 当前价: ${current_price:.2f}
         else:
             return f"【期权提醒】\n\n{alert.get('message', '')}"
 
+    def format_option_digest(self, alert: Dict) -> str:
+        """同一规则命中多个持仓的汇总报警 (app.alerts.digest)"""
+        timestamp = alert.get("timestamp", datetime.now())
+        time_str = timestamp.strftime("%Y-%m-%d %H:%M:%S") if isinstance(timestamp, datetime) else str(timestamp)
+        positions = alert.get("positions", [])
+
+        # 各持仓文本不同 (按持仓计算的规则) 时顶层 message 为空，逐个持仓列出自己的消息和触发条件
+        shared = bool(alert.get('message'))
+        lines = []
+        for position in positions:
+            pnl_pct = position.get("pnl_pct") or 0.0
+            pnl_sign = "+" if pnl_pct >= 0 else ""
+            dte = f"  DTE {position['dte']}" if position.get("dte") is not None else ""
+            lines.append(f"- {position.get('position_ticker', '')}  "
+                         f"现价 ${position.get('current_price') or 0:.2f}  盈亏 {pnl_sign}{pnl_pct:.1f}%{dte}")
+            if not shared:
+                lines.append(f"  {position.get('message', '')}")
+                lines.append(f"  触发条件: {position.get('trigger_condition', '')}")
+        position_lines = "\n".join(lines)
+
+        summary = f"""
+
+{alert['message']}
+
+触发条件: {alert.get('trigger_condition', '')}""" if shared else ""
+
+        return f"""【期权提醒汇总】{alert.get('rule_name', '')}{summary}
+
+受影响持仓 ({len(positions)}):
+{position_lines}
+
+时间: {time_str}"""
+
     def _format_max_holding_alert(self, alert: Dict, position_ticker: str) -> str:
         return f"""【期权最大持仓周期提醒】
 
@@ -176,42 +311,63 @@ QQQ 当前价: ${current_price:.2f}
 触发红线风控：请立即平仓以规避期权末期加速的时间价值衰减（Theta Decay）！"""
 
     def _send_message(self, message: str) -> bool:
+        self.rate_limiter.acquire()
+        return self._post({
+            "msgtype": "text",
+            "text": {
+                "content": message,
+                "mentioned_list": []
+            }
+        })
+
+    def _post(self, payload: Dict) -> bool:
+        self.last_error = None
         if not self.webhook_url:
-            print(f"[WARN] WeChat webhook URL not configured, skipping alert: {message[:100]}")
+            content = payload.get(payload["msgtype"], {}).get("content", "")
+            print(f"[WARN] WeChat webhook URL not configured, skipping alert: {content[:100]}")
+            self.last_error = "WeChat webhook URL not configured"
             return False
 
+        start = time.perf_counter()
+        status = "error"
         try:
-            payload = {
-                "msgtype": "text",
-                "text": {
-                    "content": message,
-                    "mentioned_list": []
-                }
-            }
-            
-            response = requests.post(
-                self.webhook_url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10
-            )
-            
+            response = self.session.post(self.webhook_url, json=payload, timeout=10)
+
             if response.status_code == 200:
                 result = response.json()
                 if result.get("errcode") == 0:
                     print(f"[INFO] WeChat alert sent successfully")
+                    status = "success"
                     return True
                 else:
                     print(f"[ERROR] WeChat API error: {result}")
+                    if result.get("errcode") == ERRCODE_RATE_LIMITED:
+                        self.rate_limiter.drain()
+                    self.last_error = f"WeChat API error: {result}"
                     return False
             else:
                 print(f"[ERROR] WeChat HTTP error: {response.status_code} - {response.text}")
+                self.last_error = f"WeChat HTTP error: {response.status_code}"
                 return False
                 
         except Exception as e:
             print(f"[ERROR] Failed to send WeChat message: {e}")
+            self.last_error = f"Failed to send WeChat message: {e}"
             return False
+        finally:
+            metrics.wechat_send_duration.labels(status).observe(time.perf_counter() - start)
+
+
+# 每个 Webhook 一个长期存活的 notifier (连接池和速率配额按 Webhook 计算)
+_notifiers: Dict[str, WeChatNotifier] = {}
+_notifiers_lock = threading.Lock()
 
 
 def get_wechat_notifier(webhook_url: str) -> WeChatNotifier:
-    return WeChatNotifier(webhook_url)
\ No newline at end of file
+    notifier = _notifiers.get(webhook_url)
+    if notifier is None:
+        with _notifiers_lock:
+            notifier = _notifiers.get(webhook_url)
+            if notifier is None:
+                notifier = _notifiers[webhook_url] = WeChatNotifier(webhook_url)
+    return notifier
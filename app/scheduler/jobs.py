@@ -1,20 +1,46 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+from collections import defaultdict
+import concurrent.futures
 from datetime import datetime
-import json
+from typing import Optional, Tuple
 import logging
+import threading
 import time
 
 from .trading_hours import is_trading_time, get_current_time_et
+from . import leader
 from app.market.polygon_client import CachedPolygonClient
 from app.market.data_fetcher import DataFetcher
-from app.alerts import qqq_rules, option_rules, dedup
+from app.market.bar_store import get_bar_store
+from app.market.snapshot import get_market_snapshot
+from app.market import backfill
+from app.alerts import qqq_rules, option_rules, dedup, digest
 from app.notification.wechat import get_wechat_notifier
+from app.notification import outbox
 from app.config import get_config
+from app.database.init_db import session_scope, read_session_scope
+from app.database.write_buffer import get_write_buffer, flush_pending
+from app.database.retention import run_retention
+from app.database import price_history, queries
+from app.monitoring import metrics
+from app.monitoring.health import get_health
+from app.monitoring.profiler import profile_job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+write_buffer = get_write_buffer()
+write_buffer.add_outbox_listener(outbox.get_dispatcher().wake)
+
+# 并发检查的组合数上限 (期权报价请求在数据源客户端内统一限流)
+PORTFOLIO_WORKERS = 4
+
+CHECK_INTERVAL_MINUTES = 5
+# 任务实际开始比计划时间晚超过该秒数时，调度器状态显示为 degraded
+SCHEDULER_LAG_WARN_SECONDS = 60
+
 
 scheduler = BackgroundScheduler(
     executors={"default": ThreadPoolExecutor(max_workers=2)},
@@ -26,145 +52,389 @@ scheduler = BackgroundScheduler(
 )
 
 
-def check_qqq_and_options(data_fetcher: DataFetcher, db, config):
+@leader.leader_only
+@profile_job("check_qqq_and_options")
+def check_qqq_and_options(data_fetcher: DataFetcher, config):
     if not is_trading_time():
         logger.info("Outside trading hours, skipping checks")
         return
 
-    logger.info("Starting QQQ and options checks...")
-    notifier = get_wechat_notifier(config.get_wechat_webhook_url())
+    # 周期内的写入全部进入写缓冲，结束时 (包括异常退出) 一次事务落库
+    with metrics.job_timer("check_qqq_and_options") as timer, write_buffer.batch():
+        _run_checks(data_fetcher, config, timer)
+
 
-    # 1. 获取 QQQ 数据和指标
-    qqq_data = data_fetcher.get_qqq_data()
+def _run_checks(data_fetcher: DataFetcher, config, timer: metrics.JobTimer):
+    logger.info("Starting QQQ and options checks...")
 
-    if qqq_data.get("last_price"):
-        # 2. 检查 QQQ 入场信号
-        qqq_alerts = qqq_rules.check_all_qqq_rules(qqq_data, config)
+    # 1. 加载组合、持仓和 watchlist (只读，更新通过写缓冲批量提交)
+    from app.database.models import OptionPosition, Portfolio
+    with timer.stage("fetch"), read_session_scope() as db:
+        portfolios = db.query(Portfolio).filter(Portfolio.enabled.is_(True)).order_by(Portfolio.id).all()
+        default_id = queries.default_portfolio_id(db)
+        positions = db.query(OptionPosition).all()
+        watchlist, symbols = queries.market_symbols(db)
+
+    # 2. 一次批量请求获取全部标的的数据和指标，所有组合共用 (QQQ 始终下载，是持仓风控的默认参照)
+    with timer.stage("fetch"):
+        market_data = data_fetcher.get_market_data(symbols + ["QQQ"])
+        # 批量下载拿不到 QQQ 时走 QQQ 的多级灾备
+        qqq_data = market_data.get("QQQ") or data_fetcher.get_qqq_data()
+
+    # 3. 检查 watchlist 入场信号 (与组合无关，只计算一次)
+    entry_data = {symbol: market_data.get(symbol) for symbol in watchlist}
+    if "QQQ" in entry_data:
+        entry_data["QQQ"] = qqq_data
+    entry_data = {symbol: data for symbol, data in entry_data.items() if data and data.get("last_price")}
+
+    with timer.stage("evaluate"):
+        entry_alerts = qqq_rules.check_watchlist_rules(entry_data, config)
+
+    portfolio_configs = {portfolio.id: config.for_portfolio(queries.portfolio_settings(portfolio))
+                         for portfolio in portfolios}
+    entry_recipients = [portfolio.id for portfolio in portfolios if portfolio.entry_alerts_enabled]
+    if default_id is None:
+        # 尚未创建任何组合 (启动时会创建默认组合)：全部持仓按全局配置检查
+        portfolio_configs[None] = config
+        entry_recipients = [None]
+
+    for alert in entry_alerts:
+        # 按标的 + rule_name 每日去重 (每个标的每天最多一次买入指令)
+        if dedup.should_alert(f"{alert['symbol']}_{alert['rule_name']}"):
+            _dispatch_entry_alert(alert, entry_recipients, portfolio_configs, timer)
+
+    # 4. 各组合的持仓并发检查 (停用组合的持仓不检查)
+    books = defaultdict(list)
+    for position in positions:
+        books[position.portfolio_id or default_id].append(position)
+    books = {portfolio_id: book for portfolio_id, book in books.items() if portfolio_id in portfolio_configs}
+
+    quotes = CycleQuotes(data_fetcher)
+    if len(books) == 1:
+        # 单组合时直接在当前线程检查，省去线程池开销
+        (portfolio_id, book), = books.items()
+        _evaluate_portfolio(portfolio_id, book, portfolio_configs[portfolio_id],
+                            market_data, qqq_data, quotes, timer)
+    elif books:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(PORTFOLIO_WORKERS, len(books)),
+                                                   thread_name_prefix="portfolio") as pool:
+            futures = {
+                pool.submit(_evaluate_portfolio, portfolio_id, book, portfolio_configs[portfolio_id],
+                            market_data, qqq_data, quotes, timer): portfolio_id
+                for portfolio_id, book in books.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error evaluating portfolio {futures[future]}: {e}", exc_info=True)
+
+    # 已发送的报警必须在周期结束前落库
+    with timer.stage("persist"):
+        write_buffer.flush()
+
+    # 5. 发布共享行情快照，各 Web worker 直接读取，不再各自请求行情
+    with timer.stage("publish"):
+        _publish_snapshot(market_data, qqq_data, positions)
 
-        for alert in qqq_alerts:
-            # 使用 rule_name 进行每日去重 (每天最多一次买入指令)
-            if dedup.should_alert(alert["rule_name"]):
-                success = notifier.send_qqq_alert(alert)
-                _log_alert(db, alert, success)
+    logger.info("Checks completed")
 
-    # 3. 检查持仓期权
-    from app.database.models import OptionPosition
-    positions = db.query(OptionPosition).all()
 
+def _publish_snapshot(market_data: dict, qqq_data: dict, positions: list):
+    if not leader.is_leader():
+        return
+    quotes = {
+        position.id: {"price": position.current_price, "updated_at": position.last_price_update}
+        for position in positions
+    }
+    try:
+        version = get_market_snapshot().publish(market_data, qqq_data, quotes)
+        logger.debug(f"Published market snapshot v{version}")
+    except Exception as e:
+        logger.error(f"[ERROR] Failed to publish market snapshot: {e}")
+
+
+def _dispatch_entry_alert(alert: dict, portfolio_ids: list, portfolio_configs: dict, timer: metrics.JobTimer):
+    """入场信号投递到每个订阅组合的通知渠道；多个组合共用同一个目标 (如同一个 Webhook) 时只发一次"""
+    sent_targets = set()
+    unconfigured_logged = False
+    for portfolio_id in portfolio_ids:
+        if not leader.is_leader():
+            logger.warning(f"Scheduler lease lost, not sending {alert['rule_name']}")
+            return
+        targets = [target for target in portfolio_configs[portfolio_id].get_notification_targets()
+                   if target not in sent_targets]
+        if not targets:
+            # 目标都已由前面的组合发送过；都未配置时只记一条失败日志
+            if sent_targets or unconfigured_logged:
+                continue
+            unconfigured_logged = True
+        sent_targets.update(targets)
+        with timer.stage("notify"):
+            webhook_url = portfolio_configs[portfolio_id].get_wechat_webhook_url()
+            message = get_wechat_notifier(webhook_url).format_qqq_alert(alert)
+            _queue_alert(dict(alert, portfolio_id=portfolio_id), message, targets)
+
+
+class CycleQuotes:
+    """
+    一个检查周期内的期权报价缓存
+
+    多个组合持有同一合约时只请求一次；同一合约的并发请求在合约级锁上排队，后到的直接读缓存。
+    """
+
+    def __init__(self, data_fetcher: DataFetcher):
+        self._data_fetcher = data_fetcher
+        self._lock = threading.Lock()
+        self._locks: dict = {}
+        self._quotes: dict = {}
+
+    def get(self, position) -> Tuple[Optional[float], bool]:
+        """返回 (报价, 是否发起了网络请求)"""
+        key = option_rules.format_option_symbol(position)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self._quotes:
+                return self._quotes[key], False
+            price = self._data_fetcher.get_option_current_price(position)
+            self._quotes[key] = price
+            return price, True
+
+
+def _evaluate_portfolio(portfolio_id: int, positions: list, config, market_data: dict, qqq_data: dict,
+                        quotes: CycleQuotes, timer: metrics.JobTimer):
+    notifier = get_wechat_notifier(config.get_wechat_webhook_url())
+    # 本周期通过去重的报警先收集起来，按规则汇总后再发送
+    pending = digest.AlertDigest()
+    try:
+        _check_positions(portfolio_id, positions, config, market_data, qqq_data, quotes, pending, timer)
+    finally:
+        # 去重键已认领的报警必须发出 (包括租约中途失效的情况)，否则新 leader 也不会再发
+        for alert in pending.drain():
+            with timer.stage("notify"):
+                if alert.get("digest"):
+                    message = notifier.format_option_digest(alert)
+                else:
+                    message = notifier.format_option_alert(alert, alert["position_ticker"])
+                _queue_alert(alert, message, config.get_notification_targets())
+            affected = len(alert["position_ids"]) if alert.get("digest") else 1
+            logger.info(f"Alert queued for portfolio {portfolio_id}: {alert['rule_name']} ({affected} positions)")
+
+
+def _check_positions(portfolio_id: int, positions: list, config, market_data: dict, qqq_data: dict,
+                     quotes: CycleQuotes, pending: digest.AlertDigest, timer: metrics.JobTimer):
     for position in positions:
+        # 租约失效后剩余持仓交给新 leader，避免两边重复发送
+        if not leader.is_leader():
+            logger.warning(f"Scheduler lease lost, stopping checks for portfolio {portfolio_id}")
+            return
+
         try:
             position_ticker = option_rules.format_position_ticker(position)
-            logger.info(f"Checking position: {position_ticker} (ID: {position.id})")
+            logger.info(f"Checking position: {position_ticker} (ID: {position.id}, portfolio: {portfolio_id})")
 
             # 获取期权当前价格
-            current_price = data_fetcher.get_option_current_price(position)
+            with timer.stage("fetch"):
+                current_price, fetched = quotes.get(position)
 
             if current_price is None:
                 logger.warning(f"Failed to get price for position {position_ticker}, skipping")
                 continue
 
-            # 1. 立即更新并提交当前价格，确保数据一致性
+            # 1. 记录当前价格
             position.current_price = current_price
             position.last_price_update = get_current_time_et()
-            db.commit()
+            write_buffer.record_price(position.id, current_price, position.last_price_update)
             logger.debug(f"Updated price for {position_ticker} to ${current_price:.2f}")
-            
-            # 2. 检查出场/风控信号
-            result = option_rules.check_position_signals(position, current_price, qqq_data, config)
-            
+
+            # 2. 检查出场/风控信号 (持仓标的的指标，缺失时参照 QQQ)
+            with timer.stage("evaluate"):
+                trend_symbol = position.underlying.upper()
+                indicators = market_data.get(trend_symbol)
+                if not indicators:
+                    trend_symbol, indicators = "QQQ", qqq_data
+                result = option_rules.check_position_signals(position, current_price, indicators, config,
+                                                             trend_symbol)
+
             # 3. 更新 max_profit
             new_max_profit = result.get("new_max_profit", 0.0)
             if new_max_profit > (position.max_profit or 0.0):
                 logger.info(f"Updating max_profit for {position_ticker}: {position.max_profit} -> {new_max_profit}")
                 position.max_profit = new_max_profit
-                db.commit()
-            
-            # 4. 处理报警
+                write_buffer.record_max_profit(position.id, new_max_profit)
+
+            # 4. 处理报警 (发送到所属组合的 Webhook)
             option_alerts = result.get("alerts", [])
             if option_alerts:
                 logger.info(f"Found {len(option_alerts)} alerts for {position_ticker}")
-                
+
             for alert in option_alerts:
                 rule_name = alert["rule_name"]
 
                 # 针对每个 position 去重
                 if dedup.should_alert(rule_name, position.id):
-                    success = notifier.send_option_alert(alert, position_ticker)
                     alert["position_id"] = position.id
-                    _log_alert(db, alert, success)
-                    logger.info(f"Alert sent for {position_ticker}: {rule_name}")
+                    alert["portfolio_id"] = portfolio_id
+                    alert["position_ticker"] = position_ticker
+                    alert["option_symbol"] = option_rules.format_option_symbol(position)
+                    pending.add(alert)
+                    logger.info(f"Alert triggered for {position_ticker}: {rule_name}")
 
-            # 5. 性能优化：API 频率限制
-            time.sleep(1.0)
+            # 5. 性能优化：API 频率限制 (报价来自本周期缓存时无需等待)
+            if fetched:
+                time.sleep(1.0)
 
         except Exception as e:
             logger.error(f"Error processing position {position.id}: {str(e)}", exc_info=True)
-            db.rollback()
             continue
 
-    logger.info("Checks completed")
+
+@leader.leader_only
+def cleanup_old_data(config):
+    with metrics.job_timer("cleanup_old_data") as timer:
+        _run_cleanup(config, timer)
 
 
-def cleanup_old_data(db, config):
+def _run_cleanup(config, timer: metrics.JobTimer):
     logger.info("Starting data cleanup...")
 
     alert_log_retention = config.get_alert_log_retention_days()
     qqq_data_retention = config.get_daily_qqq_data_retention_days()
 
-    from app.database.models import AlertLog, DailyQQQData
     from datetime import timedelta
-    from pytz import timezone
 
-    et_tz = timezone("America/New_York")
-    cutoff_date = datetime.now(et_tz) - timedelta(days=alert_log_retention)
-    qqq_cutoff_date = datetime.now(et_tz) - timedelta(days=qqq_data_retention)
+    # triggered_at 由 CURRENT_TIMESTAMP 写入 (UTC)，fetched_at 为美东时间
+    now_utc = datetime.utcnow()
+    cutoffs = {
+        "alert_logs": now_utc - timedelta(days=alert_log_retention),
+        # 已投递 / 死信的通知与报警日志一起过期
+        "notification_outbox": now_utc - timedelta(days=alert_log_retention),
+        "daily_qqq_data": get_current_time_et().replace(tzinfo=None) - timedelta(days=qqq_data_retention),
+    }
 
-    deleted_alerts = db.query(AlertLog).filter(
-        AlertLog.triggered_at < cutoff_date
-    ).delete()
+    # 分批删除 + 增量 vacuum，批次之间释放写锁，不阻塞检查任务和管理后台
+    with timer.stage("persist"):
+        report = run_retention(
+            cutoffs,
+            batch_size=config.get_cleanup_batch_size(),
+            time_budget_seconds=config.get_cleanup_time_budget_seconds()
+        )
 
-    deleted_qqq_data = db.query(DailyQQQData).filter(
-        DailyQQQData.fetched_at < qqq_cutoff_date
-    ).delete()
+    with timer.stage("persist"):
+        dedup_purged = dedup.reset_daily_dedup()
 
-    db.commit()
+    logger.info(f"Cleanup finished: {report.summary()}, {dedup_purged} expired dedup keys purged")
 
-    dedup.reset_daily_dedup()
 
-    logger.info(f"Deleted {deleted_alerts} old alert logs")
-    logger.info(f"Deleted {deleted_qqq_data} old QQQ data records")
+@leader.leader_only
+def compact_price_history(config):
+    with metrics.job_timer("compact_price_history") as timer:
+        _run_compaction(config, timer)
 
 
-def _log_alert(db, alert: dict, success: bool):
-    from app.database.models import AlertLog
+def _run_compaction(config, timer: metrics.JobTimer):
+    from app.database.models import OptionPosition
+
+    with timer.stage("persist"), session_scope() as db:
+        result = price_history.compact(db, config.get_price_history_raw_days())
+
+    # 用完整报价历史校正 max_profit：周期间的高点以及漏记的峰值都会被补上
+    # (只上调不下调，功能上线前的峰值不在历史里)
+    corrected = 0
+    with timer.stage("evaluate"), session_scope() as db:
+        for position in db.query(OptionPosition).all():
+            history_max = price_history.max_profit_from_history(db, position)
+            if history_max is not None and history_max > (position.max_profit or 0.0) + 1e-9:
+                position.max_profit = history_max
+                corrected += 1
+
+    logger.info(f"Price history compacted: {result['rolled_up']} daily rows, "
+                f"{result['purged']} raw chunks purged, {corrected} max_profit corrected")
 
-    alert_log = AlertLog(
-        alert_type=alert.get("alert_type", "QQQ_DROP"),
-        rule_name=alert.get("rule_name", ""),
-        message=json.dumps(alert, default=str),
-        sent_successfully=success,
-        position_id=alert.get("position_id")
-    )
 
-    if not success:
-        alert_log.error_message = "Failed to send WeChat notification"
+@leader.leader_only
+def backfill_bar_history(data_fetcher: DataFetcher, config):
+    with metrics.job_timer("backfill_bar_history") as timer:
+        _run_backfill(data_fetcher, config, timer)
 
-    db.add(alert_log)
-    db.commit()
 
+def _run_backfill(data_fetcher: DataFetcher, config, timer: metrics.JobTimer):
+    from datetime import timedelta
+
+    # 今天的日线由检查周期写入，补缺只覆盖到昨天
+    today = get_current_time_et().date()
+    start = today - timedelta(days=config.get_bar_backfill_days())
+    end = today - timedelta(days=1)
+
+    with read_session_scope() as db:
+        _, symbols = queries.market_symbols(db)
+
+    incomplete = []
+    for symbol in sorted(set(symbols) | {"QQQ"}):
+        with timer.stage("fetch"):
+            report = backfill.backfill(
+                get_bar_store(), symbol, start, end,
+                yfinance_client=data_fetcher.yfinance,
+                polygon_client=data_fetcher.polygon
+            )
+
+        metrics.bar_missing_sessions.labels(symbol).set(report.missing_after)
+        if report.missing_after:
+            incomplete.append(symbol)
+            logger.warning(f"Bar backfill incomplete: {report.summary()}")
+        else:
+            logger.info(f"Bar backfill finished: {report.summary()}")
+
+    if incomplete:
+        timer.status = "error"
+
+
+def _queue_alert(alert: dict, message: str, targets: list):
+    """
+    报警日志和各渠道待投递的通知一起写入 (同一事务)，由 outbox dispatcher 并发投递
+
+    targets 为 [(渠道, 目标)] (Config.get_notification_targets)。
+    周期内的写缓冲延迟到周期结束才落库，这里立即 flush，通知不必等整个周期跑完。
+    """
+    if not targets:
+        write_buffer.add_alert_log(alert, False, error_message="No notification channel configured")
+        return
+
+    day = get_current_time_et().date().isoformat()
+    notifications = [outbox.build_notification(alert, message, destination, day, channel)
+                     for channel, destination in targets]
+    write_buffer.add_alert_log(alert, None, notifications=notifications)
+    try:
+        write_buffer.flush()
+    except Exception:
+        # 写缓冲已记录错误：暂时性错误的数据已放回缓冲，由周期结束时的 flush 重试；
+        # 数据错误时只丢弃出错的那一类 (报警日志单独重写，仍失败时逐条记录被丢弃的报警)
+        pass
+
+
+@leader.leader_only
+@profile_job("send_daily_report")
+def send_daily_report_job(data_fetcher: DataFetcher, config):
+    with metrics.job_timer("send_daily_report") as timer:
+        _run_daily_report(data_fetcher, config, timer)
 
-def send_daily_report_job(data_fetcher: DataFetcher, db, config):
+
+def _run_daily_report(data_fetcher: DataFetcher, config, timer: metrics.JobTimer):
     logger.info("Generating daily report...")
     if not is_trading_time():
         # Optional: could check if market was open today, but this runs at 16:15 so it's fine.
         pass
 
-    qqq_data = data_fetcher.get_qqq_data()
+    with timer.stage("fetch"):
+        qqq_data = data_fetcher.get_qqq_data()
     if not qqq_data.get("last_price"):
+        timer.status = "skipped"
         return
 
     from app.database.models import OptionPosition
-    positions_count = db.query(OptionPosition).count()
+    with timer.stage("fetch"), read_session_scope() as db:
+        positions_count = db.query(OptionPosition).count()
 
     # Determine unmet conditions
     unmet = []
@@ -194,23 +464,71 @@ def send_daily_report_job(data_fetcher: DataFetcher, db, config):
     notifier = get_wechat_notifier(config.get_wechat_webhook_url())
     # bypass dedup or use a special dedup key
     if dedup.should_alert("DAILY_REPORT"):
-        success = notifier.send_daily_report(report_data)
+        with timer.stage("notify"):
+            message = notifier.format_daily_report(report_data)
         
-        # 记录到数据库
+        # 记录到数据库并进入 outbox
         alert_dict = {
             "alert_type": "DAILY_REPORT",
             "rule_name": "盘后交易日报",
             "message": f"QQQ收盘价: ${report_data['qqq_price']:.2f} | RSI: {report_data['rsi']:.1f} | 均线距离连续: {report_data['consecutive_days']}天"
         }
-        _log_alert(db, alert_dict, success)
+        with timer.stage("persist"):
+            _queue_alert(alert_dict, message, config.get_notification_targets())
+
+
+# job_id -> 最近一次运行 {"last_run_at", "lag_seconds", "outcome", "missed"}
+_job_runs: dict = {}
+_job_runs_lock = threading.Lock()
+
+
+def _on_job_event(event):
+    """APScheduler 事件上报到健康状态：各任务最近一次运行时间、调度延迟和结果"""
+    with _job_runs_lock:
+        run = _job_runs.setdefault(event.job_id, {})
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = get_current_time_et()
+            run["last_run_at"] = now.isoformat(timespec="seconds")
+            run["lag_seconds"] = round(max(0.0, max(
+                (now - scheduled).total_seconds() for scheduled in event.scheduled_run_times)), 1)
+        elif event.code == EVENT_JOB_EXECUTED:
+            run["outcome"] = "success"
+        elif event.code == EVENT_JOB_ERROR:
+            run["outcome"] = "error"
+        elif event.code == EVENT_JOB_MISSED:
+            run["outcome"] = "missed"
+            run["missed"] = run.get("missed", 0) + 1
+    _report_scheduler()
+
+
+def _report_scheduler():
+    with _job_runs_lock:
+        jobs = {job_id: dict(run) for job_id, run in _job_runs.items()}
+    healthy = all(run.get("outcome") not in ("error", "missed")
+                  and run.get("lag_seconds", 0) <= SCHEDULER_LAG_WARN_SECONDS for run in jobs.values())
+    # 检查任务每个间隔都会触发 (休市时直接返回)，两个间隔没有任何事件说明调度线程卡住
+    get_health().report("scheduler", "ok" if healthy else "degraded",
+                        stale_after=CHECK_INTERVAL_MINUTES * 60 * 2 + 60, jobs=jobs)
+
+
+def start_scheduler(data_fetcher: DataFetcher, config):
+    # 通知由 leader 投递
+    outbox.get_dispatcher().start()
+
+    # 重新当选时恢复已暂停的调度器
+    if scheduler.running:
+        scheduler.resume()
+        _report_scheduler()
+        logger.info("Scheduler resumed")
+        return
 
+    scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
 
-def start_scheduler(data_fetcher: DataFetcher, db, config):
     scheduler.add_job(
         check_qqq_and_options,
         "interval",
-        minutes=5,
-        args=[data_fetcher, db, config],
+        minutes=CHECK_INTERVAL_MINUTES,
+        args=[data_fetcher, config],
         id="check_qqq_and_options",
         name="Check QQQ and Options",
         replace_existing=True
@@ -223,7 +541,7 @@ def start_scheduler(data_fetcher: DataFetcher, db, config):
         minute=30,
         day_of_week='mon-fri',
         timezone="America/New_York",
-        args=[data_fetcher, db, config],
+        args=[data_fetcher, config],
         id="send_daily_report",
         name="Send Daily Report",
         replace_existing=True
@@ -234,17 +552,57 @@ def start_scheduler(data_fetcher: DataFetcher, db, config):
         "cron",
         hour=2,
         minute=0,
-        args=[db, config],
+        args=[config],
         id="cleanup_old_data",
         name="Cleanup Old Data",
         replace_existing=True
     )
 
+    # 收盘后补齐日线缺口；启动时先跑一次，冷启动时一次性拉齐指标窗口
+    scheduler.add_job(
+        backfill_bar_history,
+        "cron",
+        hour=17,
+        minute=15,
+        day_of_week='mon-fri',
+        timezone="America/New_York",
+        args=[data_fetcher, config],
+        id="backfill_bar_history",
+        name="Backfill Bar History",
+        next_run_time=datetime.now(),
+        replace_existing=True
+    )
+
+    scheduler.add_job(
+        compact_price_history,
+        "cron",
+        hour=2,
+        minute=30,
+        args=[config],
+        id="compact_price_history",
+        name="Compact Price History",
+        replace_existing=True
+    )
+
     scheduler.start()
+    _report_scheduler()
     logger.info("Scheduler started")
 
 
+def pause_scheduler():
+    """失去 leader 租约：暂停调度 (正在运行的任务在下一次 leader 检查时退出)"""
+    if scheduler.running:
+        scheduler.pause()
+        logger.info("Scheduler paused")
+    get_health().report("scheduler", "standby")
+    outbox.get_dispatcher().stop()
+
+
 def stop_scheduler():
     if scheduler.running:
         scheduler.shutdown()
         logger.info("Scheduler stopped")
+    # 任务线程已全部退出，写出缓冲中剩余的数据
+    flush_pending()
+    # 未投递的通知留在 outbox 中，由下一个 leader 继续投递
+    outbox.get_dispatcher().stop()
@@ -0,0 +1,211 @@
+"""
+调度任务 leader 选举 (SQLite 租约)
+
+uvicorn 多 worker 部署时每个进程都会执行 startup，但调度任务只能由一个进程运行，
+否则同一条提醒会被每个 worker 各发一次。各进程竞争 scheduler_leases 表中的同一行租约：
+
+- 心跳线程每 lease/3 秒续约；持有者崩溃或卡死导致租约过期后，其他进程接管并递增 fencing_token
+- 续约和接管都是一条带条件的 UPDATE，由 SQLite 的写锁保证同一时刻只有一个进程成功
+- 本地按单调时钟记录租约截止时间 (留出安全余量)：数据库暂时不可写时到期前仍是 leader，
+  到期后立即降级，不会与接管者同时运行任务
+- 所有 worker 照常提供 HTTP 服务，只有 leader 的调度器在运行
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from functools import wraps
+from typing import Callable, Optional
+
+from sqlalchemy import case, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.init_db import engine
+from app.database.models import SchedulerLease
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+# 本地截止时间比数据库中的 expires_at 提前的比例 (吸收续约耗时和进程间时钟误差)
+SAFETY_MARGIN_RATIO = 0.1
+
+
+class LeaderElector:
+    def __init__(self, lease_seconds: float = 30.0, on_elected: Optional[Callable[[], None]] = None,
+                 on_demoted: Optional[Callable[[], None]] = None, name: str = LEASE_NAME,
+                 holder: Optional[str] = None):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+
+        self._lock = threading.Lock()
+        self._token: Optional[int] = None
+        self._deadline = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def heartbeat_interval(self) -> float:
+        return self.lease_seconds / 3
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        return self._token if self.is_leader() else None
+
+    def is_leader(self) -> bool:
+        with self._lock:
+            return self._token is not None and time.monotonic() < self._deadline
+
+    def status(self) -> dict:
+        return {
+            "holder": self.holder,
+            "is_leader": self.is_leader(),
+            "fencing_token": self.fencing_token,
+            "lease_seconds": self.lease_seconds,
+        }
+
+    def start(self):
+        # 启动时先竞争一次，leader 不必等到第一次心跳才开始调度
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name="leader-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info(f"[INFO] Leader election started as {self.holder} (lease {self.lease_seconds:.0f}s)")
+
+    def stop(self):
+        """停止心跳；是 leader 时先降级再释放租约，其他 worker 在下一次心跳时立即接管"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat_interval + 5)
+        if self._token is None:
+            return
+        self._demote("released")
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(SchedulerLease)
+                    .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+                    .values(expires_at=0.0)
+                )
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to release scheduler lease, it will expire on its own: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            self._tick()
+
+    def _tick(self):
+        started = time.monotonic()
+        try:
+            token = self._try_acquire()
+        except Exception as e:
+            logger.warning(f"[WARN] Scheduler lease heartbeat failed: {e}")
+            # 续约失败时保持现状直到本地截止时间
+            if self._token is not None and not self.is_leader():
+                self._demote("expired")
+            return
+
+        if token is None:
+            if self._token is not None:
+                self._demote("lost")
+            return
+
+        with self._lock:
+            previous = self._token
+            self._token = token
+            self._deadline = started + self.lease_seconds * (1 - SAFETY_MARGIN_RATIO)
+
+        if previous != token:
+            metrics.scheduler_leader.set(1)
+            metrics.leader_transitions.labels("elected").inc()
+            logger.info(f"[INFO] Acquired scheduler lease (fencing token {token}), starting jobs")
+            self._callback(self._on_elected)
+
+    def _try_acquire(self) -> Optional[int]:
+        """续约或接管过期租约，成功时返回 fencing_token，租约被其他进程持有时返回 None"""
+        now = time.time()
+        with engine.begin() as conn:
+            conn.execute(
+                sqlite_insert(SchedulerLease)
+                .values(name=self.name, holder="", fencing_token=0, expires_at=0.0, renewed_at=0.0)
+                .on_conflict_do_nothing(index_elements=[SchedulerLease.name])
+            )
+            # SET 中的表达式取更新前的值：换主时 token 递增，续约时不变
+            result = conn.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name)
+                .where((SchedulerLease.holder == self.holder) | (SchedulerLease.expires_at < now))
+                .values(
+                    fencing_token=case(
+                        (SchedulerLease.holder == self.holder, SchedulerLease.fencing_token),
+                        else_=SchedulerLease.fencing_token + 1
+                    ),
+                    holder=self.holder,
+                    expires_at=now + self.lease_seconds,
+                    renewed_at=now,
+                )
+            )
+            if result.rowcount == 0:
+                return None
+            return conn.execute(
+                select(SchedulerLease.fencing_token).where(SchedulerLease.name == self.name)
+            ).scalar()
+
+    def _demote(self, reason: str):
+        with self._lock:
+            if self._token is None:
+                return
+            self._token = None
+            self._deadline = 0.0
+        metrics.scheduler_leader.set(0)
+        metrics.leader_transitions.labels(reason).inc()
+        logger.warning(f"[WARN] Scheduler lease {reason}, pausing jobs")
+        self._callback(self._on_demoted)
+
+    def _callback(self, callback: Optional[Callable[[], None]]):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"[ERROR] Leader election callback failed: {e}", exc_info=True)
+
+
+_elector: Optional[LeaderElector] = None
+
+
+def start_election(lease_seconds: float, on_elected: Callable[[], None],
+                   on_demoted: Callable[[], None]) -> LeaderElector:
+    global _elector
+    _elector = LeaderElector(lease_seconds, on_elected=on_elected, on_demoted=on_demoted)
+    _elector.start()
+    return _elector
+
+
+def stop_election():
+    if _elector:
+        _elector.stop()
+
+
+def get_elector() -> Optional[LeaderElector]:
+    return _elector
+
+
+def is_leader() -> bool:
+    """未启用选举 (单进程 / 脚本直接调用任务) 时视为 leader"""
+    return _elector is None or _elector.is_leader()
+
+
+def leader_only(func):
+    """调度任务入口：租约已失效但调度器尚未暂停时跳过本次运行"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_leader():
+            logger.warning(f"[WARN] Not the scheduler leader, skipping {func.__name__}")
+            return None
+        return func(*args, **kwargs)
+    return wrapper
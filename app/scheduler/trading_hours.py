@@ -1,5 +1,7 @@
 from datetime import datetime, date
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
+import numpy as np
 from pytz import timezone
 from pandas_market_calendars import get_calendar
 
@@ -7,20 +9,27 @@ et_tz = timezone("America/New_York")
 nyse_calendar = get_calendar("XNYS")
 
 
-def is_trading_day(dt: Optional[datetime] = None) -> bool:
-    if dt is None:
-        dt = datetime.now(et_tz)
-
-    date_to_check = dt.date()
-    schedule = nyse_calendar.schedule(start_date=date_to_check, end_date=date_to_check)
+@lru_cache(maxsize=32)
+def market_session(day: date) -> Optional[Tuple[datetime, datetime]]:
+    """day 的 NYSE 开盘 / 收盘时间 (美东)，休市日返回 None；日历计算较慢，按天缓存"""
+    schedule = nyse_calendar.schedule(start_date=day, end_date=day)
 
     if schedule.empty:
-        return False
+        return None
 
     market_open = schedule.iloc[0]["market_open"]
     market_close = schedule.iloc[0]["market_close"]
 
-    return market_open is not None and market_close is not None
+    if market_open is None or market_close is None:
+        return None
+    return market_open.astimezone(et_tz), market_close.astimezone(et_tz)
+
+
+def is_trading_day(dt: Optional[datetime] = None) -> bool:
+    if dt is None:
+        dt = datetime.now(et_tz)
+
+    return market_session(dt.date()) is not None
 
 
 def is_trading_time(dt: Optional[datetime] = None) -> bool:
@@ -32,14 +41,12 @@ def is_trading_time(dt: Optional[datetime] = None) -> bool:
 
     dt_et = dt.astimezone(et_tz)
 
-    schedule = nyse_calendar.schedule(start_date=dt_et.date(), end_date=dt_et.date())
+    session = market_session(dt_et.date())
 
-    if schedule.empty:
+    if session is None:
         return False
 
-    market_open = schedule.iloc[0]["market_open"].astimezone(et_tz)
-    market_close = schedule.iloc[0]["market_close"].astimezone(et_tz)
-
+    market_open, market_close = session
     return market_open <= dt_et <= market_close
 
 
@@ -47,11 +54,10 @@ def get_market_open_time(dt: Optional[datetime] = None) -> datetime:
     if dt is None:
         dt = datetime.now(et_tz)
 
-    schedule = nyse_calendar.schedule(start_date=dt.date(), end_date=dt.date())
+    session = market_session(dt.date())
 
-    if not schedule.empty:
-        market_open = schedule.iloc[0]["market_open"].astimezone(et_tz)
-        return market_open
+    if session is not None:
+        return session[0]
 
     return dt.replace(hour=9, minute=30, second=0, microsecond=0)
 
@@ -60,11 +66,10 @@ def get_market_close_time(dt: Optional[datetime] = None) -> datetime:
     if dt is None:
         dt = datetime.now(et_tz)
 
-    schedule = nyse_calendar.schedule(start_date=dt.date(), end_date=dt.date())
+    session = market_session(dt.date())
 
-    if not schedule.empty:
-        market_close = schedule.iloc[0]["market_close"].astimezone(et_tz)
-        return market_close
+    if session is not None:
+        return session[1]
 
     return dt.replace(hour=16, minute=0, second=0, microsecond=0)
 
@@ -75,3 +80,12 @@ def is_market_open_now() -> bool:
 
 def get_current_time_et() -> datetime:
     return datetime.now(et_tz)
+
+
+@lru_cache(maxsize=32)
+def trading_sessions(start: date, end: date) -> np.ndarray:
+    """[start, end] 闭区间内的 NYSE 交易日 (datetime64[D]，升序)；日历计算较慢，按区间缓存"""
+    days = nyse_calendar.valid_days(start_date=start, end_date=end)
+    sessions = days.tz_localize(None).values.astype("datetime64[D]")
+    sessions.setflags(write=False)
+    return sessions
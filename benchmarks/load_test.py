@@ -0,0 +1,163 @@
+"""
+Web 层并发负载测试
+
+用法:
+    python -m benchmarks.load_test                        # 默认: 2 个慢刷新 + 200 个并发 Dashboard / health 请求
+    python -m benchmarks.load_test --refresh-seconds 5 --requests 500 --concurrency 50
+
+在本进程内用 uvicorn 启动应用 (不执行 startup，不启动调度器)，行情数据源替换为固定延迟的离线实现:
+先测一轮没有刷新时的 Dashboard / health 延迟作为基准，再在若干个手动刷新 (每个阻塞 --refresh-seconds)
+进行期间重复同样的请求。刷新期间的 p95 延迟比基准多出 --refresh-seconds 的一半以上时，
+说明请求被慢刷新串行化，以退出码 1 结束。
+
+数据库为临时目录下的 SQLite 文件，行情快照由测试预先发布 (与 leader 正常运行时一致)。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+# 必须在导入 app 之前指定，避免写入真实数据库 / 日线存储
+_LOAD_TMP = tempfile.mkdtemp(prefix="leaps-load-")
+os.environ["DATABASE_PATH"] = os.path.join(_LOAD_TMP, "load.db")
+os.environ["BAR_STORE_PATH"] = os.path.join(_LOAD_TMP, "bars")
+os.environ["MARKET_SNAPSHOT_PATH"] = os.path.join(_LOAD_TMP, "market_snapshot.bin")
+
+import httpx
+import uvicorn
+
+from app import main as web
+from app.database.init_db import init_db, session_scope
+from app.database.models import Configuration, OptionPosition, Portfolio
+from app.market.snapshot import get_market_snapshot
+
+COOKIES = {"admin_logged_in": "true"}
+
+
+class SlowDataFetcher:
+    """离线数据源: 期权报价固定阻塞 delay 秒 (模拟 yfinance 超时重试 / Polygon 限流 sleep)"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get_qqq_data(self) -> Dict[str, Any]:
+        time.sleep(self.delay)
+        return {"last_price": 500.0, "rsi": 50.0, "is_above_sma200_3d": True}
+
+    def get_option_current_price(self, position) -> Optional[float]:
+        time.sleep(self.delay)
+        return position.entry_price * 1.1
+
+
+def _seed(positions: int):
+    init_db()
+    with session_scope() as db:
+        db.add(Configuration(admin_password_hash="x", polygon_api_key="", wechat_webhook_url=""))
+        db.add(Portfolio(id=1, name="load"))
+        db.bulk_save_objects([
+            OptionPosition(
+                underlying="QQQ", option_type="CALL", strike_price=400 + i,
+                expiration_date=date.today() + timedelta(days=400), entry_price=50.0, quantity=1,
+                entry_date=date.today() - timedelta(days=30), portfolio_id=1,
+            )
+            for i in range(positions)
+        ])
+    get_market_snapshot().publish({"QQQ": {"last_price": 500.0, "rsi": 50.0, "is_above_sma200_3d": True}})
+
+
+def _serve(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(web.app, host="127.0.0.1", port=port, lifespan="off",
+                                           log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _timed(client: httpx.AsyncClient, method: str, path: str, semaphore: asyncio.Semaphore) -> float:
+    async with semaphore:
+        start = time.perf_counter()
+        response = await client.request(method, path)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+
+async def _burst(base_url: str, requests: int, concurrency: int, refreshes: int) -> Dict[str, List[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    refresh_semaphore = asyncio.Semaphore(max(refreshes, 1))
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, cookies=COOKIES) as client:
+        refresh_tasks = [asyncio.create_task(_timed(client, "POST", f"/admin/positions/{i + 1}/refresh",
+                                                    refresh_semaphore))
+                         for i in range(refreshes)]
+        # 让刷新先进入数据源调用
+        await asyncio.sleep(0.2 if refreshes else 0)
+        paths = ["/admin", "/health"]
+        latencies = await asyncio.gather(*[
+            _timed(client, "GET", paths[i % len(paths)], semaphore) for i in range(requests)
+        ])
+        refresh_latencies = await asyncio.gather(*refresh_tasks)
+    return {
+        "dashboard": [latency for i, latency in enumerate(latencies) if i % len(paths) == 0],
+        "health": [latency for i, latency in enumerate(latencies) if i % len(paths) == 1],
+        "refresh": list(refresh_latencies),
+    }
+
+
+def _p95(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def _summary(latencies: List[float]) -> str:
+    if not latencies:
+        return "-"
+    return (f"n={len(latencies):<4} p50={statistics.median(latencies) * 1000:8.1f}ms "
+            f"p95={_p95(latencies) * 1000:8.1f}ms max={max(latencies) * 1000:8.1f}ms")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="QQQ Option Alert Web 层并发负载测试")
+    parser.add_argument("--refresh-seconds", type=float, default=2.0, help="每次期权报价请求阻塞的秒数")
+    parser.add_argument("--refreshes", type=int, default=2, help="同时进行的手动刷新数")
+    parser.add_argument("--requests", type=int, default=200, help="Dashboard + health 请求总数")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    _seed(max(args.refreshes, 1))
+    web.data_fetcher = SlowDataFetcher(args.refresh_seconds)
+    server = _serve(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        asyncio.run(_burst(base_url, 20, args.concurrency, 0))  # 预热 (模板编译、连接池)
+        idle = asyncio.run(_burst(base_url, args.requests, args.concurrency, 0))
+        busy = asyncio.run(_burst(base_url, args.requests, args.concurrency, args.refreshes))
+    finally:
+        server.should_exit = True
+
+    print(f"{'idle    dashboard':<22} {_summary(idle['dashboard'])}")
+    print(f"{'idle    health':<22} {_summary(idle['health'])}")
+    print(f"{'refresh dashboard':<22} {_summary(busy['dashboard'])}")
+    print(f"{'refresh health':<22} {_summary(busy['health'])}")
+    print(f"{'refresh (slow)':<22} {_summary(busy['refresh'])}")
+
+    # 与无刷新时相比，p95 多出的延迟超过刷新耗时的一半即视为被串行化
+    extra = _p95(busy["dashboard"] + busy["health"]) - _p95(idle["dashboard"] + idle["health"])
+    if extra > args.refresh_seconds / 2:
+        print(f"[SERIALIZED] p95 latency grew by {extra:.2f}s behind {args.refreshes} slow refresh(es)")
+        return 1
+    print("Dashboard / health requests did not wait for slow refreshes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,509 @@
+"""
+热路径离线基准测试
+
+用法:
+    python -m benchmarks.run                      # quick 规模，对比 benchmarks/baseline.json
+    python -m benchmarks.run --profile full       # 包含 100k 持仓的完整检查周期
+    python -m benchmarks.run --recorded qqq.csv   # 额外跑一遍录制的真实日线
+    python -m benchmarks.run --update-baseline    # 用本次结果覆盖基线
+
+结果写入 benchmarks/results/latest.json；任何用例的中位数耗时比基线慢
+超过 --threshold (默认 25%) 时以退出码 1 结束。
+
+基线记录的是相对耗时：每次运行先跑一个固定的校准用例 (纯 Python + NumPy 计算)，
+各用例的耗时除以同一进程内的校准耗时后再与基线比较，换一台机器 / CI runner 时整体快慢相互抵消。
+基线中没有校准耗时 (旧格式) 时退回按绝对耗时比较，此时应先在本机 --update-baseline 重新生成。
+
+完全离线: 行情由合成/录制数据提供，数据库为临时目录下的 SQLite 文件
+(与生产相同的 WAL / pragma 配置)，企业微信 Webhook 留空 (发送直接返回 False)，
+周期内的限流 sleep 被跳过。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+
+# 必须在导入 app 之前指定，避免写入真实数据库 / 日线存储
+_BENCH_TMP = tempfile.mkdtemp(prefix="leaps-bench-")
+os.environ["DATABASE_PATH"] = os.path.join(_BENCH_TMP, "bench.db")
+os.environ["BAR_STORE_PATH"] = os.path.join(_BENCH_TMP, "bars")
+os.environ["MARKET_SNAPSHOT_PATH"] = os.path.join(_BENCH_TMP, "market_snapshot.bin")
+
+import numpy as np
+from sqlalchemy import func
+
+from app.database.init_db import init_db, session_scope
+from app.database.models import AlertDedupKey, OptionPosition, Portfolio
+from app.market.data_fetcher import DataFetcher
+from app.market.bar_store import BarStore
+from app.market.indicators import compute_indicators
+from app.market.snapshot import MarketSnapshot
+from app.alerts import option_rules, dedup
+from app.alerts.dedup import AlertDeduplicator
+from app.scheduler import jobs
+from app.scheduler.trading_hours import is_trading_time, et_tz
+from app.config import get_config
+
+from benchmarks.synthetic import (
+    BAR_SIZES, POSITION_SIZES, make_price_history, load_recorded_history,
+    make_positions, make_option_price,
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results", "latest.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# 小于该绝对差值的变化视为噪声，不判定为回归
+NOISE_FLOOR_SECONDS = 0.0005
+
+CALIBRATION_CASE = "calibration"
+
+# 多标的指标计算的 watchlist 规模
+WATCHLIST_SIZES = [1, 5, 20]
+
+# 多组合检查周期的组合数
+PORTFOLIO_SIZES = [4, 16]
+
+# 各 profile 下完整检查周期跑的持仓规模
+CYCLE_SIZES = {
+    "quick": ["10", "1k"],
+    "full": ["10", "1k", "100k"],
+}
+
+
+class BenchCase:
+    def __init__(self, name: str, fn: Callable[[Any], Any], setup: Optional[Callable[[], Any]] = None,
+                 params: Optional[Dict[str, Any]] = None, min_rounds: int = 5, max_rounds: int = 50,
+                 min_time: float = 0.5):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.params = params or {}
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.min_time = min_time
+
+    def run(self) -> Dict[str, Any]:
+        timings: List[float] = []
+        total = 0.0
+        while len(timings) < self.max_rounds and (len(timings) < self.min_rounds or total < self.min_time):
+            arg = self.setup() if self.setup else None
+            start = time.perf_counter()
+            self.fn(arg)
+            elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+            total += elapsed
+
+        return {
+            "params": self.params,
+            "rounds": len(timings),
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "max_s": max(timings),
+            "mean_s": statistics.fmean(timings),
+        }
+
+
+def _load_positions(count: int, portfolios: int = 1):
+    """把持仓表重置为 count 个合成持仓，轮流分配到 portfolios 个组合 (已是该规模时跳过)"""
+    with session_scope() as db:
+        if (db.query(OptionPosition).count() == count
+                and db.query(func.count(func.distinct(OptionPosition.portfolio_id))).scalar() == portfolios):
+            return
+        db.query(OptionPosition).delete()
+        db.query(Portfolio).delete()
+        db.bulk_save_objects([Portfolio(id=i + 1, name=f"bench-{i + 1}") for i in range(portfolios)])
+        db.bulk_save_objects([
+            OptionPosition(
+                underlying=p.underlying, option_type=p.option_type, strike_price=p.strike_price,
+                expiration_date=p.expiration_date, entry_price=p.entry_price, quantity=p.quantity,
+                entry_date=p.entry_date, max_profit=p.max_profit, portfolio_id=i % portfolios + 1,
+            )
+            for i, p in enumerate(make_positions(count))
+        ])
+
+
+class OfflineDataFetcher:
+    """替代 DataFetcher 的网络部分: 固定的 QQQ 指标 + 确定性的期权报价"""
+
+    def __init__(self, qqq_data: Dict[str, Any]):
+        self.qqq_data = qqq_data
+
+    def get_qqq_data(self) -> Dict[str, Any]:
+        return dict(self.qqq_data)
+
+    def get_market_data(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {symbol: dict(self.qqq_data, symbol=symbol) for symbol in symbols}
+
+    def get_option_current_price(self, position) -> Optional[float]:
+        return make_option_price(position)
+
+
+@contextlib.contextmanager
+def _offline_cycle():
+    """强制处于交易时段、跳过周期内的 API 限流 sleep、屏蔽发送失败的打印"""
+    fake_time = mock.Mock(wraps=time)
+    fake_time.sleep = lambda seconds: None
+    with mock.patch.object(jobs, "is_trading_time", lambda dt=None: True), \
+            mock.patch.object(jobs, "time", fake_time), \
+            contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _history_cases(label: str, frames: Dict[str, Any]) -> List[BenchCase]:
+    cases = []
+    fetcher = DataFetcher(None)
+    for size, df in frames.items():
+        cases.append(BenchCase(
+            f"process_qqq_df[{label},bars={size}]",
+            fn=fetcher._process_qqq_df,
+            setup=df.copy,
+            params={"source": label, "bars": len(df)},
+        ))
+    return cases
+
+
+def _bar_store_cases(frames: Dict[str, Any]) -> List[BenchCase]:
+    cases = []
+    store = BarStore(os.environ["BAR_STORE_PATH"])
+    for size, df in frames.items():
+        ticker = f"BENCH{size.upper()}"
+        store.write(ticker, df)
+        # 读取全部历史并转成指标计算用的 DataFrame
+        cases.append(BenchCase(
+            f"bar_store_load[bars={size}]",
+            fn=lambda _, ticker=ticker: store.read(ticker).to_frame(),
+            params={"bars": len(df)},
+        ))
+    return cases
+
+
+def _indicator_cases() -> List[BenchCase]:
+    cases = []
+    for count in WATCHLIST_SIZES:
+        frames = {f"SYM{i}": make_price_history(BAR_SIZES["1y"], seed=i) for i in range(count)}
+        # 全部标的一次向量化计算；与 process_qqq_df[bars=1y] 对比即单个标的的边际成本
+        cases.append(BenchCase(
+            f"compute_indicators[symbols={count}]",
+            fn=lambda _, frames=frames: compute_indicators(frames),
+            params={"symbols": count, "bars": BAR_SIZES["1y"]},
+        ))
+    return cases
+
+
+def _position_cases(qqq_data: Dict[str, Any]) -> List[BenchCase]:
+    cases = []
+    for size, count in POSITION_SIZES.items():
+        positions = make_positions(count)
+        prices = [make_option_price(p) for p in positions]
+
+        def run_signals(_, positions=positions, prices=prices):
+            for position, price in zip(positions, prices):
+                option_rules.check_position_signals(position, price, qqq_data)
+
+        cases.append(BenchCase(
+            f"check_position_signals[positions={size}]",
+            fn=run_signals,
+            params={"positions": count},
+            min_rounds=3 if count >= 100_000 else 5,
+        ))
+    return cases
+
+
+def _dedup_cases() -> List[BenchCase]:
+    cases = []
+    for size, count in POSITION_SIZES.items():
+        def run_dedup(deduplicator, count=count):
+            for position_id in range(count):
+                deduplicator.should_alert("Tiered Take Profit", position_id)
+            # 第二轮全部命中去重
+            for position_id in range(count):
+                deduplicator.should_alert("Tiered Take Profit", position_id)
+
+        cases.append(BenchCase(
+            f"dedup_should_alert[positions={size}]",
+            fn=run_dedup,
+            setup=_fresh_deduplicator,
+            params={"positions": count, "calls": count * 2},
+            min_rounds=3 if count >= 100_000 else 5,
+        ))
+
+        # 重启后：本周期的键全部已持久化，首次调用一次查询载入，之后全部命中前置缓存
+        def run_warm(deduplicator, count=count):
+            for position_id in range(count):
+                deduplicator.should_alert("Tiered Take Profit", position_id)
+
+        cases.append(BenchCase(
+            f"dedup_should_alert_after_restart[positions={size}]",
+            fn=run_warm,
+            setup=lambda count=count: _persisted_deduplicator(count),
+            params={"positions": count, "calls": count},
+            min_rounds=3 if count >= 100_000 else 5,
+        ))
+    return cases
+
+
+def _fresh_deduplicator() -> AlertDeduplicator:
+    """清空持久化的去重键，每轮都从首次认领开始"""
+    deduplicator = AlertDeduplicator()
+    deduplicator.clear()
+    return deduplicator
+
+
+def _persisted_deduplicator(count: int) -> AlertDeduplicator:
+    with session_scope() as db:
+        persisted = db.query(AlertDedupKey).count()
+    if persisted != count:
+        _fresh_deduplicator()
+        today = datetime.now(et_tz).date()
+        with session_scope() as db:
+            db.bulk_save_objects([
+                AlertDedupKey(period_key=today.isoformat(), rule_key=f"Tiered Take Profit_pos_{i}",
+                              expires_on=today)
+                for i in range(count)
+            ])
+    return AlertDeduplicator()
+
+
+def _snapshot_cases(qqq_data: Dict[str, Any]) -> List[BenchCase]:
+    market = {f"SYM{i}": dict(qqq_data, symbol=f"SYM{i}") for i in range(WATCHLIST_SIZES[-1])}
+    quotes = {i: {"price": 1.0 + i / 1000, "updated_at": datetime(2025, 3, 3, 10, 15)}
+              for i in range(POSITION_SIZES["1k"])}
+    writer = MarketSnapshot(os.path.join(_BENCH_TMP, "snapshot-bench.bin"))
+    # 读者是独立实例 (相当于另一个 worker 进程)，不共享写者的解码缓存
+    reader = MarketSnapshot(writer.path)
+    writer.publish(market, qqq_data, quotes)
+
+    def read_new(_):
+        writer.publish(market, qqq_data, quotes)
+        reader.read()
+
+    return [
+        BenchCase("snapshot_publish[positions=1k]", fn=lambda _: writer.publish(market, qqq_data, quotes),
+                  params={"positions": len(quotes), "symbols": len(market)}),
+        # 版本未变：只读头部，直接返回已解码的快照
+        BenchCase("snapshot_read[cached]", fn=lambda _: reader.read(), params={"calls": 1}),
+        BenchCase("snapshot_publish_and_read[positions=1k]", fn=read_new,
+                  params={"positions": len(quotes), "symbols": len(market)}),
+    ]
+
+
+def _trading_time_case() -> BenchCase:
+    # 一周内盘前 / 盘中 / 盘后的混合时点
+    moments = [et_tz.localize(datetime(2025, 3, d, h, 15)) for d in range(3, 8) for h in (8, 10, 15, 17)]
+
+    def run_checks(_):
+        for moment in moments:
+            is_trading_time(moment)
+
+    return BenchCase("is_trading_time[calls=20]", fn=run_checks, params={"calls": len(moments)})
+
+
+def _cycle_cases(qqq_data: Dict[str, Any], profile: str) -> List[BenchCase]:
+    cases = []
+    config = get_config({"wechat_webhook_url": ""})
+    # 最坏情况: 大盘趋势止损，所有持仓同时触发
+    worst_case = dict(qqq_data, is_below_sma200_3d=True)
+
+    fetcher = OfflineDataFetcher(worst_case)
+
+    def run_cycle(_):
+        with _offline_cycle():
+            jobs.check_qqq_and_options(fetcher, config)
+
+    for size in CYCLE_SIZES[profile]:
+        count = POSITION_SIZES[size]
+
+        def setup(count=count):
+            _load_positions(count)
+            dedup.clear_dedup()
+
+        cases.append(BenchCase(
+            f"check_qqq_and_options[positions={size}]",
+            fn=run_cycle,
+            setup=setup,
+            params={"positions": count},
+            min_rounds=1 if count >= 100_000 else 3,
+            max_rounds=3 if count >= 100_000 else 20,
+        ))
+
+    # 同样的 1k 持仓分散到多个组合：行情只取一次，组合并发检查
+    for portfolios in PORTFOLIO_SIZES:
+        def setup(portfolios=portfolios):
+            _load_positions(POSITION_SIZES["1k"], portfolios)
+            dedup.clear_dedup()
+
+        cases.append(BenchCase(
+            f"check_qqq_and_options[positions=1k,portfolios={portfolios}]",
+            fn=run_cycle,
+            setup=setup,
+            params={"positions": POSITION_SIZES["1k"], "portfolios": portfolios},
+            min_rounds=3,
+            max_rounds=20,
+        ))
+    return cases
+
+
+def build_cases(profile: str, recorded: Optional[str]) -> List[BenchCase]:
+    synthetic = {size: make_price_history(bars) for size, bars in BAR_SIZES.items()}
+    cases = _history_cases("synthetic", synthetic)
+
+    if recorded:
+        recorded_frames = {}
+        for size, bars in BAR_SIZES.items():
+            df = load_recorded_history(recorded, bars)
+            if len(df) == bars:
+                recorded_frames[size] = df
+        cases += _history_cases("recorded", recorded_frames)
+
+    cases += _bar_store_cases(synthetic)
+    cases += _indicator_cases()
+
+    qqq_data = DataFetcher(None)._process_qqq_df(synthetic["1y"].copy())
+
+    cases += _position_cases(qqq_data)
+    cases += _dedup_cases()
+    cases += _snapshot_cases(qqq_data)
+    cases.append(_trading_time_case())
+    cases += _cycle_cases(qqq_data, profile)
+    return cases
+
+
+def _calibration_case() -> BenchCase:
+    """与被测代码无关的固定负载，用来换算不同机器之间的整体速度"""
+    values = np.random.default_rng(0).standard_normal(200_000)
+
+    def run_calibration(_):
+        total = 0.0
+        for i in range(100_000):
+            total += (i % 7) * 0.5
+        buckets = {}
+        for i in range(20_000):
+            buckets[i % 97] = buckets.get(i % 97, 0) + i
+        np.convolve(values, np.ones(20) / 20, mode="valid").std()
+        np.sort(values)
+        return total
+
+    return BenchCase(CALIBRATION_CASE, run_calibration, min_rounds=10, min_time=1.0)
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float, calibration_s: Optional[float] = None,
+            baseline_calibration_s: Optional[float] = None) -> List[str]:
+    """
+    中位数耗时与基线比较；两边都有校准耗时时，把基线换算到本机速度后再比较
+
+    即 current / calibration 与 baseline / baseline_calibration 比较。
+    """
+    scale = calibration_s / baseline_calibration_s if calibration_s and baseline_calibration_s else 1.0
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base or name == CALIBRATION_CASE:
+            continue
+        expected = base["median_s"] * scale
+        ratio = current["median_s"] / expected if expected > 0 else 1.0
+        delta = current["median_s"] - expected
+        current["baseline_median_s"] = expected
+        current["ratio"] = ratio
+        if ratio > 1 + threshold and delta > NOISE_FLOOR_SECONDS:
+            regressions.append(name)
+    return regressions
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.2f}ms"
+    return f"{seconds:8.3f}s "
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="QQQ Option Alert 热路径基准测试")
+    parser.add_argument("--profile", choices=sorted(CYCLE_SIZES), default="quick")
+    parser.add_argument("--recorded", help="录制的日线 CSV (Date,Open,High,Low,Close[,Volume])")
+    parser.add_argument("--filter", default="", help="只运行名称包含该子串的用例")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的回归比例 (0.25 = 慢 25%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    # 只测计算本身，避免 INFO 日志刷屏影响计时
+    logging.disable(logging.INFO)
+    init_db()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    calibration = _calibration_case().run()
+    print(f"{CALIBRATION_CASE:<55} {_format_seconds(calibration['median_s'])} (rounds={calibration['rounds']})")
+    for case in build_cases(args.profile, args.recorded):
+        if args.filter and args.filter not in case.name:
+            continue
+        results[case.name] = case.run()
+        print(f"{case.name:<55} {_format_seconds(results[case.name]['median_s'])} "
+              f"(rounds={results[case.name]['rounds']})")
+
+    baseline: Dict[str, Dict[str, Any]] = {}
+    baseline_calibration_s = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved.get("results", {})
+        baseline_calibration_s = saved.get("meta", {}).get("calibration_s")
+        if baseline and not baseline_calibration_s and not args.update_baseline:
+            print("[WARN] Baseline has no calibration timing, comparing absolute timings "
+                  "(regenerate it on this machine with --update-baseline)")
+
+    regressions = [] if args.update_baseline else compare(
+        results, baseline, args.threshold, calibration["median_s"], baseline_calibration_s)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "profile": args.profile,
+            "threshold": args.threshold,
+            "calibration_s": calibration["median_s"],
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": report["meta"], "results": merged}, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    for name in regressions:
+        current = results[name]
+        print(f"[REGRESSION] {name}: {_format_seconds(current['median_s']).strip()} vs "
+              f"baseline {_format_seconds(current['baseline_median_s']).strip()} (scaled to this machine) "
+              f"(x{current['ratio']:.2f})")
+
+    if regressions:
+        return 1
+    print("No regressions against baseline" if baseline else "No baseline found, skipped comparison")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+基准测试用的合成数据 / 录制数据加载
+
+- 行情: 几何随机游走生成的日线 OHLCV，按交易日 (工作日) 排列，与 yfinance history() 同构
+- 持仓: 轻量对象，字段与 OptionPosition 一致，可直接喂给 option_rules
+"""
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import List, Optional
+import random
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS_PER_YEAR = 252
+
+# 参数化规模: 1y / 10y / 25y 日线
+BAR_SIZES = {
+    "1y": 1 * TRADING_DAYS_PER_YEAR,
+    "10y": 10 * TRADING_DAYS_PER_YEAR,
+    "25y": 25 * TRADING_DAYS_PER_YEAR,
+}
+
+# 参数化规模: 10 / 1k / 100k 持仓
+POSITION_SIZES = {
+    "10": 10,
+    "1k": 1_000,
+    "100k": 100_000,
+}
+
+
+def make_price_history(bars: int, seed: int = 42, start_price: float = 100.0,
+                       end: Optional[date] = None) -> pd.DataFrame:
+    """生成 bars 根日线，索引为交易日 (工作日)，最后一根落在 end"""
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+    index = pd.bdate_range(end=pd.Timestamp(end), periods=bars, name="Date")
+
+    # 年化 ~20% 波动、~10% 漂移的几何随机游走
+    returns = rng.normal(0.10 / TRADING_DAYS_PER_YEAR, 0.20 / np.sqrt(TRADING_DAYS_PER_YEAR), bars)
+    close = start_price * np.exp(np.cumsum(returns))
+    spread = np.abs(rng.normal(0, 0.006, bars)) * close
+    open_ = close * (1 + rng.normal(0, 0.003, bars))
+
+    return pd.DataFrame({
+        "Open": open_,
+        "High": np.maximum(open_, close) + spread,
+        "Low": np.minimum(open_, close) - spread,
+        "Close": close,
+        "Volume": rng.integers(20_000_000, 80_000_000, bars).astype(float),
+    }, index=index)
+
+
+def load_recorded_history(path: str, bars: Optional[int] = None) -> pd.DataFrame:
+    """
+    加载录制的日线 CSV (例如 yfinance `history().to_csv()` 的输出)
+
+    需要包含 Date, Open, High, Low, Close 列，Volume 可选。
+    bars 不为空时只取最后 bars 根。
+    """
+    df = pd.read_csv(path)
+    df["Date"] = pd.to_datetime(df["Date"], utc=True).dt.tz_convert(None).dt.normalize()
+    df = df.set_index("Date").sort_index()
+    columns = [c for c in ("Open", "High", "Low", "Close", "Volume") if c in df.columns]
+    df = df[columns].astype(float)
+    if bars is not None:
+        df = df.iloc[-bars:]
+    return df
+
+
+def make_positions(count: int, seed: int = 7, today: Optional[date] = None) -> List[SimpleNamespace]:
+    """生成 count 个 LEAPS Call 持仓，入场时间/到期日/价格分布覆盖所有出场分支"""
+    rnd = random.Random(seed)
+    today = today or date.today()
+    positions = []
+    for i in range(count):
+        entry_date = today - timedelta(days=rnd.randint(1, 330))
+        expiration_date = entry_date + timedelta(days=rnd.randint(300, 420))
+        positions.append(SimpleNamespace(
+            id=i + 1,
+            underlying="QQQ",
+            option_type="CALL",
+            strike_price=float(rnd.randint(400, 650)),
+            expiration_date=expiration_date,
+            entry_price=round(rnd.uniform(40.0, 120.0), 2),
+            quantity=rnd.randint(1, 5),
+            entry_date=entry_date,
+            current_price=None,
+            last_price_update=None,
+            max_profit=round(rnd.uniform(0.0, 0.8), 4),
+        ))
+    return positions
+
+
+def make_option_price(position, seed: int = 11) -> float:
+    """为持仓给出一个确定性的现价 (-60% ~ +150% 盈亏区间)"""
+    rnd = random.Random(seed * 1_000_003 + position.id)
+    return round(position.entry_price * rnd.uniform(0.4, 2.5), 2)
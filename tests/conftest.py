@@ -0,0 +1,26 @@
+"""
+测试使用临时目录中的数据库、K 线存储和行情快照 (需在导入 app 之前设置环境变量)
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="qqq-alert-test-")
+os.environ.setdefault("DATABASE_PATH", os.path.join(_tmp, "test.db"))
+os.environ.setdefault("BAR_STORE_PATH", os.path.join(_tmp, "bars"))
+os.environ.setdefault("MARKET_SNAPSHOT_PATH", os.path.join(_tmp, "market.snapshot"))
+
+import pytest  # noqa: E402
+
+from app.database.init_db import init_db, session_scope  # noqa: E402
+from app.database.models import Base  # noqa: E402
+
+init_db()
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    """每个测试前清空所有表"""
+    with session_scope() as db:
+        for table in reversed(Base.metadata.sorted_tables):
+            db.execute(table.delete())
+    yield
@@ -0,0 +1,47 @@
+from datetime import date
+
+import pandas as pd
+
+from app.market import backfill
+from app.market.bar_store import BarStore
+from app.scheduler.trading_hours import trading_sessions
+
+
+class ListedProvider:
+    """只有 listed_on 之后才有日线的数据源"""
+
+    def __init__(self, listed_on: date):
+        self.listed_on = listed_on
+        self.requests = []
+
+    def get_daily_bars(self, ticker, start, end):
+        self.requests.append((start, end))
+        days = [pd.Timestamp(day) for day in trading_sessions(max(start, self.listed_on), end)]
+        return pd.DataFrame({"Open": 10.0, "High": 11.0, "Low": 9.0, "Close": 10.5, "Volume": 1000.0},
+                            index=pd.DatetimeIndex(days, name="Date"))
+
+
+def test_sessions_before_listing_are_not_gaps(tmp_path):
+    store = BarStore(str(tmp_path / "bars"))
+    provider = ListedProvider(date(2025, 6, 2))
+    start, end = date(2025, 1, 2), date(2025, 9, 30)
+
+    report = backfill.backfill(store, "NEWCO", start, end, yfinance_client=provider)
+    assert report.missing_after == 0
+    assert store.first_available("NEWCO") == date(2025, 6, 2)
+
+    # 下一次补缺不再请求上市前的区间
+    report = backfill.backfill(store, "NEWCO", start, end, yfinance_client=provider)
+    assert report.missing_before == 0 and report.requests == 0
+    assert len(provider.requests) == 1
+
+
+def test_gap_at_start_of_stored_history_is_still_fetched(tmp_path):
+    store = BarStore(str(tmp_path / "bars"))
+    provider = ListedProvider(date(2020, 1, 2))
+    # 存储中只有近期日线：更早的部分是真实缺口，不是上市前
+    store.write("OLDCO", provider.get_daily_bars("OLDCO", date(2025, 6, 2), date(2025, 9, 30)))
+
+    report = backfill.backfill(store, "OLDCO", date(2025, 1, 2), date(2025, 9, 30), yfinance_client=provider)
+    assert report.missing_before > 0 and report.missing_after == 0
+    assert store.first_available("OLDCO") is None
@@ -0,0 +1,35 @@
+from app.alerts.dedup import AlertDeduplicator
+from app.database.init_db import read_session_scope
+from app.database.models import AlertDedupKey
+
+
+def test_claimed_keys_survive_restart():
+    assert AlertDeduplicator().should_alert("rule", 1) is True
+    assert AlertDeduplicator().should_alert_weekly("weekly_rule") is True
+
+    # 重启：新实例的缓存为空，从数据库载入本周期已发送的键
+    restarted = AlertDeduplicator()
+    assert restarted.should_alert("rule", 1) is False
+    assert restarted.should_alert_weekly("weekly_rule") is False
+    assert restarted.should_alert("rule", 2) is True
+
+
+def test_concurrent_claim_has_single_winner():
+    first, second = AlertDeduplicator(), AlertDeduplicator()
+    # 两个进程都在对方认领前载入了 (空的) 周期缓存
+    first._check_and_mark(first.daily_rules, "2026-01-05", "other")
+    second._check_and_mark(second.daily_rules, "2026-01-05", "other")
+
+    results = [dedup._check_and_mark(dedup.daily_rules, "2026-01-05", "rule", 1)
+               for dedup in (first, second)]
+
+    assert results == [True, False]
+    with read_session_scope() as db:
+        assert db.query(AlertDedupKey).filter_by(period_key="2026-01-05", rule_key="rule_pos_1").count() == 1
+
+
+def test_in_memory_dedup_when_not_persistent():
+    dedup = AlertDeduplicator(persistent=False)
+    assert dedup.should_alert("rule") is True
+    assert dedup.should_alert("rule") is False
+    assert AlertDeduplicator(persistent=False).should_alert("rule") is True
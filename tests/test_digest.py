@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.alerts import digest, option_rules
+from app.notification.wechat import WeChatNotifier
+
+
+def _time_stop_alert(position_id: int, dte: int):
+    today = datetime.now(option_rules.et_tz).date()
+    position = SimpleNamespace(id=position_id, underlying="QQQ", option_type="CALL", strike_price=400 + position_id,
+                               expiration_date=today + timedelta(days=dte), entry_date=today - timedelta(days=30),
+                               entry_price=50.0, max_profit=0.0)
+    alert = next(alert for alert in option_rules.check_position_signals(position, 50.0, {})["alerts"]
+                 if alert["rule_name"] == "Time Stop (90 DTE)")
+    alert.update(position_id=position_id, portfolio_id=1,
+                 position_ticker=option_rules.format_position_ticker(position),
+                 option_symbol=option_rules.format_option_symbol(position))
+    return alert
+
+
+def test_digest_keeps_per_position_time_stop_text():
+    pending = digest.AlertDigest()
+    pending.add(_time_stop_alert(1, 80))
+    pending.add(_time_stop_alert(2, 30))
+
+    [merged] = pending.drain()
+    assert merged["digest"] and merged["position_ids"] == [1, 2]
+    # 各持仓的 DTE 不同，顶层不能只保留第一条的文本
+    assert merged["message"] == "" and merged["trigger_condition"] == ""
+    by_id = {position["position_id"]: position for position in merged["positions"]}
+    assert by_id[1]["dte"] == 80 and by_id[1]["trigger_condition"] == "DTE 80 <= 90"
+    assert by_id[2]["dte"] == 30 and "仅剩 30 天" in by_id[2]["message"]
+
+    text = WeChatNotifier("").format_option_digest(merged)
+    assert "DTE 80 <= 90" in text and "DTE 30 <= 90" in text
+
+
+def test_digest_shares_identical_trend_stop_text():
+    alerts = []
+    for position_id in (1, 2):
+        alert = {"rule_name": "QQQ SMA200 Stop Loss", "alert_type": "OPTION_STOP_LOSS",
+                 "message": "trend stop", "trigger_condition": "QQQ < SMA200 for 3 days",
+                 "position_id": position_id, "position_ticker": f"P{position_id}"}
+        alerts.append(alert)
+    merged = digest.merge(alerts)
+    assert merged["message"] == "trend stop"
+    assert WeChatNotifier("").format_option_digest(merged).count("QQQ < SMA200 for 3 days") == 1
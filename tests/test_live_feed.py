@@ -0,0 +1,20 @@
+import asyncio
+
+from app.market.live_feed import LiveFeed
+
+
+def test_unstarted_subscription_does_not_leak_slot():
+    async def main():
+        feed = LiveFeed()
+        # 客户端在响应开始前断开：生成器从未迭代就被关闭
+        stream = await feed.subscribe()
+        await stream.aclose()
+        assert feed.clients == 0
+
+        stream = await feed.subscribe()
+        assert (await stream.__anext__()).startswith("retry:")
+        assert feed.clients == 1
+        await stream.aclose()
+        assert feed.clients == 0
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import time
+
+from app.database.init_db import read_session_scope, session_scope
+from app.database.models import AlertLog, NotificationOutbox
+from app.database.write_buffer import WriteBuffer
+from app.notification import channels, outbox
+
+
+def _enqueue(destination: str, channel: str = "file", rule_name: str = "r") -> int:
+    alert = {"alert_type": "OPTION_TIME", "rule_name": rule_name, "position_id": 1}
+    buffer = WriteBuffer()
+    buffer.add_alert_log(alert, None, notifications=[
+        outbox.build_notification(alert, "text", destination, "2026-01-05", channel)
+    ])
+    with read_session_scope() as db:
+        return db.query(NotificationOutbox.id).order_by(NotificationOutbox.id.desc()).first()[0]
+
+
+def _row(outbox_id: int) -> NotificationOutbox:
+    with read_session_scope() as db:
+        return db.get(NotificationOutbox, outbox_id)
+
+
+def test_stopped_dispatcher_releases_claim_without_counting_attempt(tmp_path):
+    outbox_id = _enqueue(str(tmp_path / "alerts.jsonl"))
+    dispatcher = outbox.OutboxDispatcher()
+    dispatcher._stop.set()
+
+    dispatcher.dispatch_once()
+
+    row = _row(outbox_id)
+    assert row.status == "pending" and row.attempts == 0
+    assert row.next_attempt_at <= time.time()
+
+
+def test_claim_is_renewed_while_delivering(tmp_path, monkeypatch):
+    outbox_id = _enqueue("slow-destination", channel="slow")
+    seen = {}
+
+    def slow_sender(destination, rows):
+        time.sleep(0.3)
+        # 超过初始租约后仍在投递：租约已被续期，其他 dispatcher 认领不到
+        seen["claimable"] = outbox.OutboxDispatcher()._claim(outbox_id)
+        return [(True, None)] * len(rows)
+
+    monkeypatch.setitem(channels.SENDERS, "slow", slow_sender)
+    monkeypatch.setattr(outbox, "CLAIM_SECONDS", 0.2)
+    monkeypatch.setattr(outbox, "CLAIM_RENEW_SECONDS", 0.05)
+
+    outbox.OutboxDispatcher().dispatch_once()
+
+    assert seen["claimable"] is False
+    row = _row(outbox_id)
+    assert row.status == "sent" and row.attempts == 1
+
+
+def test_claim_is_exclusive(tmp_path):
+    outbox_id = _enqueue(str(tmp_path / "alerts.jsonl"))
+
+    assert outbox.OutboxDispatcher()._claim(outbox_id) is True
+    assert outbox.OutboxDispatcher()._claim(outbox_id) is False
+    row = _row(outbox_id)
+    assert row.attempts == 0 and row.next_attempt_at > time.time()
+
+
+def test_failed_delivery_backs_off(monkeypatch):
+    outbox_id = _enqueue("broken-destination", channel="broken")
+    monkeypatch.setitem(channels.SENDERS, "broken", lambda destination, rows: [(False, "HTTP 500")] * len(rows))
+
+    before = time.time()
+    outbox.OutboxDispatcher().dispatch_once()
+
+    row = _row(outbox_id)
+    assert row.status == "pending" and row.attempts == 1 and row.last_error == "HTTP 500"
+    assert before + outbox.backoff_seconds(1) <= row.next_attempt_at <= time.time() + outbox.backoff_seconds(1)
+    # 退避期间不再投递
+    assert outbox.OutboxDispatcher()._claim(outbox_id) is False
+    assert [outbox.backoff_seconds(n) for n in (1, 2, 3)] == [5.0, 10.0, 20.0]
+    assert outbox.backoff_seconds(20) == outbox.BACKOFF_MAX_SECONDS
+
+
+def test_last_attempt_dead_letters(monkeypatch):
+    outbox_id = _enqueue("broken-destination", channel="broken")
+    monkeypatch.setitem(channels.SENDERS, "broken", lambda destination, rows: [(False, "HTTP 500")] * len(rows))
+    with session_scope() as db:
+        db.get(NotificationOutbox, outbox_id).attempts = outbox.MAX_ATTEMPTS - 1
+
+    outbox.OutboxDispatcher().dispatch_once()
+
+    row = _row(outbox_id)
+    assert row.status == "dead" and row.attempts == outbox.MAX_ATTEMPTS
+    with read_session_scope() as db:
+        log = db.get(AlertLog, row.alert_log_id)
+        assert log.sent_successfully is False
+        assert "gave up after" in log.error_message
+        assert outbox.summary(db)["counts"]["dead"] == 1
+
+
+def test_duplicate_idempotency_key_drops_duplicate_log(tmp_path):
+    destination = str(tmp_path / "alerts.jsonl")
+    first = _enqueue(destination)
+    second = _enqueue(destination)
+
+    assert first == second
+    with read_session_scope() as db:
+        assert db.query(NotificationOutbox).count() == 1
+        assert db.query(AlertLog).count() == 1
+        assert db.query(AlertLog.id).scalar() == _row(first).alert_log_id
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import threading
+
+from app.monitoring import profiler
+from app.monitoring.profiler import Profiler, ProfilingMiddleware
+
+
+def _profiles(directory, extension):
+    return [name for name in os.listdir(directory) if name.endswith(extension)]
+
+
+def test_overlapping_requests_in_cprofile_window(tmp_path, monkeypatch):
+    instance = Profiler(profile_dir=str(tmp_path / "profiles"))
+    instance.start(60, mode="cprofile", route_prefixes=["/slow"])
+    monkeypatch.setattr(profiler, "_profiler", instance)
+
+    async def app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def request(middleware):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware({"type": "http", "method": "GET", "path": "/slow"}, None, send)
+        return sent[0]["status"]
+
+    async def main():
+        middleware = ProfilingMiddleware(app)
+        return await asyncio.gather(request(middleware), request(middleware))
+
+    # 两个请求同时在事件循环上执行：都成功；路由剖析总是采样所有线程，不启用 cProfile
+    assert asyncio.run(main()) == [200, 200]
+    assert len(_profiles(instance.profile_dir, ".folded")) == 2
+    assert not _profiles(instance.profile_dir, ".pstats")
+
+
+def test_overlapping_cprofile_jobs(tmp_path):
+    instance = Profiler(profile_dir=str(tmp_path / "profiles"))
+    instance.start(60, mode="cprofile")
+    entered, release = threading.Barrier(2), threading.Event()
+
+    def job():
+        with instance.profile("job-test"):
+            entered.wait()
+            release.wait()
+
+    threads = [threading.Thread(target=job) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # 同一时刻只有一个 cProfile：后进入的任务照常执行但不剖析
+    assert len(_profiles(instance.profile_dir, ".pstats")) == 1
+
+
+def test_window_is_shared_between_processes(tmp_path):
+    directory = str(tmp_path / "profiles")
+    admin_worker, leader_worker = Profiler(profile_dir=directory), Profiler(profile_dir=directory)
+    assert not leader_worker.is_active()
+
+    admin_worker.start(60, mode="cprofile")
+    leader_worker._sync_window(force=True)
+    assert leader_worker.is_active() and leader_worker.mode == "cprofile"
+
+    admin_worker.stop()
+    leader_worker._sync_window(force=True)
+    assert not leader_worker.is_active()
@@ -0,0 +1,114 @@
+from datetime import date, datetime, timedelta
+
+from app.database.init_db import read_session_scope, session_scope
+from app.database.models import AlertLog, OptionPosition
+from app.database.write_buffer import WriteBuffer
+from app.notification import outbox
+
+
+def _add_position(strike: float) -> int:
+    with session_scope() as db:
+        position = OptionPosition(underlying="QQQ", option_type="CALL", strike_price=strike,
+                                  expiration_date=date.today() + timedelta(days=400), entry_price=50.0,
+                                  quantity=1, entry_date=date.today())
+        db.add(position)
+        db.flush()
+        return position.id
+
+
+def test_flush_skips_position_deleted_while_buffered():
+    kept, deleted = _add_position(400), _add_position(410)
+    buffer = WriteBuffer()
+    now = datetime(2026, 1, 5, 10, 0)
+
+    with buffer.batch():
+        buffer.record_price(kept, 55.0, now)
+        buffer.record_price(deleted, 60.0, now)
+        buffer.record_max_profit(deleted, 0.2)
+        buffer.add_alert_log({"alert_type": "OPTION_TAKE_PROFIT", "rule_name": "r", "position_id": kept}, True)
+        # 持仓在缓冲期间被删除 (不经过 delete_position，模拟它与 flush 的竞争)
+        with session_scope() as db:
+            db.query(OptionPosition).filter(OptionPosition.id == deleted).delete()
+
+    assert buffer.pending() == 0
+    with read_session_scope() as db:
+        assert db.get(OptionPosition, kept).current_price == 55.0
+        assert db.get(OptionPosition, deleted) is None
+        assert db.query(AlertLog).count() == 1
+
+    # 之后的周期照常写入
+    buffer.record_price(kept, 56.0, now + timedelta(minutes=5))
+    assert buffer.pending() == 0
+    with read_session_scope() as db:
+        assert db.get(OptionPosition, kept).current_price == 56.0
+
+
+def test_discard_position_drops_buffered_rows():
+    position_id = _add_position(420)
+    buffer = WriteBuffer()
+    with buffer.batch():
+        buffer.record_price(position_id, 55.0, datetime(2026, 1, 5, 10, 0))
+        buffer.discard_position(position_id)
+        assert buffer.pending() == 0
+
+
+def test_data_error_keeps_alert_logs(monkeypatch):
+    from app.database import write_buffer as module
+    from app.database.models import NotificationOutbox
+
+    position_id = _add_position(430)
+    buffer = WriteBuffer()
+
+    def broken(db, rows):
+        raise ValueError("bad price history chunk")
+
+    monkeypatch.setattr(module.price_history, "append_chunks", broken)
+    alert = {"alert_type": "OPTION_TIME", "rule_name": "r", "position_id": position_id}
+    notification = outbox.build_notification(alert, "text", "https://hook", "2026-01-05")
+    try:
+        with buffer.batch():
+            buffer.record_price(position_id, 55.0, datetime(2026, 1, 5, 10, 0))
+            buffer.add_alert_log(alert, None, notifications=[notification])
+    except ValueError:
+        pass
+
+    # 只有价格历史被丢弃，持仓现价、报警日志和待投递通知照常写入
+    assert buffer.pending() == 0
+    with read_session_scope() as db:
+        assert db.get(OptionPosition, position_id).current_price == 55.0
+        assert db.query(AlertLog).count() == 1
+        assert db.query(NotificationOutbox).count() == 1
+
+
+def test_batch_depth_is_per_thread():
+    import threading
+
+    position_id = _add_position(440)
+    buffer = WriteBuffer()
+    at = datetime(2026, 1, 5, 10, 0)
+
+    with buffer.batch():
+        # 另一个线程 (如 Web 请求) 在 batch 外的写入立即落库
+        writer = threading.Thread(target=buffer.record_price, args=(position_id, 57.0, at))
+        writer.start()
+        writer.join()
+        with read_session_scope() as db:
+            assert db.get(OptionPosition, position_id).current_price == 57.0
+
+        buffer.record_price(position_id, 58.0, at + timedelta(minutes=1))
+        assert buffer.pending() > 0
+    assert buffer.pending() == 0
+
+
+def test_price_points_for_deleted_position_are_skipped():
+    from app.database.models import PositionPriceChunk
+
+    position_id = _add_position(450)
+    buffer = WriteBuffer()
+    with buffer.batch():
+        buffer.add_price_point(position_id, 55.0, datetime(2026, 1, 5, 10, 0))
+        with session_scope() as db:
+            db.query(OptionPosition).filter(OptionPosition.id == position_id).delete()
+
+    with read_session_scope() as db:
+        assert db.query(PositionPriceChunk).filter(PositionPriceChunk.position_id == position_id).count() == 0